@@ -0,0 +1,86 @@
+"""
+Audio Codec Benchmark
+Encodes and decodes a synthetic voice-like signal with every registered codec and
+reports CPU time per chunk, bitrate on the wire, and signal-to-noise after a round trip
+of a stream of chunks. A 300 Hz tone streamed through each codec chunk after chunk shows whether chunk
+boundaries click: the largest error within BOUNDARY samples of a chunk edge against
+the largest error elsewhere, with the codec keeping its per-stream state and without.
+
+Usage: python benchmarks/bench_audio_codec.py [--iterations 2000]
+"""
+
+import argparse
+import timeit
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from shared.audio_codec import CODECS
+
+BOUNDARY = 4
+
+def voice_signal(chunks):
+    """A few harmonics under 4 kHz plus a little noise, at speech level."""
+    t = np.arange(AUDIO_CHUNK * chunks) / AUDIO_RATE
+    signal = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate([180, 360, 720, 1500, 3100]))
+    signal += np.random.default_rng(0).normal(0, 0.02, len(t))
+    return (signal / np.abs(signal).max() * 8000).astype(np.int16)
+
+def tone_signal(chunks):
+    t = np.arange(AUDIO_CHUNK * chunks) / AUDIO_RATE
+    return (8000 * np.sin(2 * np.pi * 300 * t)).astype(np.int16)
+
+def round_trip(codec, signal, stateful):
+    """
+    Stream a signal through the codec chunk by chunk; return (original, decoded) as
+    float arrays lined up for the codec's delay, without the first chunk.
+    """
+    encode_state, decode_state = ({}, {}) if stateful else (None, None)
+    decoded = np.concatenate([
+        np.frombuffer(codec.decode(codec.encode(signal[i:i + AUDIO_CHUNK].tobytes(), encode_state), decode_state),
+                      dtype=np.int16) for i in range(0, len(signal), AUDIO_CHUNK)
+    ]).astype(np.float64)
+    signal = signal.astype(np.float64)
+    # Codecs may delay the signal by a few samples
+    delay = min(range(8), key=lambda d: np.abs(decoded[AUDIO_CHUNK + d:] - signal[AUDIO_CHUNK:len(signal) - d]).mean())
+    return signal[AUDIO_CHUNK:len(signal) - delay], decoded[AUDIO_CHUNK + delay:]
+
+def snr_db(reference, decoded):
+    """Signal-to-noise ratio of decoded audio against the original, in dB."""
+    noise = reference - decoded
+    if not noise.any():
+        return float('inf')
+    return 10 * np.log10((reference ** 2).sum() / (noise ** 2).sum())
+
+def boundary_errors(reference, decoded):
+    """(max error within BOUNDARY samples of a chunk edge, max error elsewhere), for round_trip output."""
+    error = np.abs(reference - decoded)
+    position = np.arange(len(error)) % AUDIO_CHUNK
+    edge = (position < BOUNDARY) | (position >= AUDIO_CHUNK - BOUNDARY)
+    return error[edge].max(), error[~edge].max()
+
+def bench(iterations):
+    pcm = voice_signal(1).tobytes()
+    chunks_per_second = AUDIO_RATE / AUDIO_CHUNK
+    print(f"{'codec':10} {'payload':>8} {'wire kbit/s':>12} {'encode us':>10} {'decode us':>10} {'snr dB':>7} "
+          f"{'edge/inner err':>15} {'stateless':>12}")
+    for codec in CODECS.values():
+        encode_state, decode_state = {}, {}
+        payload = codec.encode(pcm)
+        packet = encode_message(MSG_AUDIO, payload=payload, flags=codec.codec_id)
+        encode_us = timeit.timeit(lambda: codec.encode(pcm, encode_state), number=iterations) / iterations * 1e6
+        decode_us = timeit.timeit(lambda: codec.decode(payload, decode_state), number=iterations) / iterations * 1e6
+        kbps = len(packet) * 8 * chunks_per_second / 1000
+        snr = snr_db(*round_trip(codec, voice_signal(40), True))
+        stream = '%.0f/%.0f' % boundary_errors(*round_trip(codec, tone_signal(80), True))
+        stateless = '%.0f/%.0f' % boundary_errors(*round_trip(codec, tone_signal(80), False))
+        print(f"{codec.name:10} {len(payload):8} {kbps:12.1f} {encode_us:10.1f} {decode_us:10.1f} "
+              f"{snr:7.1f} {stream:>15} {stateless:>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    bench(args.iterations)
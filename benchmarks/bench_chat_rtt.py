@@ -0,0 +1,175 @@
+"""
+Chat Latency During Screen Sharing Benchmark
+Measures chat round-trip time for a viewer whose downlink is a simulated slow link
+while a presenter streams large screen frames, with screen frames sent inline on the
+control connection (the previous design) versus on the dedicated screen channel,
+and with no presentation as a baseline.
+
+The viewer pings an echo client every 200 ms over chat; the echo client answers at
+once, so the round trip is dominated by whatever queues ahead of the answer on the
+viewer's side.
+
+Usage: python benchmarks/bench_chat_rtt.py [--seconds 10] [--link-mbps 20] [--frame-kb 300] [--engine threaded]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import threading
+import time
+import numpy as np
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from benchmarks.bench_server_engines import wait_for_port
+
+FRAME_INTERVAL = 0.1
+PING_INTERVAL = 0.2
+
+class Link:
+    """A token bucket shared by every connection of one client, standing in for its downlink."""
+    
+    def __init__(self, mbps):
+        self.seconds_per_byte = 8 / (mbps * 1e6)
+        self.free_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def consume(self, num_bytes):
+        with self.lock:
+            self.free_at = max(self.free_at, time.monotonic()) + num_bytes * self.seconds_per_byte
+            delay = self.free_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+class BenchClient:
+    """A registered control connection, optionally with a screen channel."""
+    
+    def __init__(self, username, screen_channel, link=None):
+        self.username = username
+        self.sender_id = user_id(username)
+        self.link = link
+        self.running = True
+        self.control = socket.create_connection(('127.0.0.1', TCP_PORT))
+        self.send(self.control, MSG_REGISTER, {'username': username, 'screen_channel': screen_channel})
+        self.screen = None
+        if screen_channel:
+            time.sleep(0.2)
+            self.screen = socket.create_connection(('127.0.0.1', SCREEN_PORT))
+            self.send(self.screen, MSG_REGISTER, {'username': username})
+        self.screen_bytes = 0
+    
+    def send(self, sock, msg_type, meta, payload=b'', flags=0):
+        sock.sendall(encode_message(msg_type, meta, payload, sender_id=self.sender_id, flags=flags))
+    
+    def read(self, sock, on_message):
+        """Read frames from one connection, paying for every byte on the client's link."""
+        buffer = b''
+        try:
+            while self.running:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                if self.link:
+                    self.link.consume(len(data))
+                buffer += data
+                while len(buffer) >= HEADER_SIZE and len(buffer) >= HEADER_SIZE + frame_body_size(buffer):
+                    size = HEADER_SIZE + frame_body_size(buffer)
+                    message = decode_message(buffer[:size])
+                    buffer = buffer[size:]
+                    if message['type'] == MSG_SCREEN_FRAME:
+                        self.screen_bytes += size
+                    on_message(message)
+        except OSError:
+            pass
+    
+    def start_reading(self, on_message):
+        for sock in (self.control, self.screen):
+            if sock:
+                threading.Thread(target=self.read, args=(sock, on_message), daemon=True).start()
+    
+    def close(self):
+        self.running = False
+        for sock in (self.control, self.screen):
+            if sock:
+                sock.close()
+
+def run_mode(engine, seconds, link_mbps, frame_kb, presenting, screen_channel):
+    """Return (ping round-trip times, viewer's received screen bytes)."""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', engine],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(TCP_PORT)
+        presenter = BenchClient('presenter', screen_channel)
+        viewer = BenchClient('viewer', screen_channel, Link(link_mbps))
+        echo = BenchClient('echo', False)
+        presenter.start_reading(lambda message: None)
+        
+        def answer(message):
+            if message['type'] == MSG_CHAT and 'ping' in message:
+                echo.send(echo.control, MSG_CHAT, {'username': 'echo', 'message': 'pong',
+                                                   'pong': message['ping'], 'sent': message['sent']})
+        echo.start_reading(answer)
+        
+        round_trips = []
+        def collect(message):
+            if message['type'] == MSG_CHAT and 'pong' in message:
+                round_trips.append(time.time() - message['sent'])
+        viewer.start_reading(collect)
+        time.sleep(0.5)
+        
+        def present():
+            channel = presenter.screen or presenter.control
+            presenter.send(channel, MSG_SCREEN_START, {'username': 'presenter'})
+            payload = os.urandom(frame_kb * 1024)
+            keyframe_every = int(SCREEN_KEYFRAME_INTERVAL / FRAME_INTERVAL)
+            index = 0
+            while presenter.running:
+                flags = SCREEN_FLAG_KEYFRAME if index % keyframe_every == 0 else 0
+                presenter.send(channel, MSG_SCREEN_FRAME, {'username': 'presenter', 'width': SCREEN_WIDTH,
+                                                           'height': SCREEN_HEIGHT, 'rects': []}, payload, flags)
+                index += 1
+                time.sleep(FRAME_INTERVAL)
+        if presenting:
+            threading.Thread(target=present, daemon=True).start()
+        
+        until = time.time() + seconds
+        ping = 0
+        while time.time() < until:
+            viewer.send(viewer.control, MSG_CHAT, {'username': 'viewer', 'message': 'ping',
+                                                   'ping': ping, 'sent': time.time()})
+            ping += 1
+            time.sleep(PING_INTERVAL)
+        time.sleep(1)
+        for client in (presenter, viewer, echo):
+            client.close()
+        return round_trips, viewer.screen_bytes
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--link-mbps', type=float, default=20, help="viewer downlink")
+    parser.add_argument('--frame-kb', type=int, default=300, help="screen frame size")
+    parser.add_argument('--engine', default='threaded')
+    args = parser.parse_args()
+    
+    offered = args.frame_kb * 1024 * 8 / FRAME_INTERVAL / 1e6
+    print(f"viewer link={args.link_mbps:.0f} Mbit/s, screen frames {args.frame_kb} KB every "
+          f"{FRAME_INTERVAL * 1000:.0f} ms ({offered:.1f} Mbit/s offered), engine={args.engine}")
+    print(f"{'mode':36} {'pings':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'screen Mbit/s':>14}")
+    modes = [('no presentation', False, True),
+             ('screen frames on control connection', True, False),
+             ('dedicated screen channel', True, True)]
+    for label, presenting, screen_channel in modes:
+        round_trips, screen_bytes = run_mode(args.engine, args.seconds, args.link_mbps, args.frame_kb,
+                                             presenting, screen_channel)
+        rtt = np.array(round_trips) * 1000 if round_trips else np.array([np.nan])
+        print(f"{label:36} {len(round_trips):5} {np.percentile(rtt, 50):8.1f} {np.percentile(rtt, 95):8.1f} "
+              f"{rtt.max():8.1f} {screen_bytes * 8 / args.seconds / 1e6:14.1f}")
@@ -0,0 +1,120 @@
+"""
+File Receive Benchmark
+Feeds a file's MSG_FILE_DATA chunks, decoded from the wire format as the client's
+receive loop does, to the previous receiver (8 KB chunks, every one kept in a dict,
+received bytes re-summed on every chunk, the file written out at the end) and to the
+current one (FILE_CHANNEL_CHUNK chunks, each checked against the file's manifest and
+written at its offset into a preallocated '.part' file, renamed into place when
+complete). Reports receiver time, throughput and peak memory of each, every run in a
+fresh process, and checks the saved file byte for byte.
+
+The previous receiver is quadratic in the number of chunks, so it runs at the smaller
+sizes given; the current one also receives a 2 GB file.
+
+Usage: python benchmarks/bench_file_receive.py [--previous-mb 32,64,128] [--current-mb 128,2048]
+"""
+
+import argparse
+import hashlib
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.file_transfer import FileTransfer
+from shared.file_io import chunk_digest, manifest_id
+
+FILENAME = 'build-artifacts.tar'
+CHUNK_SIZE = 8192                         # what the previous sender sent per frame
+POOL_BYTES = 512 * 1024
+
+class PreviousFileTransfer:
+    """The receive side before: chunks buffered in memory until the file is complete."""
+    
+    def __init__(self):
+        self.available_files = {}
+    
+    def receive_file_meta(self, message):
+        self.available_files[message.get('filename')] = {'size': message.get('filesize'), 'received_data': {}}
+    
+    def receive_file_data(self, message):
+        filename = message.get('filename')
+        self.available_files[filename]['received_data'][message.get('offset')] = message['payload']
+        total_received = sum(len(d) for d in self.available_files[filename]['received_data'].values())
+        if total_received >= self.available_files[filename]['size']:
+            self.save_file(filename)
+    
+    def save_file(self, filename):
+        os.makedirs(FILE_DOWNLOAD_DIR, exist_ok=True)
+        file_info = self.available_files[filename]
+        with open(os.path.join(FILE_DOWNLOAD_DIR, filename), 'wb') as f:
+            for offset in sorted(file_info['received_data'].keys()):
+                f.write(file_info['received_data'][offset])
+
+def chunks(size, pool):
+    """Yield (offset, chunk) for a size-byte file built from a pool of random chunks."""
+    for index, offset in enumerate(range(0, size, len(pool[0]))):
+        yield offset, pool[index % len(pool)][:size - offset]
+
+def receive(mode, size):
+    """Run one receiver in this process; print receiver seconds, peak RSS in MB and whether the file matches."""
+    chunk_size = CHUNK_SIZE if mode == 'previous' else FILE_CHANNEL_CHUNK
+    pool = [os.urandom(chunk_size) for _ in range(max(2, POOL_BYTES // chunk_size))]
+    if mode == 'previous':
+        receiver, manifest = PreviousFileTransfer(), b''
+    else:
+        receiver = FileTransfer(None, 'viewer')
+        manifest = b''.join(chunk_digest(chunk) for _, chunk in chunks(size, pool))
+    file_id = manifest_id(manifest)
+    receiver.receive_file_meta(decode_message(encode_message(
+        MSG_FILE_META, {'username': 'presenter', 'filename': FILENAME, 'filesize': size, 'file_id': file_id}, manifest)))
+    if mode == 'current':
+        receiver.begin_download(file_id)
+    expected = hashlib.sha256()
+    elapsed = 0.0
+    for offset, chunk in chunks(size, pool):
+        expected.update(chunk)
+        message = decode_message(encode_message(MSG_FILE_DATA, {'filename': FILENAME, 'file_id': file_id,
+                                                                'offset': offset}, chunk))
+        start = time.perf_counter()
+        receiver.receive_file_data(message)
+        elapsed += time.perf_counter() - start
+    
+    saved = hashlib.sha256()
+    with open(os.path.join(FILE_DOWNLOAD_DIR, FILENAME), 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            saved.update(block)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(elapsed, peak_mb, saved.digest() == expected.digest())
+
+def run(mode, size_mb):
+    """Receive one file in a fresh process and working directory; return (seconds, peak MB, ok)."""
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', mode, str(size_mb)],
+                                cwd=workdir, capture_output=True, text=True, check=True).stdout.splitlines()[-1].split()
+    return float(output[0]), float(output[1]), output[2] == 'True'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--previous-mb', default='32,64,128')
+    parser.add_argument('--current-mb', default='128,2048')
+    parser.add_argument('--run', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        receive(args.run[0], int(args.run[1]) * 1024 * 1024)
+        sys.exit()
+    
+    print(f"previous receiver: {CHUNK_SIZE} byte chunks, current receiver: {FILE_CHANNEL_CHUNK} byte chunks")
+    print(f"{'receiver':9} {'file MB':>8} {'chunks':>8} {'seconds':>8} {'MB/s':>8} {'us/chunk':>9} {'peak RSS MB':>12}  file")
+    runs = [('previous', int(size)) for size in args.previous_mb.split(',')]
+    runs += [('current', int(size)) for size in args.current_mb.split(',')]
+    for mode, size_mb in runs:
+        seconds, peak_mb, ok = run(mode, size_mb)
+        count = -(-size_mb * 1024 * 1024 // (CHUNK_SIZE if mode == 'previous' else FILE_CHANNEL_CHUNK))
+        print(f"{mode:9} {size_mb:8} {count:8} {seconds:8.2f} {size_mb / seconds:8.0f} {seconds / count * 1e6:9.1f} "
+              f"{peak_mb:12.0f}  {'ok' if ok else 'MISMATCH'}")
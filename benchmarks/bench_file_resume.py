@@ -0,0 +1,130 @@
+"""
+File Resume Benchmark
+Shares a file through a real server and breaks the transfer on purpose to show that
+a retry only moves what is missing: an upload whose file channel drops halfway, a
+re-upload of an edited copy (one chunk changed), a download cut off halfway and
+resumed after one chunk of its '.part' file was corrupted, and a download of the
+edited copy by someone who already has the original. Reports the bytes each step
+put on the wire next to what starting over from scratch would have, and checks every
+copy byte for byte.
+
+Usage: python benchmarks/bench_file_resume.py [--size-mb 512] [--engine threaded]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import tempfile
+import time
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from shared.file_io import write_at
+from benchmarks.bench_server_engines import wait_for_port
+from benchmarks.bench_file_transfer import BenchClient, make_file, file_digest, source_file_id
+
+def interrupt_at(percent, prefix, action):
+    """A progress callback that runs action once, the first time a prefix status reaches percent."""
+    fired = [False]
+    
+    def callback(status):
+        if not fired[0] and status.startswith(prefix) and int(status.rstrip('%').rsplit(' ', 1)[-1]) >= percent:
+            fired[0] = True
+            action()
+    return callback
+
+def drop_channel(client, dropped_at):
+    dropped_at.append(client.files.bytes_sent)
+    client.files.file_socket.shutdown(socket.SHUT_RDWR)
+
+def wait_announced(client, file_id, timeout=60):
+    start = time.monotonic()
+    while file_id not in client.files.available_files:
+        if time.monotonic() - start > timeout:
+            raise RuntimeError("file was never announced")
+        time.sleep(0.001)
+
+def report(step, moved, from_scratch, seconds, ok=None):
+    check = '' if ok is None else ('  ok' if ok else '  MISMATCH')
+    print(f"{step:44} {moved / 1e6:9.1f} MB {from_scratch / 1e6:9.1f} MB {seconds:7.2f} s{check}")
+
+def run(engine, workdir, size):
+    original = os.path.join(workdir, 'dataset.bin')
+    edited = os.path.join(workdir, 'dataset-v2.bin')
+    original_digest = make_file(original, size)
+    with open(original, 'rb') as source, open(edited, 'wb') as target:
+        target.write(source.read())
+    with open(edited, 'r+b') as f:
+        f.seek(size // 3)
+        f.write(os.urandom(4096))
+    edited_digest = file_digest(edited)
+    original_id, edited_id = source_file_id(original), source_file_id(edited)
+    
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', engine, '--file-store', workdir],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(TCP_PORT)
+        sender = BenchClient('sender', os.path.join(workdir, 'sender'))
+        viewer = BenchClient('viewer', os.path.join(workdir, 'viewer'))
+        time.sleep(0.3)
+        
+        dropped_at = []
+        sender.files.progress_callback = interrupt_at(50, 'Sending', lambda: drop_channel(sender, dropped_at))
+        start = time.monotonic()
+        ok = sender.files.send_file(original) == original_id
+        report("upload, channel dropped at 50%, resumed", sender.files.bytes_sent, dropped_at[0] + size,
+               time.monotonic() - start, ok)
+        
+        sender.files.progress_callback = None
+        start = time.monotonic()
+        sent = sender.files.bytes_sent
+        ok = sender.files.send_file(edited) == edited_id
+        report("upload of an edited copy (4 KB changed)", sender.files.bytes_sent - sent, size,
+               time.monotonic() - start, ok)
+        
+        wait_announced(viewer, original_id)
+        wait_announced(viewer, edited_id)
+        viewer.files.progress_callback = interrupt_at(50, 'Receiving', lambda: viewer.files.abort_file(original_id))
+        start = time.monotonic()
+        viewer.files.download_file(original_id)
+        cancelled_at = viewer.files.bytes_received
+        report("download, cancelled at 50%", cancelled_at, size, time.monotonic() - start)
+        
+        viewer.files.progress_callback = None
+        part = os.path.join(workdir, 'viewer', f".dataset.bin.{original_id[:16]}.part")
+        fd = os.open(part, os.O_WRONLY)
+        write_at(fd, os.urandom(4096), 0)
+        os.close(fd)
+        start = time.monotonic()
+        received = viewer.files.bytes_received
+        path = viewer.files.download_file(original_id)
+        report("download resumed, first chunk corrupted", viewer.files.bytes_received - received, size,
+               time.monotonic() - start, bool(path) and file_digest(path) == original_digest)
+        
+        start = time.monotonic()
+        received = viewer.files.bytes_received
+        path = viewer.files.download_file(edited_id)
+        report("download of the edited copy", viewer.files.bytes_received - received, size,
+               time.monotonic() - start, bool(path) and file_digest(path) == edited_digest)
+        
+        sender.close()
+        viewer.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--engine', default='threaded')
+    args = parser.parse_args()
+    
+    print(f"{args.size_mb} MB file, {FILE_CHANNEL_CHUNK // 1024 // 1024} MB chunks, loopback, engine={args.engine}")
+    print(f"{'step':44} {'moved':>12} {'from scratch':>12} {'time':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        run(args.engine, workdir, args.size_mb * 1024 * 1024)
@@ -0,0 +1,154 @@
+"""
+File Sharing Benchmark
+Connects a room of participants to a real server. One of them uploads a file; the
+server stores it and only announces it, and two participants download it on
+demand, one over a single range stream and one over FILE_DOWNLOAD_STREAMS parallel
+range streams. Reports upload and download times, checks every copy byte for byte,
+and compares the server's file egress with pushing the file to everyone, as the
+previous design did.
+
+Usage: python benchmarks/bench_file_transfer.py [--size-mb 1024] [--participants 6] [--engine threaded]
+"""
+
+import argparse
+import hashlib
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.file_transfer import FileTransfer
+from shared.file_io import file_manifest, manifest_id
+from benchmarks.bench_server_engines import wait_for_port
+
+FILENAME = 'build-artifacts.tar'
+
+class BenchClient:
+    """A registered participant: a control connection feeding file announcements to a FileTransfer."""
+    
+    def __init__(self, username, download_dir):
+        self.control = socket.create_connection(('127.0.0.1', TCP_PORT))
+        self.control.sendall(encode_message(MSG_REGISTER, {'username': username}, sender_id=user_id(username)))
+        self.files = FileTransfer(self.control, username, server_ip='127.0.0.1', download_dir=download_dir)
+        self.control_bytes = 0
+        threading.Thread(target=self.read_control, daemon=True).start()
+        time.sleep(0.1)
+        self.files.open_channel()
+    
+    def read_control(self):
+        try:
+            while True:
+                header = self.recv_exact(HEADER_SIZE)
+                body = self.recv_exact(frame_body_size(header)) if header else None
+                if body is None:
+                    return
+                self.control_bytes += HEADER_SIZE + len(body)
+                message = decode_message(header + body)
+                if message['type'] == MSG_FILE_META:
+                    self.files.receive_file_meta(message)
+        except OSError:
+            pass
+    
+    def recv_exact(self, num_bytes):
+        data = bytearray(num_bytes)
+        view = memoryview(data)
+        received = 0
+        while received < num_bytes:
+            count = self.control.recv_into(view[received:])
+            if not count:
+                return None
+            received += count
+        return data
+    
+    def close(self):
+        self.files.close()
+        self.control.close()
+
+def make_file(path, size):
+    """Write a size-byte file of random data and return its SHA-256."""
+    digest = hashlib.sha256()
+    block_size = 1024 * 1024
+    with open(path, 'wb') as f:
+        for offset in range(0, size, block_size):
+            chunk = os.urandom(min(block_size, size - offset))
+            f.write(chunk)
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def timed(function, *args):
+    start = time.monotonic()
+    result = function(*args)
+    return time.monotonic() - start, result
+
+def source_file_id(path):
+    with open(path, 'rb') as f:
+        return manifest_id(file_manifest(f.fileno(), os.path.getsize(path)))
+
+def run(engine, workdir, source, expected, num_participants, timeout=300):
+    """Upload once, download twice; print timings and egress."""
+    size = os.path.getsize(source)
+    file_id = source_file_id(source)
+    size_mb = size / 1024 / 1024
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', engine, '--file-store', workdir],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(TCP_PORT)
+        clients = [BenchClient(f"user{index}", os.path.join(workdir, f"user{index}")) for index in range(num_participants)]
+        sender, single, parallel = clients[:3]
+        time.sleep(0.3)
+        
+        start = time.monotonic()
+        sender.files.send_file(source)
+        while not all(file_id in client.files.available_files for client in clients[1:]):
+            if time.monotonic() - start > timeout:
+                raise RuntimeError("file was never announced")
+            time.sleep(0.001)
+        upload = time.monotonic() - start
+        
+        single_time, single_path = timed(single.files.download_file, file_id, 1)
+        parallel_time, parallel_path = timed(parallel.files.download_file, file_id, FILE_DOWNLOAD_STREAMS)
+        copies = [path for path in (single_path, parallel_path) if path and file_digest(path) == expected]
+        control = sum(client.control_bytes for client in clients[1:])
+        for client in clients:
+            client.close()
+    finally:
+        server.terminate()
+        _, _, usage = os.wait4(server.pid, 0)
+    
+    print(f"{'upload to the file store':34} {upload:8.2f} s {size_mb / upload:8.0f} MB/s")
+    print(f"{'download, 1 range stream':34} {single_time:8.2f} s {size_mb / single_time:8.0f} MB/s")
+    print(f"{f'download, {FILE_DOWNLOAD_STREAMS} range streams':34} {parallel_time:8.2f} s {size_mb / parallel_time:8.0f} MB/s")
+    print(f"copies ok {len(copies)}/2, server CPU {usage.ru_utime + usage.ru_stime:.2f} s")
+    pushed = (num_participants - 1) * size
+    on_demand = 2 * size + control
+    print(f"server file egress: push to everyone {pushed / 1e6:.0f} MB (computed), "
+          f"on demand {on_demand / 1e6:.0f} MB (two downloads + {control} bytes of control traffic), "
+          f"{pushed / on_demand:.1f}x less")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--participants', type=int, default=6)
+    parser.add_argument('--engine', default='threaded')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, FILENAME)
+        expected = make_file(source, args.size_mb * 1024 * 1024)
+        print(f"{args.size_mb} MB file, {args.participants} participants, 2 download it, loopback, engine={args.engine}")
+        run(args.engine, workdir, source, expected, args.participants)
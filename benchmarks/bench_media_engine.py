@@ -0,0 +1,138 @@
+"""
+Media Engine Benchmark
+Starts a client's media nodes against a real server the previous way (one spawned
+Python process per node, each importing cv2/numpy again and registering its UDP
+port on a connection of its own) and the current way (the nodes hosted by the
+client's MediaEngine). Reports how long each node takes from the click until it is
+running and registered, and the memory it adds: the resident size of each spawned
+process, versus how much the client process grows.
+
+The client process is modelled as an interpreter that has imported cv2 and numpy, as
+the real client already has for screen sharing, with a registered control
+connection. Without a webcam the capture node gives up after opening the camera
+fails, which still covers its startup. Audio nodes are measured when pyaudio is
+installed.
+
+Usage: python benchmarks/bench_media_engine.py
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import socket
+import subprocess
+import threading
+import time
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from benchmarks.bench_server_engines import wait_for_port
+
+# (label, engine method, module, line the node prints once started and registered)
+NODES = [
+    ('video capture', 'start_video_capture', 'video_capture_encode', ('Started for', 'no camera found')),
+    ('video display', 'start_video_display', 'video_decode_render', ('Registered UDP port',)),
+    ('audio capture', 'start_audio_capture', 'audio_capture_encode', ('Started for',)),
+    ('audio playback', 'start_audio_playback', 'audio_decode_playback', ('Registered UDP port',))
+]
+
+def audio_available():
+    return importlib.util.find_spec('pyaudio') is not None
+
+def rss_mb(pid='self'):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def control_connection(username):
+    """A registered control connection whose incoming messages are drained in the background."""
+    control = socket.create_connection(('127.0.0.1', TCP_PORT))
+    control.sendall(encode_message(MSG_REGISTER, {'username': username}, sender_id=user_id(username)))
+    
+    def drain():
+        try:
+            while control.recv(65536):
+                pass
+        except OSError:
+            pass
+    threading.Thread(target=drain, daemon=True).start()
+    return control
+
+def spawn_node(module, username, ready):
+    """Start a node script the way the client used to; returns (seconds until ready, RSS MB)."""
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, f"modules/{module}.py", '127.0.0.1', username],
+                               cwd=os.path.join(ROOT, 'client'), stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in process.stdout:
+            if any(marker in line for marker in ready):
+                return time.monotonic() - start, rss_mb(process.pid)
+        raise RuntimeError(f"{module} exited before starting")
+    finally:
+        process.kill()
+        process.wait()
+
+def engine_child(nodes):
+    """Run in a fresh interpreter: the client process, then its MediaEngine starting every node."""
+    # The real client has these loaded before any media starts, so they are not the engine's cost
+    for module in ('cv2', 'numpy'):
+        importlib.import_module(module)
+    control = control_connection('engine')
+    time.sleep(0.2)
+    results = {'client_rss': rss_mb()}
+    start = time.monotonic()
+    from client.modules.media_engine import MediaEngine
+    engine = MediaEngine('127.0.0.1', 'engine', control)
+    results['engine'] = (time.monotonic() - start, rss_mb() - results['client_rss'])
+    for label, method, _, _ in nodes:
+        before = rss_mb()
+        start = time.monotonic()
+        getattr(engine, method)()
+        results[label] = (time.monotonic() - start, rss_mb() - before)
+    # Node threads print too (the display keeps failing without a GUI), so mark the result
+    sys.stdout.write(f"\nRESULT {json.dumps(results)}\n")
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--engine-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    nodes = NODES if audio_available() else NODES[:2]
+    if args.engine_child:
+        engine_child(nodes)
+    
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server', 'server_main.py')],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(TCP_PORT)
+        control = control_connection('spawned')
+        time.sleep(0.2)
+        spawned = {label: spawn_node(module, 'spawned', ready) for label, _, module, ready in nodes}
+        control.close()
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--engine-child'],
+                               capture_output=True, text=True, check=True)
+        engine = json.loads(next(line for line in child.stdout.splitlines() if line.startswith('RESULT '))[7:])
+    finally:
+        server.terminate()
+        server.wait()
+    
+    print(f"{os.cpu_count()} CPU(s); client process before any media: {engine['client_rss']:.0f} MB"
+          + ("" if len(nodes) == len(NODES) else "; audio nodes skipped (pyaudio not installed)"))
+    print(f"{'node':16} {'spawned start':>14} {'process RSS':>12} {'engine start':>13} {'RSS added':>10}")
+    seconds, memory = engine['engine']
+    print(f"{'(engine itself)':16} {'-':>14} {'-':>12} {seconds * 1000:10.1f} ms {memory:7.1f} MB")
+    for label, _, _, _ in nodes:
+        print(f"{label:16} {spawned[label][0] * 1000:11.0f} ms {spawned[label][1]:9.0f} MB "
+              f"{engine[label][0] * 1000:10.1f} ms {engine[label][1]:7.1f} MB")
+    total_spawned = [sum(spawned[label][i] for label, _, _, _ in nodes) for i in (0, 1)]
+    total_engine = [engine['engine'][i] + sum(engine[label][i] for label, _, _, _ in nodes) for i in (0, 1)]
+    print(f"{'total':16} {total_spawned[0] * 1000:11.0f} ms {total_spawned[1]:9.0f} MB "
+          f"{total_engine[0] * 1000:10.1f} ms {total_engine[1]:7.1f} MB")
@@ -0,0 +1,105 @@
+"""
+Scalability Benchmark
+Starts a local server and adds headless bots (client/bot_client.py) in steps,
+measuring at each step once the new bots have settled: the video the bots receive
+(Mbit/s, relay latency percentiles from send to arrival, loss), the share of audio
+mixes delivered and the longest wait between two mixes at any bot, chat delivery and latency, file upload and download throughput, and
+the server's CPU and resident memory. A few bots send webcams and talk, every bot
+receives, and the rest are muted like most of a large meeting.
+
+The bots run in this process, so on a machine with few cores they compete with the
+server for CPU; their own CPU is reported alongside, and datagrams they dropped at
+full socket buffers are counted so bot overload is not mistaken for server loss.
+
+Usage: python benchmarks/bench_scalability.py [--steps 10,25,50,100,200] [--seconds 10] [--engine threaded]
+                                              [--video 640x480@15] [--video-senders 4] [--audio-senders 4]
+                                              [--chat-interval 10] [--file-mb 4]
+"""
+
+import argparse
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from benchmarks.bench_server_engines import wait_for_port
+from client.bot_client import BotSwarm, parse_video
+
+TICKS = os.sysconf('SC_CLK_TCK')
+
+def process_cpu_seconds(pid):
+    """User plus system CPU time of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / TICKS
+
+def process_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def own_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--steps', default='10,25,50,100,200', help="comma-separated total bot counts")
+    parser.add_argument('--seconds', type=float, default=10, help="measurement time per step")
+    parser.add_argument('--settle', type=float, default=2, help="time after adding bots before measuring")
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--video', default=f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}@{VIDEO_FPS}")
+    parser.add_argument('--video-senders', type=int, default=4)
+    parser.add_argument('--audio-senders', type=int, default=4)
+    parser.add_argument('--chat-interval', type=float, default=10.0)
+    parser.add_argument('--file-mb', type=float, default=4, help="size of the file transferred every 5 s (0: none)")
+    args = parser.parse_args()
+    
+    store = tempfile.mkdtemp(prefix='bench-store-')
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', args.engine,
+                               '--file-store', store], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    video_size, video_fps = parse_video(args.video)
+    swarm = None
+    try:
+        wait_for_port(TCP_PORT)
+        swarm = BotSwarm('127.0.0.1', video_size, video_fps, args.video_senders, args.audio_senders,
+                         args.chat_interval, args.file_mb, file_interval=5.0)
+        print(f"{args.engine} server, {os.cpu_count()} CPU(s); {args.video_senders} webcams at {args.video}, "
+              f"{args.audio_senders} talking, chat every {args.chat_interval:.0f}s per bot, "
+              f"{args.file_mb:.0f} MB file every 5s; {args.seconds:.0f}s per step")
+        print(f"{'bots':>5} {'video Mbit/s':>12} {'latency p50/p95/p99':>20} {'loss':>6} {'audio':>6} {'mix gap':>8} "
+              f"{'chat':>5} {'chat p95':>9} {'up/down MB/s':>13} {'server CPU':>10} {'RSS':>7} {'bot CPU':>8} {'bot drops':>9}")
+        for total in [int(count) for count in args.steps.split(',')]:
+            swarm.add_bots(total - len(swarm.bots))
+            time.sleep(args.settle)
+            swarm.report()
+            server_cpu = process_cpu_seconds(server.pid)
+            bot_cpu = own_cpu_seconds()
+            time.sleep(args.seconds)
+            report = swarm.report()
+            server_cpu = (process_cpu_seconds(server.pid) - server_cpu) / report['seconds']
+            bot_cpu = (own_cpu_seconds() - bot_cpu) / report['seconds']
+            
+            latency = '/'.join(f"{ms:.0f}" for ms in report['video_latency_ms']) + ' ms'
+            files = f"{report['upload_mb_per_second']:.0f}/{report['download_mb_per_second']:.0f}" if args.file_mb else '-'
+            print(f"{total:5} {report['video_mbps']:12.1f} {latency:>20} {report['video_loss'] * 100:5.1f}% "
+                  f"{report['audio_delivered'] * 100:5.0f}% {report['audio_gap_ms']:5.0f} ms {report['chat_delivered'] * 100:4.0f}% "
+                  f"{report['chat_latency_ms'][1]:6.0f} ms {files:>13} {server_cpu * 100:9.0f}% "
+                  f"{process_rss_mb(server.pid):4.0f} MB {bot_cpu * 100:7.0f}% {report['socket_drops']:9}")
+            if server.poll() is not None:
+                print("[BENCH] Server exited")
+                break
+    finally:
+        if swarm:
+            swarm.close()
+        server.terminate()
+        server.wait()
+        shutil.rmtree(store, ignore_errors=True)
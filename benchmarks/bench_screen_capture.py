@@ -0,0 +1,118 @@
+"""
+Screen Capture Pipeline Benchmark
+Drives the presenter's capture loop against a virtual 3840x2160 display that is
+static, then shows slides with a moving pointer, then plays a 720p video in a
+window, and compares the previous pipeline (convert at full resolution, stretch to
+1024x768, full JPEG, fixed 100 ms sleep after each frame) with the current one
+(aspect-preserving scaling, tile-diff encoding, deadline pacing, content-adaptive
+frame rate). Reports per phase the capture rate, capture-to-send latency and
+bitrate.
+
+A "grab" copies the virtual display, which costs about what a real 4K grab does.
+
+Usage: python benchmarks/bench_screen_capture.py [--phase-seconds 6]
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.screen_codec import ScreenEncoder, CapturePacer, prepare_capture
+from benchmarks.bench_screen_tiles import draw_slide
+
+DISPLAY = (3840, 2160)
+VIDEO_WINDOW = (1280, 720)
+PHASES = ['static', 'slides', 'video']
+
+class VirtualDisplay:
+    """A 4K BGRA desktop whose content depends on the phase and the time within it."""
+    
+    def __init__(self):
+        self.slides = [cv2.cvtColor(cv2.resize(draw_slide(number), DISPLAY), cv2.COLOR_BGR2BGRA) for number in range(4)]
+        rng = np.random.default_rng(0)
+        width, height = VIDEO_WINDOW
+        y, x = np.mgrid[0:height, 0:width]
+        self.video = []
+        for index in range(30):
+            # A moving gradient with noise: every pixel changes from frame to frame
+            frame = np.dstack([(x + index * 40) % 256, (y + index * 25) % 256, (x + y) % 256, np.full_like(x, 255)])
+            frame = frame + rng.integers(0, 8, frame.shape)
+            self.video.append(np.clip(frame, 0, 255).astype(np.uint8))
+    
+    def grab(self, phase, t):
+        if phase == 'static':
+            return self.slides[0].copy()
+        if phase == 'slides':
+            screen = self.slides[int(t / 2) % len(self.slides)].copy()
+            x, y = int(1500 + 1500 * (t % 2) / 2), int(1600 - 400 * np.sin(t * np.pi))
+            pointer = np.array([[x, y], [x, y + 66], [x + 18, y + 51], [x + 45, y + 51]], dtype=np.int32)
+            cv2.fillPoly(screen, [pointer], (0, 0, 0, 255))
+            return screen
+        screen = self.slides[1].copy()
+        width, height = VIDEO_WINDOW
+        screen[700:700 + height, 1200:1200 + width] = self.video[int(t * 30) % len(self.video)]
+        return screen
+
+def previous_pipeline(display, phase, seconds):
+    """The capture loop before: full-size convert, stretched resize, full JPEG, then a fixed sleep."""
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), SCREEN_QUALITY]
+    latencies, sent_bytes, size = [], 0, None
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        captured = time.monotonic()
+        frame = cv2.cvtColor(display.grab(phase, captured - start), cv2.COLOR_BGRA2BGR)
+        frame = cv2.resize(frame, (SCREEN_WIDTH, SCREEN_HEIGHT))
+        _, encoded = cv2.imencode('.jpg', frame, encode_param)
+        sent_bytes += len(encode_message(MSG_SCREEN_FRAME, {'username': 'presenter'}, encoded.tobytes()))
+        latencies.append(time.monotonic() - captured)
+        size = frame.shape[1::-1]
+        time.sleep(0.1)
+    return latencies, sent_bytes, size
+
+def current_pipeline(display, phase, seconds, encoder, pacer):
+    """The capture loop now: aspect-fit scaling, tile diff, deadline pacing with adaptive frame rate."""
+    latencies, sent_bytes, size = [], 0, None
+    start = time.monotonic()
+    pacer.next_capture = start
+    while time.monotonic() - start < seconds:
+        captured = time.monotonic()
+        frame = prepare_capture(display.grab(phase, captured - start))
+        encoded = encoder.encode(frame)
+        if encoded is not None:
+            flags, meta, payload = encoded
+            meta['username'] = 'presenter'
+            sent_bytes += len(encode_message(MSG_SCREEN_FRAME, meta, payload, flags=flags))
+        latencies.append(time.monotonic() - captured)
+        size = frame.shape[1::-1]
+        pacer.update(encoder.dirty_fraction)
+        pacer.wait()
+    return latencies, sent_bytes, size
+
+def report(label, phase, seconds, latencies, sent_bytes, size, fps=None):
+    latency_ms = np.array(latencies) * 1000
+    fps_note = f"  (pacer at {fps} fps)" if fps else ""
+    print(f"{label:9} {phase:7} {len(latencies) / seconds:6.1f} {np.mean(latency_ms):8.1f} {np.percentile(latency_ms, 95):8.1f} "
+          f"{sent_bytes * 8 / seconds / 1000:8.0f}  {size[0]}x{size[1]}{fps_note}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--phase-seconds', type=float, default=6)
+    args = parser.parse_args()
+    
+    display = VirtualDisplay()
+    seconds = args.phase_seconds
+    print(f"virtual display {DISPLAY[0]}x{DISPLAY[1]}, target {SCREEN_WIDTH}x{SCREEN_HEIGHT}, {seconds:.0f}s per phase")
+    print(f"{'pipeline':9} {'phase':7} {'fps':>6} {'lat ms':>8} {'p95 ms':>8} {'kbit/s':>8}  sent size")
+    for phase in PHASES:
+        report('previous', phase, seconds, *previous_pipeline(display, phase, seconds))
+    encoder = ScreenEncoder()
+    pacer = CapturePacer()
+    for phase in PHASES:
+        results = current_pipeline(display, phase, seconds, encoder, pacer)
+        report('current', phase, seconds, *results, fps=pacer.fps)
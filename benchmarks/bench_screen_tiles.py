@@ -0,0 +1,118 @@
+"""
+Screen Sharing Encoder Benchmark
+Replays a synthetic slide presentation (a new slide every 15 s, a pointer moving
+over it for a few seconds, a line being typed, long static stretches) at 10 captures
+per second and compares the previous encoder, a full JPEG every capture, with the
+tile-diff encoder: bytes sent, frames sent, encode CPU time, and how faithfully a
+viewer rebuilds the screen from keyframes and deltas.
+
+Usage: python benchmarks/bench_screen_tiles.py [--seconds 60]
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.screen_codec import ScreenEncoder, ScreenCanvas
+
+CAPTURE_FPS = 10
+SLIDE_SECONDS = 15
+TYPED_TEXT = "Questions? Ask in the chat or unmute."
+
+def draw_slide(number):
+    """A white slide with a title, bullets and a bar chart."""
+    rng = np.random.default_rng(number)
+    slide = np.full((SCREEN_HEIGHT, SCREEN_WIDTH, 3), 255, dtype=np.uint8)
+    cv2.rectangle(slide, (0, 0), (SCREEN_WIDTH, 90), (120, 60, 20), -1)
+    cv2.putText(slide, f"Quarterly review - part {number + 1}", (40, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.3, (255, 255, 255), 2)
+    for line in range(6):
+        cv2.putText(slide, f"- bullet point {line + 1}: metric {rng.integers(10, 99)}% vs plan", (60, 160 + line * 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (30, 30, 30), 2)
+    for bar in range(8):
+        height = int(rng.integers(40, 260))
+        cv2.rectangle(slide, (600 + bar * 48, 700 - height), (630 + bar * 48, 700), (40, 140, 220), -1)
+    return slide
+
+def presentation(seconds):
+    """Yield one capture every 1 / CAPTURE_FPS seconds of the presentation."""
+    slides = {}
+    for index in range(seconds * CAPTURE_FPS):
+        t = index / CAPTURE_FPS
+        number, offset = divmod(t, SLIDE_SECONDS)
+        number = int(number)
+        if number not in slides:
+            slides[number] = draw_slide(number)
+        frame = slides[number].copy()
+
+        # Typing a line between 8 and 12 s into each slide
+        if offset >= 8:
+            typed = TYPED_TEXT[:int(min(offset - 8, 4) / 4 * len(TYPED_TEXT))]
+            cv2.putText(frame, typed, (60, 500), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 200), 2)
+
+        # The presenter points at the chart between 3 and 6 s
+        if 3 <= offset < 6:
+            x = int(500 + (offset - 3) / 3 * 450)
+            y = int(600 - 150 * np.sin((offset - 3) * np.pi / 3))
+            pointer = np.array([[x, y], [x, y + 22], [x + 6, y + 17], [x + 15, y + 17]], dtype=np.int32)
+            cv2.fillPoly(frame, [pointer], (0, 0, 0))
+        yield t, frame
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return 99.0 if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def bench(seconds):
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), SCREEN_QUALITY]
+    full_bytes = full_cpu = 0
+    full_quality = []
+    tile_bytes = tile_cpu = tile_frames = 0
+    tile_quality = []
+    encoder = ScreenEncoder()
+    canvas = ScreenCanvas()
+    meta_size = len(encode_meta({'username': 'presenter'}))
+
+    for index, (t, frame) in enumerate(presentation(seconds)):
+        start = time.perf_counter()
+        _, encoded = cv2.imencode('.jpg', frame, encode_param)
+        full_cpu += time.perf_counter() - start
+        full_bytes += HEADER_SIZE + meta_size + len(encoded)
+
+        start = time.perf_counter()
+        result = encoder.encode(frame, now=t)
+        tile_cpu += time.perf_counter() - start
+        if result is not None:
+            flags, meta, payload = result
+            meta['username'] = 'presenter'
+            message = decode_message(encode_message(MSG_SCREEN_FRAME, meta, payload, flags=flags))
+            tile_bytes += HEADER_SIZE + len(encode_meta(meta)) + len(payload)
+            tile_frames += 1
+            canvas.apply(message)
+
+        # Compare what a viewer sees once a second
+        if index % CAPTURE_FPS == 0:
+            full_quality.append(psnr(cv2.imdecode(encoded, cv2.IMREAD_COLOR), frame))
+            tile_quality.append(psnr(canvas.frame, frame))
+
+    captures = seconds * CAPTURE_FPS
+    to_kbps = lambda total: total * 8 / seconds / 1000
+    print(f"{seconds}s presentation at {SCREEN_WIDTH}x{SCREEN_HEIGHT}, {CAPTURE_FPS} captures/s, "
+          f"tile={SCREEN_TILE}px keyframe every {SCREEN_KEYFRAME_INTERVAL:.0f}s")
+    print(f"{'encoder':18} {'frames sent':>11} {'kbit/s':>8} {'encode ms/capture':>18} {'viewer PSNR':>12}")
+    print(f"{'full JPEG (before)':18} {captures:11} {to_kbps(full_bytes):8.0f} "
+          f"{full_cpu / captures * 1000:18.2f} {np.mean(full_quality):10.1f}dB")
+    print(f"{'tile diff':18} {tile_frames:11} {to_kbps(tile_bytes):8.0f} "
+          f"{tile_cpu / captures * 1000:18.2f} {np.mean(tile_quality):10.1f}dB")
+    print(f"keyframes={encoder.keyframes} deltas={encoder.deltas} unchanged={encoder.unchanged}; "
+          f"{full_bytes / tile_bytes:.1f}x fewer bytes, {full_cpu / tile_cpu:.1f}x less encode CPU")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=60)
+    args = parser.parse_args()
+    bench(args.seconds)
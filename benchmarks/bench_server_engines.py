@@ -0,0 +1,126 @@
+"""
+Server Engine Benchmark
+Starts the server with each engine, connects many chat clients, and reports
+connection setup time, relayed messages per second, and server threads/RSS.
+
+Usage: python benchmarks/bench_server_engines.py [--clients 10,50,100] [--messages 20]
+"""
+
+import argparse
+import asyncio
+import socket
+import subprocess
+import time
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+
+async def read_message(reader):
+    """Read and decode one frame from a stream."""
+    header = await reader.readexactly(HEADER_SIZE)
+    return decode_message(header + await reader.readexactly(frame_body_size(header)))
+
+def read_proc_status(pid):
+    """Return (threads, rss_kb) for a process, or (None, None) off Linux."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['Threads']), int(fields['VmRSS'].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def wait_for_port(port, timeout=10):
+    """Block until the server accepts TCP connections."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not open port {port}")
+
+async def connect_client(index):
+    """Open a connection and register as a numbered bench user."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', TCP_PORT)
+    username = f"bench{index}"
+    writer.write(encode_message(MSG_REGISTER, {'username': username}, sender_id=user_id(username)))
+    await writer.drain()
+    return reader, writer, username
+
+async def wait_for_roster(reader, num_clients):
+    """Read user lists until the server reports every bench user as registered."""
+    while True:
+        message = await read_message(reader)
+        if message['type'] == MSG_USER_LIST and len(message.get('users', [])) >= num_clients:
+            return
+
+async def run_client(reader, writer, username, num_clients, num_messages):
+    """Send chat messages and count relayed chat until everyone else's arrived."""
+    async def send_all():
+        for i in range(num_messages):
+            writer.write(encode_message(MSG_CHAT, {'username': username, 'message': f"msg {i}"},
+                                        sender_id=user_id(username)))
+            await writer.drain()
+    
+    sender = asyncio.create_task(send_all())
+    expected = (num_clients - 1) * num_messages
+    received = 0
+    while received < expected:
+        message = await read_message(reader)
+        if message['type'] == MSG_CHAT:
+            received += 1
+    await sender
+
+async def run_round(num_clients, num_messages, server_pid):
+    """Connect num_clients, time how long all chat takes to be relayed, and sample the server."""
+    connect_start = time.perf_counter()
+    clients = await asyncio.gather(*(connect_client(i) for i in range(num_clients)))
+    await asyncio.gather(*(wait_for_roster(reader, num_clients) for reader, _, _ in clients))
+    connect_time = time.perf_counter() - connect_start
+    
+    relay_start = time.perf_counter()
+    await asyncio.gather(*(run_client(reader, writer, username, num_clients, num_messages)
+                           for reader, writer, username in clients))
+    relay_time = time.perf_counter() - relay_start
+    
+    threads, rss_kb = read_proc_status(server_pid)
+    for _, writer, _ in clients:
+        writer.close()
+    return connect_time, relay_time, threads, rss_kb
+
+def bench_engine(engine, client_counts, num_messages):
+    """Run every client count against a fresh server process using one engine."""
+    for num_clients in client_counts:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', engine],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(TCP_PORT)
+            connect_time, relay_time, threads, rss_kb = asyncio.run(
+                run_round(num_clients, num_messages, server.pid)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        
+        sent = num_clients * num_messages
+        delivered = sent * (num_clients - 1)
+        print(f"{engine:9} clients={num_clients:4} connect={connect_time:6.2f}s "
+              f"sent/s={sent / relay_time:9.0f} delivered/s={delivered / relay_time:9.0f} "
+              f"threads={threads} rss={rss_kb}kB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', default='10,50,100', help="comma-separated client counts")
+    parser.add_argument('--messages', type=int, default=20, help="chat messages sent per client")
+    parser.add_argument('--engines', default='threaded,asyncio')
+    args = parser.parse_args()
+    
+    client_counts = [int(n) for n in args.clients.split(',')]
+    for engine in args.engines.split(','):
+        bench_engine(engine, client_counts, args.messages)
@@ -0,0 +1,155 @@
+"""
+Selective Forwarding Benchmark
+Connects a room of participants that each publish a full and a thumbnail video layer,
+then measures the server's video egress when everyone subscribes to full layers
+versus thumbnails (the grid view), and with active-speaker routing (a few talkers
+take turns; their full layer goes to everyone, other webcams as thumbnails or not
+at all), and compares each with the previous relay that sent every full frame to
+every client including its sender. Runs every mode at each room size given.
+
+Usage: python benchmarks/bench_sfu_egress.py [--participants 6,12] [--seconds 5] [--speakers 2] [--engine threaded]
+"""
+
+import argparse
+import numpy as np
+import os
+import socket
+import subprocess
+import threading
+import time
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from benchmarks.bench_server_engines import wait_for_port
+
+FPS = 10
+TURN_SECONDS = 0.5
+
+class Participant:
+    """One bench client: a registered control connection, a video receiver and a publisher."""
+    
+    def __init__(self, index, default_layer):
+        self.username = f"sfu{index}"
+        self.sender_id = user_id(self.username)
+        self.control = socket.create_connection(('127.0.0.1', TCP_PORT))
+        self.control.sendall(encode_message(MSG_REGISTER, {'username': self.username}, sender_id=self.sender_id))
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_SOCKET_BUFFER)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(0.5)
+        self.publisher = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.microphone = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.default_layer = default_layer
+        self.received = 0
+    
+    def register(self):
+        port = self.receiver.getsockname()[1]
+        self.control.sendall(encode_message(MSG_UDP_REGISTER, {'username': self.username, 'video_port': port,
+                                                               'audio_port': None}, sender_id=self.sender_id))
+        subscription = {'default_layer': self.default_layer, 'layers': {}}
+        self.receiver.sendto(encode_message(MSG_VIDEO_SUBSCRIBE, subscription, sender_id=self.sender_id),
+                             ('127.0.0.1', UDP_VIDEO_PORT))
+    
+    def receive(self, until):
+        while time.time() < until:
+            try:
+                data, _ = self.receiver.recvfrom(MAX_PACKET_SIZE)
+                self.received += len(data)
+            except socket.timeout:
+                pass
+    
+    def publish(self, seq, full, thumb):
+        timestamp = time.time()
+        for layer, payload in ((VIDEO_LAYER_FULL, full), (VIDEO_LAYER_THUMB, thumb)):
+            for fragment in encode_fragments(MSG_VIDEO, {'username': self.username}, payload,
+                                             sender_id=self.sender_id, seq=seq, timestamp=timestamp, flags=layer):
+                self.publisher.sendto(fragment, ('127.0.0.1', UDP_VIDEO_PORT))
+    
+    def speak(self, seq, pcm):
+        self.microphone.sendto(encode_message(MSG_AUDIO, payload=pcm, sender_id=self.sender_id, seq=seq,
+                                              flags=CODEC_PCM), ('127.0.0.1', UDP_AUDIO_PORT))
+    
+    def close(self):
+        for sock in (self.control, self.receiver, self.publisher, self.microphone):
+            sock.close()
+
+def talk(talkers, until):
+    """Talkers take turns every TURN_SECONDS, sending loud PCM at the audio chunk rate."""
+    t = np.arange(AUDIO_CHUNK) / AUDIO_RATE
+    pcm = (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+    seq = 0
+    start = time.time()
+    while time.time() < until:
+        seq += 1
+        talkers[int((time.time() - start) / TURN_SECONDS) % len(talkers)].speak(seq, pcm)
+        time.sleep(AUDIO_CHUNK / AUDIO_RATE)
+
+def run_mode(engine, num_participants, seconds, default_layer, full, thumb, server_args=(), num_talkers=0):
+    """Return total bytes delivered to all participants over the run."""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server', 'server_main.py'), '--engine', engine, *server_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(TCP_PORT)
+        participants = [Participant(i, default_layer) for i in range(num_participants)]
+        time.sleep(0.3)
+        for participant in participants:
+            participant.register()
+        time.sleep(0.3)
+        
+        if num_talkers:
+            # Let the mixer pick up every talker before measuring
+            warmup = time.time() + num_talkers * TURN_SECONDS + 0.5
+            threading.Thread(target=talk, args=(participants[:num_talkers], warmup + seconds + 1), daemon=True).start()
+            time.sleep(warmup - time.time())
+        
+        until = time.time() + seconds + 1
+        receivers = [threading.Thread(target=p.receive, args=(until,)) for p in participants]
+        for thread in receivers:
+            thread.start()
+        for seq in range(int(seconds * FPS)):
+            for participant in participants:
+                participant.publish(seq, full, thumb)
+            time.sleep(1.0 / FPS)
+        for thread in receivers:
+            thread.join()
+        for participant in participants:
+            participant.close()
+        return sum(p.received for p in participants)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--participants', default='6,12', help="comma-separated room sizes")
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--speakers', type=int, default=2, help="talkers taking turns (and stage size)")
+    parser.add_argument('--engine', default='threaded')
+    parser.add_argument('--full-kb', type=int, default=40, help="full layer frame size")
+    parser.add_argument('--thumb-kb', type=int, default=8, help="thumbnail layer frame size")
+    args = parser.parse_args()
+    
+    full = os.urandom(args.full_kb * 1024)
+    thumb = os.urandom(args.thumb_kb * 1024)
+    full_datagrams = len(encode_fragments(MSG_VIDEO, {'username': 'sfu0'}, full))
+    full_wire = len(full) + full_datagrams * (HEADER_SIZE + FRAGMENT.size) + len(encode_meta({'username': 'sfu0'}))
+    stage_args = ['--video-speakers', str(args.speakers)]
+    modes = [
+        ('SFU, full layer subscriptions', VIDEO_LAYER_FULL, [], 0),
+        ('SFU, thumbnail subscriptions', VIDEO_LAYER_THUMB, [], 0),
+        (f'{args.speakers} speakers full, others thumbnail', VIDEO_LAYER_THUMB, stage_args + ['--video-others', 'thumbnail'], args.speakers),
+        (f'{args.speakers} speakers full, others none', VIDEO_LAYER_THUMB, stage_args + ['--video-others', 'none'], args.speakers)
+    ]
+    
+    for n in [int(size) for size in args.participants.split(',')]:
+        legacy = full_wire * n * n * FPS * args.seconds
+        print(f"participants={n} fps={FPS} full={args.full_kb}KB thumb={args.thumb_kb}KB engine={args.engine}")
+        print(f"{'previous relay (full to all, echo)':36} {legacy * 8 / args.seconds / 1e6:8.1f} Mbit/s (computed)")
+        for label, layer, server_args, talkers in modes:
+            delivered = run_mode(args.engine, n, args.seconds, layer, full, thumb, server_args, talkers)
+            print(f"{label:36} {delivered * 8 / args.seconds / 1e6:8.1f} Mbit/s ({legacy / max(delivered, 1):.1f}x less)")
+        print()
@@ -0,0 +1,96 @@
+"""
+Voice Activity Detection Benchmark
+Simulates a meeting where one participant talks at a time (in talkspurts with short
+pauses) while everyone else's microphone picks up background noise, runs every
+chunk through the capture node's VAD, and compares audio traffic with and without it.
+
+Usage: python benchmarks/bench_vad.py [--participants 30] [--seconds 60]
+"""
+
+import argparse
+import timeit
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'client', 'modules'))
+
+from shared.protocol import *
+from shared.audio_codec import get_codec
+from audio_capture_encode import VoiceActivityDetector
+
+def speech_schedule(num_chunks, rng):
+    """Return a bool per chunk: talkspurts of 1-3 s separated by 0.2-0.8 s pauses."""
+    chunk_seconds = AUDIO_CHUNK / AUDIO_RATE
+    talking = np.zeros(num_chunks, dtype=bool)
+    position = 0
+    while position < num_chunks:
+        spurt = int(rng.uniform(1, 3) / chunk_seconds)
+        talking[position:position + spurt] = True
+        position += spurt + int(rng.uniform(0.2, 0.8) / chunk_seconds)
+    return talking
+
+def bench(num_participants, seconds):
+    rng = np.random.default_rng(0)
+    num_chunks = int(seconds * AUDIO_RATE / AUDIO_CHUNK)
+    t = np.arange(AUDIO_CHUNK) / AUDIO_RATE
+    voice = 2500 * np.sin(2 * np.pi * 180 * t) + 1200 * np.sin(2 * np.pi * 540 * t)
+    noise_levels = rng.uniform(20, 300, num_participants)
+    talking = speech_schedule(num_chunks, rng)
+    
+    # The floor passes between participants every ~10 seconds
+    turn_chunks = int(10 * AUDIO_RATE / AUDIO_CHUNK)
+    detectors = [VoiceActivityDetector() for _ in range(num_participants)]
+    codec = get_codec(AUDIO_CODEC)
+    packet_size = len(encode_message(MSG_AUDIO, payload=codec.encode(bytes(AUDIO_CHUNK * 2))))
+    marker_size = len(encode_message(MSG_AUDIO, {'noise_rms': 100}, flags=AUDIO_FLAG_SILENCE))
+    markers_per_chunk = (AUDIO_CHUNK / AUDIO_RATE) / VAD_COMFORT_INTERVAL
+    
+    sent = 0
+    missed_speech = 0
+    speech_chunks = 0
+    mixed_ticks = 0
+    for index in range(num_chunks):
+        speaker = (index // turn_chunks) % num_participants
+        anyone_sent = False
+        for participant in range(num_participants):
+            samples = rng.normal(0, noise_levels[participant], AUDIO_CHUNK)
+            is_talking = participant == speaker and talking[index]
+            if is_talking:
+                samples = samples + voice
+                speech_chunks += 1
+            chunk = np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+            if detectors[participant].is_speech(chunk):
+                sent += 1
+                anyone_sent = True
+            elif is_talking:
+                missed_speech += 1
+        mixed_ticks += anyone_sent
+    
+    silent = num_chunks * num_participants - sent
+    upstream_before = num_chunks * num_participants * packet_size
+    upstream_after = sent * packet_size + silent * markers_per_chunk * marker_size
+    downstream_before = num_chunks * num_participants * packet_size
+    downstream_after = (mixed_ticks * num_participants * packet_size
+                        + (num_chunks - mixed_ticks) * markers_per_chunk * num_participants * marker_size)
+    
+    chunk = np.clip(rng.normal(0, 100, AUDIO_CHUNK), -32768, 32767).astype(np.int16).tobytes()
+    vad = VoiceActivityDetector()
+    vad_us = timeit.timeit(lambda: vad.is_speech(chunk), number=2000) / 2000 * 1e6
+    
+    to_mbps = lambda total: total * 8 / seconds / 1e6
+    print(f"participants={num_participants} seconds={seconds} codec={codec.name} vad={vad_us:.1f}us/chunk")
+    print(f"chunks sent: {sent}/{num_chunks * num_participants} "
+          f"({sent / (num_chunks * num_participants):.1%}); speech chunks missed: {missed_speech}/{speech_chunks}")
+    print(f"upstream   (all mics -> server): {to_mbps(upstream_before):7.2f} -> {to_mbps(upstream_after):6.2f} Mbit/s "
+          f"({upstream_before / upstream_after:.1f}x less)")
+    print(f"downstream (server -> all):      {to_mbps(downstream_before):7.2f} -> {to_mbps(downstream_after):6.2f} Mbit/s "
+          f"({downstream_before / downstream_after:.1f}x less)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--participants', type=int, default=30)
+    parser.add_argument('--seconds', type=int, default=60)
+    args = parser.parse_args()
+    bench(args.participants, args.seconds)
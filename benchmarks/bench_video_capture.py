@@ -0,0 +1,228 @@
+"""
+Video Capture Benchmark
+Runs a capture node against a simulated 1920x1080 30 fps webcam whose driver, like
+V4L2, fills a queue of DRIVER_BUFFERS frames and drops new frames while it is full,
+and compares the previous capture loop (camera left at 1080p30; read, resize,
+encode and send one frame at a time on one thread, timestamped after encoding) with
+the current pipeline (camera switched to the rung's size and rate; capture thread,
+newest-frame slot, encoder threads, sender thread, timestamped at capture). Runs the default 640x480 15 fps rung and the top 1920x1080 30 fps rung,
+each on an idle CPU and with busy processes competing for it, and reports frames
+sent per second, how old each frame really is when it is sent (from the moment the
+camera produced it), and CPU.
+
+Frames are sent to a local UDP socket nobody reads; the bitrate controller is held
+on the rung being measured.
+
+Usage: python benchmarks/bench_video_capture.py [--seconds 8] [--load 2]
+"""
+
+import argparse
+import bisect
+import collections
+import contextlib
+import io
+import resource
+import socket
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+import client.modules.video_capture_encode as video_capture_encode
+from client.modules.video_capture_encode import VideoCaptureNode
+from client.modules.bitrate_control import BitrateController
+
+CAMERA = VIDEO_LADDER[-1]
+DRIVER_BUFFERS = 4
+
+class FakeCamera:
+    """A cv2.VideoCapture stand-in producing frames at a fixed rate into a bounded driver queue."""
+    
+    def __init__(self, width, height, fps):
+        self.width, self.height, self.fps = width, height, fps
+        self.pool = self.frame_pool()
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.read_times = []
+        self.produced_times = []
+        self.last_produced = None
+        self.running = True
+        threading.Thread(target=self.produce, daemon=True).start()
+    
+    def frame_pool(self):
+        rng = np.random.default_rng(0)
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        background = np.dstack([(x * 200 // self.width + 30), (y * 150 // self.height + 60), np.full_like(x, 120)])
+        return [np.clip(background + rng.normal(0, 8, background.shape), 0, 255).astype(np.uint8) for _ in range(4)]
+    
+    def produce(self):
+        start = time.monotonic()
+        count = 0
+        while self.running:
+            if self.pool[0].shape[:2] != (self.height, self.width):
+                # A new mode restarts the stream
+                self.pool = self.frame_pool()
+                start = time.monotonic()
+                count = 0
+            frame = self.pool[count % len(self.pool)].copy()
+            with self.condition:
+                # No free buffer: the driver drops the new frame
+                if len(self.queue) < DRIVER_BUFFERS:
+                    self.queue.append((frame, time.time()))
+                    self.condition.notify()
+            count += 1
+            time.sleep(max(0, start + count / self.fps - time.monotonic()))
+    
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.queue or not self.running)
+            if not self.queue:
+                return False, None
+            frame, produced = self.queue.popleft()
+        self.last_produced = produced
+        self.read_times.append(time.time())
+        self.produced_times.append(produced)
+        return True, frame
+    
+    def produced_before(self, timestamp):
+        """When the camera produced the last frame read before timestamp."""
+        return self.produced_times[bisect.bisect_right(self.read_times, timestamp) - 1]
+    
+    def isOpened(self):
+        return True
+    
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width, cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+                cv2.CAP_PROP_FPS: self.fps}.get(prop, 0)
+    
+    def set(self, prop, value):
+        """Change the size or rate the way a driver does, dropping queued frames."""
+        attribute = {cv2.CAP_PROP_FRAME_WIDTH: 'width', cv2.CAP_PROP_FRAME_HEIGHT: 'height',
+                     cv2.CAP_PROP_FPS: 'fps'}.get(prop)
+        if attribute is None:
+            return False
+        with self.condition:
+            setattr(self, attribute, int(value))
+            self.queue.clear()
+        return True
+    
+    def release(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+class PreviousCaptureNode(VideoCaptureNode):
+    """The capture loop before: capture, resize, encode and send serially on one thread."""
+    
+    def start(self):
+        self.running = True
+        self.capture = self.open_camera()
+        self.controller = BitrateController(int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VIDEO_SOCKET_BUFFER)
+        threading.Thread(target=self.capture_and_send, daemon=True).start()
+    
+    def capture_and_send(self):
+        next_frame = time.monotonic()
+        while self.running:
+            try:
+                ret, frame = self.capture.read()
+                if not ret:
+                    continue
+                now = time.monotonic()
+                if now < next_frame:
+                    continue
+                next_frame = max(next_frame + 1.0 / self.controller.fps, now)
+                
+                full = cv2.resize(frame, (self.controller.width, self.controller.height))
+                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.controller.quality]
+                _, encoded_full = cv2.imencode('.jpg', full, encode_param)
+                thumb = cv2.resize(frame, VIDEO_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+                _, encoded_thumb = cv2.imencode('.jpg', thumb, [int(cv2.IMWRITE_JPEG_QUALITY), VIDEO_THUMB_QUALITY])
+                self.controller.on_frame(len(encoded_full))
+                
+                seq = self.seq
+                self.seq += 1
+                timestamp = time.time()
+                self.send_layer(VIDEO_LAYER_FULL, encoded_full, seq, timestamp)
+                self.send_layer(VIDEO_LAYER_THUMB, encoded_thumb, seq, timestamp)
+            except Exception as e:
+                print(f"[ERROR] Video capture: {e}")
+
+def measured(node_class, camera, rung):
+    """A capture node on the fake camera, held on rung, recording each sent frame's real age."""
+    class MeasuredNode(node_class):
+        def open_camera(self):
+            return camera
+        
+        def start(self):
+            super().start()
+            self.controller.rung = self.controller.ladder.index(rung)
+            self.controller.on_frame = lambda size: False
+            if node_class is not PreviousCaptureNode:
+                self.set_camera_mode(rung)
+        
+        def send_layer(self, layer, encoded_frame, seq, timestamp):
+            super().send_layer(layer, encoded_frame, seq, timestamp)
+            if layer == VIDEO_LAYER_FULL:
+                # The previous loop sends the frame it read last; the pipeline stamps the capture time
+                produced = camera.last_produced if node_class is PreviousCaptureNode else camera.produced_before(timestamp)
+                self.ages.append(time.time() - produced)
+    return MeasuredNode
+
+def run(node_class, rung, load, seconds):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    video_capture_encode.UDP_VIDEO_PORT = sink.getsockname()[1]
+    hogs = [subprocess.Popen([sys.executable, '-c', 'while True: pass']) for _ in range(load)]
+    camera = FakeCamera(*CAMERA)
+    node = measured(node_class, camera, rung)('127.0.0.1', 'bench')
+    node.ages = []
+    try:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        with contextlib.redirect_stdout(io.StringIO()):
+            node.start()
+        time.sleep(1)
+        node.ages.clear()
+        time.sleep(seconds)
+        ages = np.array(node.ages) * 1000
+        end = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        # Let every thread finish its frame before the socket goes away
+        node.running = False
+        camera.release()
+        time.sleep(1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if node_class is PreviousCaptureNode:
+                node.socket.close()
+            else:
+                node.stop()
+        for hog in hogs:
+            hog.kill()
+            hog.wait()
+        sink.close()
+    cpu = end.ru_utime + end.ru_stime - usage.ru_utime - usage.ru_stime
+    return len(ages) / seconds, np.percentile(ages, 50), np.percentile(ages, 95), ages.max(), cpu / (seconds + 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=8)
+    parser.add_argument('--load', type=int, default=2, help="busy processes competing for the CPU")
+    args = parser.parse_args()
+    
+    print(f"camera {CAMERA[0]}x{CAMERA[1]} {CAMERA[2]} fps, {DRIVER_BUFFERS} driver buffers, "
+          f"{os.cpu_count()} CPU(s), {args.seconds:.0f}s per run")
+    print(f"{'rung':14} {'CPU load':9} {'capture':9} {'sent/s':>7} {'age p50':>8} {'age p95':>8} {'age max':>8} {'CPU':>6}")
+    for rung in ((VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS), VIDEO_LADDER[-1]):
+        for load in (0, args.load):
+            for label, node_class in (('previous', PreviousCaptureNode), ('current', VideoCaptureNode)):
+                rate, p50, p95, worst, cpu = run(node_class, rung, load, args.seconds)
+                print(f"{f'{rung[0]}x{rung[1]}@{rung[2]}':14} {f'{load} busy' if load else 'idle':9} {label:9} "
+                      f"{rate:7.1f} {p50:6.0f}ms {p95:6.0f}ms {worst:6.0f}ms {cpu * 100:5.0f}%")
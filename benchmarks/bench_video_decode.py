@@ -0,0 +1,164 @@
+"""
+Video Receive Benchmark
+Sends a meeting's worth of webcam streams over UDP from a separate process (stage
+speakers at 1280x720, everyone else as 320x240 thumbnails) to a render node, while a
+render thread composes the grid 30 times a second as the display would. Compares the
+previous receive loop (every completed frame decoded inline on the socket thread)
+with the current one (the socket thread only reassembles; a decode pool decodes the
+newest frame of each stream at reduced scale when the tile is small). Reports frames
+completed, datagrams the kernel dropped from the full socket buffer, frames decoded,
+how old the frames on screen are, and receiver CPU.
+
+Socket drops are read from /proc/net/udp, so that column needs Linux.
+
+Usage: python benchmarks/bench_video_decode.py [--participants 16] [--stage 4] [--seconds 10]
+"""
+
+import argparse
+import resource
+import socket
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.video_decode_render import VideoRenderNode
+
+STAGE_SIZE = (1280, 720, 20)
+THUMB_SIZE = VIDEO_THUMB_SIZE + (15,)
+RENDER_FPS = 30
+
+def webcam_frames(width, height, count=10):
+    """JPEGs of a talking-head-like scene: a gradient background, a moving face, sensor noise."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for index in range(count):
+        frame = np.dstack([(x * 200 // width + 30), (y * 150 // height + 60), np.full_like(x, 120)]).astype(np.uint8)
+        center = (width // 2 + int(width * 0.05 * np.sin(index / 3)), height // 2)
+        cv2.ellipse(frame, center, (width // 7, height // 4), 0, 0, 360, (90, 140, 200), -1)
+        frame = np.clip(frame + rng.normal(0, 8, frame.shape), 0, 255).astype(np.uint8)
+        _, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), VIDEO_QUALITY])
+        frames.append(encoded.tobytes())
+    return frames
+
+def send(port, participants, stage, seconds):
+    """Sender process: every stream sends its frames as fragment bursts at its frame rate."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    frames = {size: webcam_frames(*size[:2]) for size in (STAGE_SIZE, THUMB_SIZE)}
+    streams = [(index + 1, f"user{index:02}", STAGE_SIZE if index < stage else THUMB_SIZE,
+                VIDEO_LAYER_FULL if index < stage else VIDEO_LAYER_THUMB) for index in range(participants)]
+    start = time.monotonic()
+    next_send = {sender_id: start + sender_id * 0.003 for sender_id, _, _, _ in streams}
+    seq = {sender_id: 0 for sender_id, _, _, _ in streams}
+    sent_frames = 0
+    while time.monotonic() - start < seconds:
+        sender_id = min(next_send, key=next_send.get)
+        time.sleep(max(0, next_send[sender_id] - time.monotonic()))
+        _, username, size, layer = streams[sender_id - 1]
+        payload = frames[size][seq[sender_id] % len(frames[size])]
+        for fragment in encode_fragments(MSG_VIDEO, {'username': username}, payload, sender_id=sender_id,
+                                         seq=seq[sender_id], flags=layer):
+            sock.sendto(fragment, ('127.0.0.1', port))
+        seq[sender_id] += 1
+        sent_frames += 1
+        next_send[sender_id] += 1 / size[2]
+    print(sent_frames)
+
+class PreviousRenderNode(VideoRenderNode):
+    """The receive loop before: every completed frame decoded on the socket thread."""
+    
+    def receive_video(self):
+        while self.running:
+            try:
+                data, _ = self.socket.recvfrom(MAX_PACKET_SIZE)
+                packet = decode_message(data)
+                if packet['type'] == MSG_VIDEO:
+                    completed = self.reassembler.push(packet)
+                    if completed is None:
+                        continue
+                    username, frame_data = completed
+                    frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+                    self.store_frame(username, frame, packet['flags'] & VIDEO_LAYER_MASK, packet['timestamp'])
+            except OSError:
+                return
+
+def measured(node_class):
+    """A render node that records the capture timestamp and count of every frame it is given to show."""
+    class MeasuredNode(node_class):
+        def store_frame(self, username, frame, layer, timestamp):
+            super().store_frame(username, frame, layer, timestamp)
+            self.shown[username] = timestamp
+            self.stored += 1
+    return MeasuredNode
+
+def socket_drops(port):
+    """Datagrams the kernel dropped for the UDP socket bound to port."""
+    with open('/proc/net/udp') as f:
+        for line in f.readlines()[1:]:
+            fields = line.split()
+            if int(fields[1].split(':')[1], 16) == port:
+                return int(fields[-1])
+    return 0
+
+def run(mode, participants, stage, seconds):
+    node = measured(PreviousRenderNode if mode == 'previous' else VideoRenderNode)('127.0.0.1', 'viewer')
+    node.shown, node.stored, ages = {}, 0, []
+    node.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    node.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_SOCKET_BUFFER)
+    node.socket.bind(('127.0.0.1', 0))
+    port = node.socket.getsockname()[1]
+    node.running = True
+    
+    def render():
+        while node.running:
+            node.render_grid()
+            now = time.time()
+            ages.extend(now - timestamp for timestamp in list(node.shown.values()))
+            time.sleep(1 / RENDER_FPS)
+    
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    threading.Thread(target=node.receive_video, daemon=True).start()
+    threading.Thread(target=render, daemon=True).start()
+    sender = subprocess.run([sys.executable, os.path.abspath(__file__), '--send', str(port), str(participants),
+                             str(stage), str(seconds)], capture_output=True, text=True, check=True)
+    time.sleep(0.5)
+    drops = socket_drops(port)
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    node.running = False
+    node.socket.close()
+    node.decoder.stop()
+    
+    sent = int(sender.stdout.split()[-1])
+    cpu = end.ru_utime + end.ru_stime - usage.ru_utime - usage.ru_stime
+    ages_ms = np.array(ages) * 1000
+    print(f"{mode:9} {sent:7} {node.reassembler.completed * 100 / sent:9.1f}% {drops:8} {node.stored / seconds:8.1f} "
+          f"{np.percentile(ages_ms, 50):8.0f} {np.percentile(ages_ms, 95):8.0f} {cpu / seconds * 100:6.0f}%")
+    return node
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--participants', type=int, default=16)
+    parser.add_argument('--stage', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--send', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.send:
+        send(int(args.send[0]), int(args.send[1]), int(args.send[2]), float(args.send[3]))
+        sys.exit()
+    
+    print(f"{args.participants} streams ({args.stage} at {STAGE_SIZE[0]}x{STAGE_SIZE[1]} {STAGE_SIZE[2]} fps, "
+          f"the rest {THUMB_SIZE[0]}x{THUMB_SIZE[1]} {THUMB_SIZE[2]} fps), {args.seconds:.0f}s, {os.cpu_count()} CPU(s)")
+    print(f"{'receiver':9} {'frames':>7} {'complete':>10} {'drops':>8} {'shown/s':>8} {'age p50':>8} {'age p95':>8} {'CPU':>7}")
+    run('previous', args.participants, args.stage, args.seconds)
+    node = run('current', args.participants, args.stage, args.seconds)
+    for username, decoded, skipped, failed, mean_ms, max_ms, scale in node.decoder.report():
+        if username in ('user00', f"user{args.stage:02}"):
+            print(f"  {username}: {decoded} decoded, {skipped} skipped, {mean_ms:.1f} ms mean / {max_ms:.1f} ms max "
+                  f"at 1/{scale} scale")
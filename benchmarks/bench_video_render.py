@@ -0,0 +1,163 @@
+"""
+Video Render Benchmark
+Runs a render node's display loop while every stream delivers new decoded 320x240
+frames at a webcam frame rate, and compares the previous loop (waitKey(1) busy loop
+rebuilding the whole grid with resize, putText and hstack/vstack every iteration)
+with the current one (the window display thread rendering the node's grid on a
+preallocated canvas, only changed tiles redrawn, cached labels, paced to
+VIDEO_DISPLAY_FPS). Reports grids shown per second, the display
+thread's CPU and its CPU per shown grid at 4, 16 and 49 tiles, with streams live and
+with every stream frozen.
+
+No window is opened: imshow is replaced by a no-op and waitKey(delay) by a sleep of
+delay milliseconds, which is what it costs on a real display, so the numbers leave
+out the windowing system's own drawing.
+
+Usage: python benchmarks/bench_video_render.py [--tiles 4,16,49] [--fps 15] [--seconds 5]
+"""
+
+import argparse
+import threading
+import time
+import cv2
+import numpy as np
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from shared.protocol import *
+from client.modules.video_decode_render import VideoRenderNode
+from client.modules.window_display import WindowDisplay
+
+class PreviousRenderNode(VideoRenderNode):
+    """The display loop before: a waitKey(1) busy loop rebuilding the whole grid every iteration."""
+    
+    def display_video(self):
+        while self.running:
+            now = time.monotonic()
+            with self.stream_lock:
+                for username in [name for name, (_, _, updated) in self.video_streams.items()
+                                 if now - updated > VIDEO_STREAM_TIMEOUT]:
+                    del self.video_streams[username]
+                streams = sorted(self.video_streams.items())
+            
+            if not streams:
+                cv2.waitKey(1)
+                continue
+            
+            stage = [(username, frame) for username, (frame, layer, _) in streams if layer == VIDEO_LAYER_FULL]
+            thumbs = [(username, frame) for username, (frame, layer, _) in streams if layer != VIDEO_LAYER_FULL]
+            sections = []
+            if stage:
+                stage_size = (VIDEO_WIDTH, VIDEO_HEIGHT) if len(stage) == 1 else (VIDEO_WIDTH // 2, VIDEO_HEIGHT // 2)
+                sections.append(self.compose_grid(stage, stage_size, len(stage)))
+            if thumbs:
+                sections.append(self.compose_grid(thumbs, VIDEO_THUMB_SIZE, int(np.ceil(np.sqrt(len(thumbs))))))
+            width = max(section.shape[1] for section in sections)
+            grid = np.vstack([np.pad(section, ((0, 0), (0, width - section.shape[1]), (0, 0)))
+                              for section in sections])
+            cv2.imshow('Video Conference', grid)
+            cv2.waitKey(1)
+    
+    def compose_grid(self, streams, tile_size, cols):
+        tile_width, tile_height = tile_size
+        rows = int(np.ceil(len(streams) / cols))
+        grid_frames = []
+        for i in range(rows):
+            row_frames = []
+            for j in range(cols):
+                idx = i * cols + j
+                if idx < len(streams):
+                    username, frame = streams[idx]
+                    frame = cv2.resize(frame, (tile_width, tile_height))
+                    cv2.putText(frame, username, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                    row_frames.append(frame)
+                else:
+                    row_frames.append(np.zeros((tile_height, tile_width, 3), dtype=np.uint8))
+            grid_frames.append(np.hstack(row_frames))
+        return np.vstack(grid_frames)
+
+def headless_window(shown):
+    """Replace the HighGUI calls the display loop makes: count imshow, sleep for waitKey."""
+    cv2.imshow = lambda name, image: shown.append(image.shape)
+    cv2.waitKey = lambda delay=0: time.sleep(delay / 1000) or -1
+    cv2.destroyWindow = lambda name: None
+
+def feed(node, tiles, fps, seconds):
+    """
+    Deliver fresh decoded frames to every stream at fps, as the decoder would, each
+    stream at its own phase (fps 0: one frame each, then frozen).
+    """
+    rng = np.random.default_rng(0)
+    width, height = VIDEO_THUMB_SIZE
+    pool = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    for index in range(tiles):
+        node.store_frame(f"user{index:02}", pool[index % len(pool)].copy(), VIDEO_LAYER_THUMB, time.time())
+    start = time.monotonic()
+    if fps == 0:
+        # Frozen streams still count as alive
+        while time.monotonic() - start < seconds:
+            time.sleep(0.1)
+            with node.stream_lock:
+                for username, (frame, layer, _) in list(node.video_streams.items()):
+                    node.video_streams[username] = (frame, layer, time.monotonic())
+        return
+    next_frame = [start + index / tiles / fps for index in range(tiles)]
+    sent = 0
+    while time.monotonic() - start < seconds:
+        index = min(range(tiles), key=next_frame.__getitem__)
+        time.sleep(max(0, next_frame[index] - time.monotonic()))
+        node.store_frame(f"user{index:02}", pool[sent % len(pool)].copy(), VIDEO_LAYER_THUMB, time.time())
+        next_frame[index] += 1 / fps
+        sent += 1
+
+def run(node_class, tiles, fps, seconds):
+    """Return (grids shown per second, display thread CPU fraction)."""
+    shown = []
+    headless_window(shown)
+    node = node_class('127.0.0.1', 'viewer')
+    node.running = True
+    cpu = []
+    if node_class is PreviousRenderNode:
+        display_loop = node.display_video
+    else:
+        window_display = WindowDisplay()
+        window_display.running = True
+        window_display.attach('Video Conference', node.render_grid)
+        display_loop = window_display.run
+    
+    def display():
+        start = time.thread_time()
+        display_loop()
+        cpu.append(time.thread_time() - start)
+    
+    feeder = threading.Thread(target=feed, args=(node, tiles, fps, seconds), daemon=True)
+    feeder.start()
+    time.sleep(0.2)
+    shown.clear()
+    thread = threading.Thread(target=display, daemon=True)
+    thread.start()
+    feeder.join()
+    node.running = False
+    if node_class is not PreviousRenderNode:
+        window_display.stop()
+    thread.join()
+    node.decoder.stop()
+    return len(shown) / (seconds - 0.2), cpu[0] / (seconds - 0.2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tiles', default='4,16,49')
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    
+    print(f"{VIDEO_THUMB_SIZE[0]}x{VIDEO_THUMB_SIZE[1]} tiles, display paced to {VIDEO_DISPLAY_FPS} fps, {args.seconds:.0f}s per run")
+    print(f"{'tiles':>5} {'streams':8} {'display':9} {'grids/s':>8} {'CPU':>6} {'ms CPU/grid':>12}")
+    for tiles in [int(count) for count in args.tiles.split(',')]:
+        for fps, streams in ((args.fps, f"{args.fps:.0f} fps"), (0, 'frozen')):
+            for label, node_class in (('previous', PreviousRenderNode), ('current', VideoRenderNode)):
+                rate, cpu = run(node_class, tiles, fps, args.seconds)
+                per_grid = f"{cpu * 1000 / rate:12.2f}" if fps else f"{'-':>12}"
+                print(f"{tiles:5} {streams:8} {label:9} {rate:8.1f} {cpu * 100:5.0f}% {per_grid}")
@@ -0,0 +1,75 @@
+"""
+Wire Format Benchmark
+Compares encode/decode cost and bytes on the wire for the binary frame format
+against the previous pickled-dict messages, for each kind of traffic.
+
+Usage: python benchmarks/bench_wire_format.py [--iterations 20000]
+"""
+
+import argparse
+import os
+import pickle
+import struct
+import sys
+import timeit
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+
+USERNAME = "alice"
+
+def sample_messages():
+    """Return (label, pickled dict, binary encode args) for representative traffic."""
+    audio = os.urandom(AUDIO_CHUNK * 2)
+    video = os.urandom(30 * 1024)
+    chunk = os.urandom(8192)
+    screen = os.urandom(300 * 1024)
+    return [
+        ('audio (UDP)', {'username': USERNAME, 'audio': audio},
+         (MSG_AUDIO, None, audio)),
+        ('video (UDP)', {'username': USERNAME, 'frame': video},
+         (MSG_VIDEO, encode_meta({'username': USERNAME}), video)),
+        ('chat (TCP)', {'type': MSG_CHAT, 'username': USERNAME, 'message': "see slide 4"},
+         (MSG_CHAT, {'username': USERNAME, 'message': "see slide 4"}, b'')),
+        ('file chunk (TCP)', {'type': MSG_FILE_DATA, 'username': USERNAME, 'filename': "build.zip",
+                              'data': chunk, 'offset': 81920},
+         (MSG_FILE_DATA, {'filename': "build.zip", 'offset': 81920}, chunk)),
+        ('screen frame (TCP)', {'type': MSG_SCREEN_FRAME, 'username': USERNAME, 'frame': screen},
+         (MSG_SCREEN_FRAME, {'username': USERNAME}, screen)),
+    ]
+
+def pickle_encode(message, tcp):
+    """Previous encoding: pickled dict, length-prefixed on TCP."""
+    data = pickle.dumps(message)
+    return struct.pack('!I', len(data)) + data if tcp else data
+
+def pickle_decode(data, tcp):
+    return pickle.loads(data[4:] if tcp else data)
+
+def bench(iterations):
+    sender_id = user_id(USERNAME)
+    print(f"{'message':20} {'format':7} {'bytes':>8} {'overhead':>9} {'encode us':>10} {'decode us':>10}")
+    for label, pickled, (msg_type, meta, payload) in sample_messages():
+        tcp = 'TCP' in label
+        old = pickle_encode(pickled, tcp)
+        new = encode_message(msg_type, meta, payload, sender_id=sender_id, seq=1)
+        
+        rows = [
+            ('pickle', old,
+             lambda: pickle_encode(pickled, tcp),
+             lambda: pickle_decode(old, tcp)),
+            ('binary', new,
+             lambda: encode_message(msg_type, meta, payload, sender_id=sender_id, seq=1),
+             lambda: decode_message(new)),
+        ]
+        for name, encoded, encode, decode in rows:
+            encode_us = timeit.timeit(encode, number=iterations) / iterations * 1e6
+            decode_us = timeit.timeit(decode, number=iterations) / iterations * 1e6
+            print(f"{label:20} {name:7} {len(encoded):8} {len(encoded) - len(payload):9} "
+                  f"{encode_us:10.2f} {decode_us:10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+    bench(args.iterations)
@@ -0,0 +1,114 @@
+"""
+Adaptive Bitrate Simulation
+Runs the webcam bitrate controller against a simulated bottleneck link (drop-tail
+queue, random loss, capacity changing over time) in virtual time, feeding the real
+ReceiverStats/BitrateController classes, and prints how the target bitrate,
+resolution and quality converge after each capacity change.
+
+Frame sizes come from actually JPEG-encoding a synthetic scene at every ladder rung
+and quality step.
+
+Usage: python benchmarks/sim_adaptive_bitrate.py [--schedule 4000:20,1000:20,2500:20,8000:20] [--loss 0.01]
+"""
+
+import argparse
+import cv2
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from client.modules.bitrate_control import ReceiverStats, BitrateController
+
+SENDER_ID = 1
+RECEIVER_ID = 2
+PROPAGATION_DELAY = 0.005
+QUEUE_SECONDS = 0.1
+
+def synthetic_scene():
+    """A 1080p frame with gradients, shapes and sensor-like noise."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:1080, 0:1920]
+    frame = np.dstack([x * 255 // 1920, y * 255 // 1080, (x + y) * 255 // 3000]).astype(np.uint8)
+    for _ in range(40):
+        center = (int(rng.integers(0, 1920)), int(rng.integers(0, 1080)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(frame, center, int(rng.integers(20, 200)), color, -1)
+    noise = rng.normal(0, 3, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+def frame_size_table():
+    """Encoded JPEG size for every (width, height) in the ladder and every quality step."""
+    scene = synthetic_scene()
+    table = {}
+    for width, height, _ in VIDEO_LADDER:
+        resized = cv2.resize(scene, (width, height))
+        for quality in range(VIDEO_QUALITY_RANGE[0], VIDEO_QUALITY_RANGE[1] + 1, 5):
+            _, encoded = cv2.imencode('.jpg', resized, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            table[(width, height, quality)] = len(encoded)
+    return table
+
+def simulate(schedule, random_loss, table):
+    rng = np.random.default_rng(1)
+    controller = BitrateController()
+    stats = ReceiverStats()
+    fragment_payload = VIDEO_MTU - HEADER_SIZE - FRAGMENT.size
+    
+    phase_ends = np.cumsum([seconds for _, seconds in schedule])
+    capacity_at = lambda t: schedule[min(np.searchsorted(phase_ends, t, side='right'), len(schedule) - 1)][0] * 1000
+    
+    queue_bytes = 0.0
+    last_send = 0.0
+    in_flight = []
+    t = 0.0
+    frame_id = 0
+    next_report = VIDEO_FEEDBACK_INTERVAL
+    sent_bytes = 0
+    stats.last_report = 0.0
+    
+    print(f"{'t':>4} {'link kbit/s':>11} {'target':>7} {'sent':>7} {'resolution':>10} {'fps':>3} "
+          f"{'q':>3} {'loss':>6} {'jitter':>7}")
+    while t < phase_ends[-1]:
+        capacity = capacity_at(t) / 8
+        
+        # Encode one frame (with some scene-dependent variation) and push its fragments
+        # through the bottleneck queue
+        size = int(table[(controller.width, controller.height, controller.quality)] * rng.uniform(0.9, 1.1))
+        count = max(1, -(-size // fragment_payload))
+        queue_bytes = max(0.0, queue_bytes - (t - last_send) * capacity)
+        last_send = t
+        for _ in range(count):
+            datagram = min(size, fragment_payload) + HEADER_SIZE + FRAGMENT.size
+            size -= fragment_payload
+            sent_bytes += datagram
+            if queue_bytes + datagram > capacity * QUEUE_SECONDS or rng.random() < random_loss:
+                continue
+            queue_bytes += datagram
+            in_flight.append((t + queue_bytes / capacity + PROPAGATION_DELAY, frame_id, count, datagram, t))
+        controller.on_frame(table[(controller.width, controller.height, controller.quality)])
+        frame_id += 1
+        t += 1.0 / controller.fps
+        
+        # Deliver everything that has arrived, then report once per interval
+        while in_flight and in_flight[0][0] <= t:
+            arrival, fid, fcount, datagram, timestamp = in_flight.pop(0)
+            stats.on_fragment(SENDER_ID, fid, fcount, datagram, timestamp, arrival)
+        if t >= next_report:
+            next_report += VIDEO_FEEDBACK_INTERVAL
+            for _, loss, jitter_ms, _ in stats.report(now=t):
+                controller.on_feedback(RECEIVER_ID, loss, jitter_ms, now=t)
+                print(f"{t:4.0f} {capacity * 8 / 1000:11.0f} {controller.target_bitrate / 1000:7.0f} "
+                      f"{sent_bytes * 8 / VIDEO_FEEDBACK_INTERVAL / 1000:7.0f} "
+                      f"{controller.width:>5}x{controller.height:<4} {controller.fps:3} {controller.quality:3} "
+                      f"{loss:6.1%} {jitter_ms:5.1f}ms")
+            sent_bytes = 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--schedule', default='4000:20,1000:20,2500:20,8000:20',
+                        help="comma-separated link_kbps:seconds phases")
+    parser.add_argument('--loss', type=float, default=0.01, help="random loss rate on the link")
+    args = parser.parse_args()
+    schedule = [tuple(int(v) for v in phase.split(':')) for phase in args.schedule.split(',')]
+    simulate(schedule, args.loss, frame_size_table())
@@ -0,0 +1,459 @@
+"""
+Headless Bot Client
+Participants without a GUI, webcam, microphone or screen, for load testing a server.
+Each bot registers like a real client (a control connection, with UDP video and audio
+ports registered on it) and speaks the real protocol: synthetic webcam video
+(pre-encoded JPEG frames at a given size and frame rate, as full and thumbnail
+layers), microphone audio (a tone in noise at AUDIO_RATE, or the silence markers of
+a muted microphone), chat messages, and file uploads each downloaded by another bot.
+
+A BotSwarm drives any number of bots from a few threads: one paces every bot's
+sends, one receives on every bot's sockets and measures what arrives (video frame
+relay latency and loss, audio mixes delivered, chat delivery and latency), and one
+runs the file transfers.
+
+Usage: python client/bot_client.py <server_ip> [--bots 20] [--video 640x480@15] [--video-senders 4]
+                                   [--audio-senders 4] [--chat-interval 10] [--file-mb 0] [--seconds 0]
+"""
+
+import argparse
+import heapq
+import queue
+import selectors
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from shared.audio_codec import CODECS, get_codec
+from client.modules.bitrate_control import ReceiverStats
+from client.modules.file_transfer import FileTransfer
+
+def synthetic_video(width, height, quality, count=15):
+    """JPEGs of a talking-head-like scene: a gradient background, a moving face, sensor noise."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for index in range(count):
+        frame = np.dstack([(x * 200 // width + 30), (y * 150 // height + 60), np.full_like(x, 120)]).astype(np.uint8)
+        center = (width // 2 + int(width * 0.05 * np.sin(index / 3)), height // 2)
+        cv2.ellipse(frame, center, (width // 7, height // 4), 0, 0, 360, (90, 140, 200), -1)
+        frame = np.clip(frame + rng.normal(0, 8, frame.shape), 0, 255).astype(np.uint8)
+        _, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        frames.append(encoded.tobytes())
+    return frames
+
+def synthetic_audio(codec, seconds=1.0):
+    """A second of encoded chunks of a 220 Hz tone in noise, loud enough to count as speech."""
+    rng = np.random.default_rng(0)
+    chunks = []
+    state = {}
+    for index in range(int(seconds / MIXER_TICK)):
+        t = (np.arange(AUDIO_CHUNK) + index * AUDIO_CHUNK) / AUDIO_RATE
+        samples = 6000 * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 300, AUDIO_CHUNK)
+        chunks.append(codec.encode(samples.astype(np.int16).tobytes(), state))
+    return chunks
+
+class BotClient:
+    """One participant: a registered control connection and UDP video and audio sockets."""
+    
+    def __init__(self, server_ip, username):
+        self.server_ip = server_ip
+        self.username = username
+        self.sender_id = user_id(username)
+        self.meta = encode_meta({'username': username})
+        self.control = socket.create_connection((server_ip, TCP_PORT))
+        self.control.sendall(encode_message(MSG_REGISTER, {'username': username}, sender_id=self.sender_id))
+        
+        self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_SOCKET_BUFFER)
+        self.video_socket.bind(('0.0.0.0', 0))
+        self.audio_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.audio_socket.bind(('0.0.0.0', 0))
+        self.control.sendall(encode_message(MSG_UDP_REGISTER, {
+            'username': username,
+            'video_port': self.video_socket.getsockname()[1],
+            'audio_port': self.audio_socket.getsockname()[1],
+            'audio_codecs': [codec_id for codec_id in AUDIO_CODEC_PREFERENCE if codec_id in CODECS]
+        }, sender_id=self.sender_id))
+        
+        self.pending = bytearray()
+        self.link_stats = ReceiverStats()
+        self.files = None
+        self.video_seq = 0
+        self.audio_seq = 0
+        self.last_mix = None
+    
+    def send_video(self, full, thumb):
+        """Send one frame as both simulcast layers, like a webcam capture node."""
+        for layer, frame in ((VIDEO_LAYER_FULL, full), (VIDEO_LAYER_THUMB, thumb)):
+            for fragment in encode_fragments(MSG_VIDEO, self.meta, frame, sender_id=self.sender_id,
+                                             seq=self.video_seq, flags=layer):
+                self.video_socket.sendto(fragment, (self.server_ip, UDP_VIDEO_PORT))
+        self.video_seq += 1
+    
+    def send_audio(self, chunk, codec_id):
+        self.audio_socket.sendto(encode_message(MSG_AUDIO, payload=chunk, sender_id=self.sender_id,
+                                                seq=self.audio_seq, flags=codec_id),
+                                 (self.server_ip, UDP_AUDIO_PORT))
+        self.audio_seq += 1
+    
+    def send_silence(self):
+        """What a muted microphone sends: an occasional comfort-noise marker."""
+        self.audio_socket.sendto(encode_message(MSG_AUDIO, {'noise_rms': VAD_MIN_RMS // 2}, sender_id=self.sender_id,
+                                                seq=self.audio_seq, flags=AUDIO_FLAG_SILENCE),
+                                 (self.server_ip, UDP_AUDIO_PORT))
+        self.audio_seq += round(VAD_COMFORT_INTERVAL / MIXER_TICK)
+    
+    def send_chat(self, text):
+        self.control.sendall(encode_message(MSG_CHAT, {'username': self.username, 'message': text},
+                                            sender_id=self.sender_id))
+    
+    def open_files(self, download_dir):
+        """Set up file transfers, with downloads going to a directory of the bot's own."""
+        if self.files is None:
+            self.files = FileTransfer(self.control, self.username, server_ip=self.server_ip,
+                                      download_dir=os.path.join(download_dir, self.username))
+        return self.files
+    
+    def close(self):
+        if self.files:
+            self.files.close()
+        for sock in (self.control, self.video_socket, self.audio_socket):
+            sock.close()
+
+class BotSwarm:
+    def __init__(self, server_ip, video_size=(VIDEO_WIDTH, VIDEO_HEIGHT), video_fps=VIDEO_FPS, video_senders=4,
+                 audio_senders=4, chat_interval=10.0, file_mb=0, file_interval=10.0):
+        self.server_ip = server_ip
+        self.video_fps = video_fps
+        self.video_senders = video_senders
+        self.audio_senders = audio_senders
+        self.chat_interval = chat_interval
+        self.file_size = int(file_mb * 1024 * 1024)
+        self.file_interval = file_interval
+        self.bots = []
+        self.new_bots = queue.Queue()
+        self.selector = selectors.DefaultSelector()
+        self.stats_lock = threading.Lock()
+        self.work_dir = tempfile.mkdtemp(prefix='bots-')
+        self.running = True
+        
+        # Media is encoded once and shared by every bot
+        self.full_frames = synthetic_video(*video_size, VIDEO_QUALITY)
+        self.thumb_frames = synthetic_video(*VIDEO_THUMB_SIZE, VIDEO_THUMB_QUALITY)
+        self.codec = get_codec(AUDIO_CODEC)
+        self.audio_chunks = synthetic_audio(self.codec)
+        
+        # Counters only ever grow; report() works from differences
+        self.counters = {'video_frames_sent': 0, 'video_datagrams': 0, 'video_bytes': 0, 'audio_chunks_sent': 0,
+                         'audio_mixes': 0, 'chat_sent': 0, 'chat_received': 0, 'files_uploaded': 0,
+                         'upload_bytes': 0, 'upload_seconds': 0.0, 'download_bytes': 0, 'download_seconds': 0.0,
+                         'file_errors': 0}
+        self.last_counters = dict(self.counters)
+        self.video_latency = []
+        self.audio_latency = []
+        self.audio_gap = 0.0
+        self.chat_latency = []
+        self.last_report = time.monotonic()
+        self.last_drops = 0
+        
+        threading.Thread(target=self.send_loop, daemon=True).start()
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+        if self.file_size:
+            threading.Thread(target=self.transfer_files, daemon=True).start()
+    
+    def add_bots(self, count, prefix='bot'):
+        """Connect and register count more bots."""
+        for _ in range(count):
+            bot = BotClient(self.server_ip, f"{prefix}{len(self.bots):04}")
+            bot.index = len(self.bots)
+            self.bots.append(bot)
+            for sock, kind in ((bot.control, 'control'), (bot.video_socket, 'video'), (bot.audio_socket, 'audio')):
+                sock.setblocking(False)
+                self.selector.register(sock, selectors.EVENT_READ, (bot, kind))
+            self.new_bots.put(bot)
+    
+    def send_loop(self):
+        """Send every bot's media, silence markers and chat, each on its own deadline."""
+        events = []
+        order = 0
+        while self.running:
+            while not self.new_bots.empty():
+                bot = self.new_bots.get()
+                now = time.monotonic()
+                # Spread bots over the interval so sends don't arrive in lockstep
+                phase = (bot.index * 0.618) % 1
+                if bot.index < self.video_senders:
+                    events.append((now + phase / self.video_fps, order, 'video', bot))
+                if bot.index < self.audio_senders:
+                    events.append((now + phase * MIXER_TICK, order + 1, 'audio', bot))
+                else:
+                    events.append((now + phase * VAD_COMFORT_INTERVAL, order + 1, 'silence', bot))
+                if self.chat_interval:
+                    events.append((now + phase * self.chat_interval, order + 2, 'chat', bot))
+                order += 3
+                heapq.heapify(events)
+            if not events:
+                time.sleep(0.05)
+                continue
+            
+            due, _, kind, bot = events[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(min(delay, 0.05))
+                continue
+            try:
+                if kind == 'video':
+                    frame = bot.video_seq % len(self.full_frames)
+                    bot.send_video(self.full_frames[frame], self.thumb_frames[frame])
+                    self.counters['video_frames_sent'] += 1
+                    interval = 1 / self.video_fps
+                elif kind == 'audio':
+                    bot.send_audio(self.audio_chunks[bot.audio_seq % len(self.audio_chunks)], self.codec.codec_id)
+                    self.counters['audio_chunks_sent'] += 1
+                    interval = MIXER_TICK
+                elif kind == 'silence':
+                    bot.send_silence()
+                    interval = VAD_COMFORT_INTERVAL
+                else:
+                    bot.send_chat(f"message {self.counters['chat_sent']} from {bot.username}")
+                    self.counters['chat_sent'] += 1
+                    interval = self.chat_interval
+            except OSError as e:
+                if self.running:
+                    print(f"[BOTS] {bot.username} send failed: {e}")
+                heapq.heappop(events)
+                continue
+            # Fell behind: carry on from now instead of bursting to catch up
+            heapq.heapreplace(events, (max(due + interval, time.monotonic()), order, kind, bot))
+            order += 1
+    
+    def receive_loop(self):
+        """Drain every bot's sockets and measure what arrives."""
+        while self.running:
+            try:
+                ready = self.selector.select(timeout=0.1)
+            except (OSError, ValueError):
+                continue
+            for key, _ in ready:
+                bot, kind = key.data
+                try:
+                    if kind == 'control':
+                        self.read_control(bot)
+                    else:
+                        self.read_datagrams(bot, key.fileobj, kind)
+                except OSError as e:
+                    if self.running:
+                        print(f"[BOTS] {bot.username} {kind} socket failed: {e}")
+                    self.selector.unregister(key.fileobj)
+    
+    def read_datagrams(self, bot, sock, kind):
+        for _ in range(256):
+            try:
+                data = sock.recv(MAX_PACKET_SIZE)
+            except BlockingIOError:
+                return
+            now = time.time()
+            msg_type, flags, sender_id, seq, timestamp, meta_len, _ = decode_header(data)
+            if kind == 'video' and msg_type == MSG_VIDEO:
+                index, count = FRAGMENT.unpack_from(data, HEADER_SIZE + meta_len)
+                with self.stats_lock:
+                    bot.link_stats.on_fragment((sender_id, flags & VIDEO_LAYER_MASK), seq, count, len(data),
+                                               timestamp, now)
+                self.counters['video_datagrams'] += 1
+                self.counters['video_bytes'] += len(data)
+                if index == count - 1:
+                    self.video_latency.append(now - timestamp)
+            elif kind == 'audio' and msg_type == MSG_AUDIO and not flags & AUDIO_FLAG_SILENCE:
+                self.counters['audio_mixes'] += 1
+                self.audio_latency.append(now - timestamp)
+                # A stalled server shows as a long wait between mixes, whatever their timestamps say
+                if bot.last_mix is not None:
+                    self.audio_gap = max(self.audio_gap, now - bot.last_mix)
+                bot.last_mix = now
+    
+    def read_control(self, bot):
+        data = bot.control.recv(256 * 1024)
+        if not data:
+            raise OSError("connection closed by the server")
+        bot.pending += data
+        while len(bot.pending) >= HEADER_SIZE:
+            size = HEADER_SIZE + frame_body_size(bot.pending)
+            if len(bot.pending) < size:
+                return
+            frame = bytes(bot.pending[:size])
+            del bot.pending[:size]
+            msg_type, _, _, _, timestamp, _, _ = decode_header(frame)
+            if msg_type == MSG_CHAT:
+                self.counters['chat_received'] += 1
+                self.chat_latency.append(time.time() - timestamp)
+            elif msg_type == MSG_FILE_META and bot.files:
+                bot.files.receive_file_meta(decode_message(frame))
+    
+    def transfer_files(self):
+        """Every file_interval, one bot uploads a fresh file and the next one downloads it."""
+        count = 0
+        while self.running:
+            time.sleep(self.file_interval)
+            if len(self.bots) < 2:
+                continue
+            uploader = self.bots[count % len(self.bots)]
+            downloader = self.bots[(count + 1) % len(self.bots)]
+            count += 1
+            try:
+                uploader.open_files(self.work_dir)
+                if uploader.files.file_socket is None:
+                    uploader.files.open_channel()
+                downloader.open_files(self.work_dir)
+                path = os.path.join(self.work_dir, f"upload-{count}.bin")
+                with open(path, 'wb') as f:
+                    for offset in range(0, self.file_size, 1024 * 1024):
+                        f.write(os.urandom(min(1024 * 1024, self.file_size - offset)))
+                
+                start = time.monotonic()
+                file_id = uploader.files.send_file(path)
+                self.counters['upload_seconds'] += time.monotonic() - start
+                os.remove(path)
+                if not file_id:
+                    self.counters['file_errors'] += 1
+                    continue
+                self.counters['files_uploaded'] += 1
+                self.counters['upload_bytes'] += self.file_size
+                
+                deadline = time.monotonic() + 10
+                while file_id not in downloader.files.available_files and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                start = time.monotonic()
+                received = downloader.files.download_file(file_id)
+                self.counters['download_seconds'] += time.monotonic() - start
+                if received:
+                    self.counters['download_bytes'] += self.file_size
+                    os.remove(received)
+                else:
+                    self.counters['file_errors'] += 1
+            except Exception as e:
+                self.counters['file_errors'] += 1
+                print(f"[BOTS] File transfer: {e}")
+    
+    def socket_drops(self):
+        """Datagrams the kernel dropped because a bot's socket buffer was full (Linux only)."""
+        ports = {bot.video_socket.getsockname()[1] for bot in self.bots} | \
+                {bot.audio_socket.getsockname()[1] for bot in self.bots}
+        try:
+            with open('/proc/net/udp') as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            return 0
+        return sum(int(line.split()[-1]) for line in lines if int(line.split()[1].split(':')[1], 16) in ports)
+    
+    def report(self):
+        """Measurements since the previous report, as a dict."""
+        now = time.monotonic()
+        elapsed = max(now - self.last_report, 1e-3)
+        self.last_report = now
+        counters = dict(self.counters)
+        delta = {name: counters[name] - self.last_counters[name] for name in counters}
+        self.last_counters = counters
+        video_latency, self.video_latency = self.video_latency, []
+        audio_latency, self.audio_latency = self.audio_latency, []
+        audio_gap, self.audio_gap = self.audio_gap, 0.0
+        chat_latency, self.chat_latency = self.chat_latency, []
+        with self.stats_lock:
+            links = [report for bot in self.bots for report in bot.link_stats.report()]
+        drops = self.socket_drops()
+        delta['socket_drops'], self.last_drops = drops - self.last_drops, drops
+        
+        def percentiles(samples):
+            if not samples:
+                return (float('nan'),) * 3
+            return tuple(np.percentile(np.array(samples) * 1000, [50, 95, 99]))
+        
+        bots = len(self.bots)
+        chat_expected = delta['chat_sent'] * (bots - 1)
+        return {
+            'bots': bots,
+            'seconds': elapsed,
+            'video_frames_sent': delta['video_frames_sent'],
+            'video_mbps': delta['video_bytes'] * 8 / elapsed / 1e6,
+            'video_datagrams_per_second': delta['video_datagrams'] / elapsed,
+            'video_latency_ms': percentiles(video_latency),
+            'video_loss': float(np.mean([loss for _, loss, _, _ in links])) if links else float('nan'),
+            'audio_chunks_sent': delta['audio_chunks_sent'],
+            'audio_delivered': delta['audio_mixes'] / (bots * elapsed / MIXER_TICK) if bots else float('nan'),
+            'audio_latency_ms': percentiles(audio_latency),
+            'audio_gap_ms': audio_gap * 1000,
+            'chat_sent': delta['chat_sent'],
+            'chat_delivered': delta['chat_received'] / chat_expected if chat_expected else float('nan'),
+            'chat_latency_ms': percentiles(chat_latency),
+            'files_uploaded': delta['files_uploaded'],
+            'upload_mb_per_second': delta['upload_bytes'] / 1e6 / delta['upload_seconds'] if delta['upload_seconds'] else float('nan'),
+            'download_mb_per_second': delta['download_bytes'] / 1e6 / delta['download_seconds'] if delta['download_seconds'] else float('nan'),
+            'file_errors': delta['file_errors'],
+            'socket_drops': delta['socket_drops']
+        }
+    
+    def close(self):
+        self.running = False
+        time.sleep(0.2)
+        for bot in self.bots:
+            try:
+                self.selector.unregister(bot.control)
+                self.selector.unregister(bot.video_socket)
+                self.selector.unregister(bot.audio_socket)
+            except (KeyError, ValueError):
+                pass
+            bot.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def format_report(report):
+    """One line summarising a swarm report."""
+    video = report['video_latency_ms']
+    chat = report['chat_latency_ms']
+    return (f"[BOTS] {report['bots']} bots: video {report['video_mbps']:.1f} Mbit/s received, "
+            f"frame latency p50/p95/p99 {video[0]:.0f}/{video[1]:.0f}/{video[2]:.0f} ms, loss {report['video_loss'] * 100:.1f}%; "
+            f"audio {report['audio_delivered'] * 100:.0f}% of mixes delivered, longest gap {report['audio_gap_ms']:.0f} ms; "
+            f"chat {report['chat_delivered'] * 100:.0f}% delivered, p95 {chat[1]:.0f} ms; "
+            f"{report['socket_drops']} datagrams dropped at full bot sockets")
+
+def parse_video(spec):
+    """'640x480@15' -> ((640, 480), 15)."""
+    size, fps = spec.split('@')
+    width, height = size.split('x')
+    return (int(width), int(height)), float(fps)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless bot participants for load testing a server")
+    parser.add_argument('server_ip')
+    parser.add_argument('--bots', type=int, default=20)
+    parser.add_argument('--video', default=f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}@{VIDEO_FPS}",
+                        help="full layer size and frame rate of the bots that send webcams")
+    parser.add_argument('--video-senders', type=int, default=4, help="bots that send a webcam")
+    parser.add_argument('--audio-senders', type=int, default=4, help="bots that talk; the rest are muted")
+    parser.add_argument('--chat-interval', type=float, default=10.0, help="seconds between each bot's chat messages (0: none)")
+    parser.add_argument('--file-mb', type=float, default=0, help="size of the files bots upload and download (0: none)")
+    parser.add_argument('--file-interval', type=float, default=10.0)
+    parser.add_argument('--seconds', type=float, default=0, help="stop after this long (0: run until interrupted)")
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    args = parser.parse_args()
+    
+    video_size, video_fps = parse_video(args.video)
+    swarm = BotSwarm(args.server_ip, video_size, video_fps, args.video_senders, args.audio_senders,
+                     args.chat_interval, args.file_mb, args.file_interval)
+    swarm.add_bots(args.bots)
+    print(f"[BOTS] {args.bots} bots connected to {args.server_ip}")
+    start = time.monotonic()
+    try:
+        while not args.seconds or time.monotonic() - start < args.seconds:
+            time.sleep(args.report_interval)
+            print(format_report(swarm.report()))
+    except KeyboardInterrupt:
+        pass
+    swarm.close()
@@ -7,9 +7,6 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog, messagebox
 import socket
 import threading
-import pickle
-import struct
-import subprocess
 import sys
 import os
 
@@ -17,7 +14,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from shared.protocol import *
 from modules.text_chat import TextChat
 from modules.file_transfer import FileTransfer
-from modules.screen_sharing import ScreenSharing
+from modules.screen_sharing import ScreenSharing, ScreenViewer
+from modules.media_engine import MediaEngine
 
 class CommunicationClient:
     def __init__(self, root):
@@ -32,11 +30,11 @@ class CommunicationClient:
         
         self.chat_module = None
         self.file_module = None
+        self.file_list = None
         self.screen_module = None
+        self.screen_viewer = None
         
-        self.video_process = None
-        self.audio_capture_process = None
-        self.audio_playback_process = None
+        self.media = None
         
         self.create_login_ui()
     
@@ -72,21 +70,21 @@ class CommunicationClient:
             self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.tcp_socket.connect((self.server_ip, TCP_PORT))
             
-            # Register with server
-            register_msg = {
-                'type': MSG_REGISTER,
-                'username': self.username
-            }
-            msg_data = pickle.dumps(register_msg)
-            msg_length = struct.pack('!I', len(msg_data))
-            self.tcp_socket.sendall(msg_length + msg_data)
+            # Register with server; screen messages come inline unless the screen channel connected
+            self.screen_module = ScreenSharing(self.server_ip, self.username, self.tcp_socket)
+            screen_channel = self.screen_module.connect_channel()
+            register_msg = encode_message(MSG_REGISTER, {'username': self.username, 'screen_channel': screen_channel},
+                                          sender_id=user_id(self.username))
+            self.tcp_socket.sendall(register_msg)
             
             self.running = True
             
             # Initialize modules
             self.chat_module = TextChat(self.tcp_socket, self.username, self.on_chat_message)
-            self.file_module = FileTransfer(self.tcp_socket, self.username, self.on_file_progress)
-            self.screen_module = ScreenSharing(self.tcp_socket, self.username)
+            self.file_module = FileTransfer(self.tcp_socket, self.username, self.on_file_progress, self.server_ip,
+                                            available_callback=self.on_file_available)
+            self.media = MediaEngine(self.server_ip, self.username, self.tcp_socket)
+            self.screen_viewer = ScreenViewer(self.media.display)
             
             # Start TCP receiver thread
             threading.Thread(target=self.receive_tcp, daemon=True).start()
@@ -159,6 +157,15 @@ class CommunicationClient:
         
         ttk.Button(parent, text="Select and Send File", command=self.send_file).pack(pady=10)
         
+        # Shared files stay on the server until someone asks for them
+        ttk.Label(parent, text="Shared Files:").pack(pady=5)
+        self.file_list = tk.Listbox(parent, height=6)
+        self.file_list.pack(fill='x', padx=5)
+        self.file_list_ids = []
+        for file_info in self.file_module.available_files.values():
+            self.on_file_available(file_info)
+        ttk.Button(parent, text="Download Selected", command=self.download_file).pack(pady=5)
+        
         ttk.Label(parent, text="Transfer Status:").pack(pady=5)
         self.file_status = scrolledtext.ScrolledText(parent, wrap=tk.WORD, height=15, state='disabled')
         self.file_status.pack(expand=True, fill='both', padx=5, pady=5)
@@ -183,7 +190,7 @@ class CommunicationClient:
         """Create video/audio controls."""
         ttk.Label(parent, text="Video & Audio Controls", font=('Arial', 12, 'bold')).pack(pady=10)
         
-        ttk.Label(parent, text="These controls launch separate processes for video and audio streaming.").pack(pady=10)
+        ttk.Label(parent, text="Video and audio run inside this client and start straight away.").pack(pady=10)
         
         # Video controls
         video_frame = ttk.LabelFrame(parent, text="Video Conferencing", padding="10")
@@ -228,6 +235,20 @@ class CommunicationClient:
         if filepath and self.file_module:
             threading.Thread(target=self.file_module.send_file, args=(filepath,), daemon=True).start()
     
+    def download_file(self):
+        """Download the selected shared file."""
+        selection = self.file_list.curselection()
+        if selection and self.file_module:
+            file_id = self.file_list_ids[selection[0]]
+            threading.Thread(target=self.file_module.download_file, args=(file_id,), daemon=True).start()
+    
+    def on_file_available(self, file_info):
+        """Callback for a file shared by another participant."""
+        if self.file_list is None or file_info['file_id'] in self.file_list_ids:
+            return
+        self.file_list_ids.append(file_info['file_id'])
+        self.file_list.insert(tk.END, f"{file_info['filename']} ({file_info['size']} bytes) from {file_info['sender']}")
+    
     def on_file_progress(self, status):
         """Callback for file transfer progress."""
         self.file_status.config(state='normal')
@@ -248,45 +269,34 @@ class CommunicationClient:
             self.screen_status.config(text="Not sharing")
     
     def start_video_capture(self):
-        """Start video capture process."""
+        """Start sending the webcam."""
         try:
-            self.video_process = subprocess.Popen([
-                'python3', 'modules/video_capture_encode.py',
-                self.server_ip, self.username
-            ], cwd='client')
+            if not self.media.start_video_capture():
+                raise RuntimeError("no camera found")
             messagebox.showinfo("Video", "Video capture started")
         except Exception as e:
             messagebox.showerror("Error", f"Could not start video capture: {e}")
     
     def start_video_display(self):
-        """Start video display process."""
+        """Start showing the other participants' video."""
         try:
-            subprocess.Popen([
-                'python3', 'modules/video_decode_render.py',
-                self.server_ip, self.username
-            ], cwd='client')
+            self.media.start_video_display()
             messagebox.showinfo("Video", "Video display started in new window")
         except Exception as e:
             messagebox.showerror("Error", f"Could not start video display: {e}")
     
     def start_audio_capture(self):
-        """Start audio capture process."""
+        """Start sending the microphone."""
         try:
-            self.audio_capture_process = subprocess.Popen([
-                'python3', 'modules/audio_capture_encode.py',
-                self.server_ip, self.username
-            ], cwd='client')
+            self.media.start_audio_capture()
             messagebox.showinfo("Audio", "Audio capture started")
         except Exception as e:
             messagebox.showerror("Error", f"Could not start audio capture: {e}")
     
     def start_audio_playback(self):
-        """Start audio playback process."""
+        """Start playing the meeting's audio."""
         try:
-            self.audio_playback_process = subprocess.Popen([
-                'python3', 'modules/audio_decode_playback.py',
-                self.server_ip, self.username
-            ], cwd='client')
+            self.media.start_audio_playback()
             messagebox.showinfo("Audio", "Audio playback started")
         except Exception as e:
             messagebox.showerror("Error", f"Could not start audio playback: {e}")
@@ -295,17 +305,16 @@ class CommunicationClient:
         """Receive TCP messages from server."""
         while self.running:
             try:
-                length_data = self.recv_exact(4)
-                if not length_data:
+                header = self.recv_exact(HEADER_SIZE)
+                if not header:
                     break
                 
-                msg_length = struct.unpack('!I', length_data)[0]
-                msg_data = self.recv_exact(msg_length)
-                if not msg_data:
+                body = self.recv_exact(frame_body_size(header))
+                if body is None:
                     break
                 
-                message = pickle.loads(msg_data)
-                msg_type = message.get('type')
+                message = decode_message(header + body)
+                msg_type = message['type']
                 
                 if msg_type == MSG_CHAT:
                     self.chat_module.receive_message(message)
@@ -313,14 +322,16 @@ class CommunicationClient:
                 elif msg_type == MSG_FILE_META:
                     self.file_module.receive_file_meta(message)
                     
-                elif msg_type == MSG_FILE_DATA:
-                    self.file_module.receive_file_data(message)
-                    
                 elif msg_type == MSG_USER_LIST:
+                    # The first user list confirms registration, so the screen and file channels can attach
+                    if not self.screen_module.channel_open:
+                        self.screen_module.open_channel(self.screen_viewer.receive)
+                    if self.file_module.file_socket is None:
+                        self.file_module.open_channel()
                     self.update_user_list(message.get('users', []))
                     
-                elif msg_type == MSG_SCREEN_FRAME:
-                    pass
+                elif msg_type in (MSG_SCREEN_START, MSG_SCREEN_FRAME, MSG_SCREEN_STOP):
+                    self.screen_viewer.receive(message)
                     
             except Exception as e:
                 if self.running:
@@ -346,6 +357,14 @@ class CommunicationClient:
     def on_closing(self):
         """Handle window closing."""
         self.running = False
+        if self.media:
+            self.media.stop()
+        if self.screen_viewer:
+            self.screen_viewer.stop()
+        if self.screen_module:
+            self.screen_module.close_channel()
+        if self.file_module:
+            self.file_module.close()
         if self.tcp_socket:
             self.tcp_socket.close()
         self.root.destroy()
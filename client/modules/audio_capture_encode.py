@@ -1,26 +1,83 @@
 """
 Audio Capture and Encode Node
-Captures audio from microphone, encodes it, and sends via UDP to server.
+Captures audio from microphone, encodes it with the configured codec, and sends via UDP to server.
+Silence is detected locally and replaced by occasional comfort-noise markers.
 """
 
 import pyaudio
 import socket
-import pickle
 import threading
+import time
+import numpy as np
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from shared.audio_codec import get_codec
+
+class VoiceActivityDetector:
+    """
+    Classifies each chunk as speech or silence from its RMS energy against an
+    adaptive noise floor, with the zero-crossing rate catching quieter unvoiced
+    sounds. A hangover keeps the stream open briefly after speech so word endings
+    and short pauses are not clipped.
+    """
+    
+    def __init__(self, hangover=VAD_HANGOVER):
+        self.hangover = hangover
+        self.noise_floor = None
+        self.hangover_left = 0
+        self.rms = 0.0
+    
+    def is_speech(self, audio_data):
+        """Return True if this chunk should be transmitted."""
+        samples = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
+        self.rms = float(np.sqrt(np.mean(samples * samples)))
+        zcr = np.count_nonzero(np.diff(np.signbit(samples))) / len(samples)
+        if self.noise_floor is None:
+            # Seed from the first chunk, capped in case the user is already talking
+            self.noise_floor = min(self.rms, VAD_MIN_RMS)
+        
+        threshold = max(VAD_MIN_RMS, self.noise_floor * VAD_ENERGY_RATIO)
+        voiced = self.rms > threshold
+        unvoiced = self.rms > threshold / 2 and VAD_ZCR_RANGE[0] < zcr < VAD_ZCR_RANGE[1]
+        
+        if voiced or unvoiced:
+            self.hangover_left = self.hangover
+            # Creep up slowly even while talking so a new steady background noise is learned
+            self.noise_floor += (self.rms - self.noise_floor) * 0.002
+            return True
+        
+        # Drop to a quieter floor immediately, rise towards a louder one gradually
+        if self.rms < self.noise_floor:
+            self.noise_floor = self.rms
+        else:
+            self.noise_floor += (self.rms - self.noise_floor) * 0.05
+        
+        if self.hangover_left > 0:
+            self.hangover_left -= 1
+            return True
+        return False
 
 class AudioCaptureNode:
-    def __init__(self, server_ip, username):
+    def __init__(self, server_ip, username, codec_id=AUDIO_CODEC, sock=None):
         self.server_ip = server_ip
         self.username = username
         self.running = False
         self.audio = None
         self.stream = None
-        self.socket = None
+        # A socket shared with the media engine
+        self.socket = sock
+        self.own_socket = sock is None
+        self.sender_id = user_id(username)
+        self.seq = 0
+        self.codec = get_codec(codec_id)
+        self.codec_state = {}
+        self.vad = VoiceActivityDetector()
+        self.last_comfort = 0
+        self.sent = 0
+        self.suppressed = 0
         
     def start(self):
         """Start audio capture and transmission."""
@@ -35,9 +92,10 @@ class AudioCaptureNode:
             frames_per_buffer=AUDIO_CHUNK
         )
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.own_socket:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         
-        print(f"[AUDIO CAPTURE] Started for {self.username}")
+        print(f"[AUDIO CAPTURE] Started for {self.username} ({self.codec.name})")
         
         threading.Thread(target=self.capture_and_send, daemon=True).start()
     
@@ -47,11 +105,23 @@ class AudioCaptureNode:
             try:
                 audio_data = self.stream.read(AUDIO_CHUNK, exception_on_overflow=False)
                 
-                packet = {
-                    'username': self.username,
-                    'audio': audio_data
-                }
-                data = pickle.dumps(packet)
+                # Sequence numbers keep counting through silence so receivers see the gap
+                seq = self.seq
+                self.seq += 1
+                
+                if self.vad.is_speech(audio_data):
+                    self.sent += 1
+                    data = encode_message(MSG_AUDIO, payload=self.codec.encode(audio_data, self.codec_state),
+                                          sender_id=self.sender_id, seq=seq, flags=self.codec.codec_id)
+                else:
+                    self.suppressed += 1
+                    # Speech after a pause doesn't continue the chunk before it
+                    self.codec_state.clear()
+                    if time.monotonic() - self.last_comfort < VAD_COMFORT_INTERVAL:
+                        continue
+                    self.last_comfort = time.monotonic()
+                    data = encode_message(MSG_AUDIO, {'noise_rms': int(self.vad.noise_floor)},
+                                          sender_id=self.sender_id, seq=seq, flags=AUDIO_FLAG_SILENCE)
                 
                 if len(data) < MAX_PACKET_SIZE:
                     self.socket.sendto(data, (self.server_ip, UDP_AUDIO_PORT))
@@ -67,9 +137,9 @@ class AudioCaptureNode:
             self.stream.close()
         if self.audio:
             self.audio.terminate()
-        if self.socket:
+        if self.socket and self.own_socket:
             self.socket.close()
-        print("[AUDIO CAPTURE] Stopped")
+        print(f"[AUDIO CAPTURE] Stopped (sent {self.sent} chunks, suppressed {self.suppressed} as silence)")
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -1,26 +1,36 @@
 """
 Audio Decode and Playback Node
-Receives mixed audio from server and plays through speakers.
+Receives mixed audio from server, decodes it, and plays through speakers.
 """
 
 import pyaudio
 import socket
-import pickle
 import threading
+import time
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from shared.audio_codec import CODECS, get_codec, codec_id_from_flags
+from client.modules.jitter_buffer import JitterBuffer
 
 class AudioPlaybackNode:
-    def __init__(self, server_ip, username):
+    def __init__(self, server_ip, username, control=None, sock=None):
         self.server_ip = server_ip
         self.username = username
         self.running = False
         self.audio = None
         self.stream = None
-        self.socket = None
+        # The client's registered control connection, if any, carries the port registration
+        self.control = control
+        # A socket shared with the media engine, which then passes datagrams to handle_datagram
+        self.socket = sock
+        self.own_socket = sock is None
+        self.sender_id = user_id(username)
+        self.jitter_buffer = JitterBuffer()
+        self.codec_state = {}
+        self.last_decoded = None
         
     def start(self):
         """Start receiving and playing audio."""
@@ -35,48 +45,77 @@ class AudioPlaybackNode:
             frames_per_buffer=AUDIO_CHUNK
         )
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(('0.0.0.0', UDP_AUDIO_PORT + 1000))
+        if self.own_socket:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind(('0.0.0.0', UDP_AUDIO_PORT + 1000))
+        port = self.socket.getsockname()[1]
         
-        print(f"[AUDIO PLAYBACK] Started for {self.username} on port {UDP_AUDIO_PORT + 1000}")
+        print(f"[AUDIO PLAYBACK] Started for {self.username} on port {port}")
         
-        self.register_udp_port()
+        self.register_udp_port(port)
         
-        threading.Thread(target=self.receive_and_play, daemon=True).start()
+        if self.own_socket:
+            threading.Thread(target=self.receive_audio, daemon=True).start()
+        threading.Thread(target=self.play_audio, daemon=True).start()
     
-    def register_udp_port(self):
-        """Register audio port with server via TCP."""
+    def register_udp_port(self, port):
+        """Register audio port with server, on the control connection or else a connection of its own."""
+        message = {
+            'username': self.username,
+            'video_port': None,
+            'audio_port': port,
+            'audio_codecs': [codec_id for codec_id in AUDIO_CODEC_PREFERENCE if codec_id in CODECS]
+        }
         try:
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tcp_sock.connect((self.server_ip, TCP_PORT))
+            if self.control:
+                self.control.sendall(encode_message(MSG_UDP_REGISTER, message, sender_id=self.sender_id))
+            else:
+                tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                tcp_sock.connect((self.server_ip, TCP_PORT))
+                tcp_sock.sendall(encode_message(MSG_UDP_REGISTER, message, sender_id=self.sender_id))
+                tcp_sock.close()
             
-            message = {
-                'type': MSG_UDP_REGISTER,
-                'username': self.username,
-                'video_port': None,
-                'audio_port': UDP_AUDIO_PORT + 1000
-            }
-            
-            msg_data = pickle.dumps(message)
-            msg_length = struct.pack('!I', len(msg_data))
-            tcp_sock.sendall(msg_length + msg_data)
-            tcp_sock.close()
-            
-            print(f"[AUDIO PLAYBACK] Registered UDP port with server")
+            print("[AUDIO PLAYBACK] Registered UDP port with server")
         except Exception as e:
             print(f"[ERROR] Audio port registration: {e}")
     
-    def receive_and_play(self):
-        """Receive audio packets and play them."""
+    def receive_audio(self):
+        """Receive audio datagrams from the node's own socket."""
         while self.running:
             try:
                 data, _ = self.socket.recvfrom(MAX_PACKET_SIZE)
-                packet = pickle.loads(data)
+                self.handle_datagram(data, decode_message(data))
+            except Exception as e:
+                print(f"[ERROR] Audio receive: {e}")
+    
+    def handle_datagram(self, data, packet):
+        """Put a received audio packet in the jitter buffer."""
+        if packet['type'] != MSG_AUDIO or packet['sender_id'] == self.sender_id:
+            return
+        if packet['flags'] & AUDIO_FLAG_SILENCE:
+            self.jitter_buffer.set_comfort_noise(packet.get('noise_rms', 0))
+            return
+        codec = get_codec(codec_id_from_flags(packet['flags']))
+        if codec is not None:
+            # The codec carries state from chunk to chunk of one stream, not across a gap
+            if self.last_decoded != (packet['seq'] - 1, codec.codec_id):
+                self.codec_state.clear()
+            self.last_decoded = (packet['seq'], codec.codec_id)
+            self.jitter_buffer.push(packet['seq'], packet['timestamp'], codec.decode(packet['payload'], self.codec_state))
+    
+    def play_audio(self):
+        """Play one chunk per period from the jitter buffer; the device clock paces the loop."""
+        last_stats = time.monotonic()
+        while self.running:
+            try:
+                self.stream.write(self.jitter_buffer.pop())
                 
-                username = packet.get('username')
-                if username != self.username:
-                    audio_data = packet.get('audio')
-                    self.stream.write(audio_data)
+                if time.monotonic() - last_stats >= JITTER_STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    stats = self.jitter_buffer.stats()
+                    print(f"[AUDIO PLAYBACK] delay={stats['delay_ms']:.0f}ms target={stats['target_ms']:.0f}ms "
+                          f"jitter={stats['jitter_ms']:.1f}ms lost={stats['lost']} late={stats['late']} "
+                          f"concealed={stats['concealed']}")
                     
             except Exception as e:
                 print(f"[ERROR] Audio playback: {e}")
@@ -89,7 +128,7 @@ class AudioPlaybackNode:
             self.stream.close()
         if self.audio:
             self.audio.terminate()
-        if self.socket:
+        if self.socket and self.own_socket:
             self.socket.close()
         print("[AUDIO PLAYBACK] Stopped")
 
@@ -0,0 +1,219 @@
+"""
+Adaptive Video Bitrate
+Receiver-side link statistics and the sender-side controller that turns receivers'
+loss and jitter reports into a target bitrate, then into JPEG quality, resolution
+and frame rate for the webcam stream.
+"""
+
+import threading
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from shared.protocol import *
+from shared.stats import InterarrivalJitter
+
+class ReceiverStats:
+    """
+    Tracks, per video sender, how many fragments arrived out of how many were sent,
+    the interarrival jitter of frames (RFC 3550 style, from capture timestamps) and
+    the received bitrate. Frames are only counted once they have had time to finish
+    arriving, so a frame straddling two reports is not mistaken for loss. A stream that
+    resumes after a pause longer than RESUME_PAUSE (the server stopped forwarding a
+    layer, e.g. a speaker left the stage) restarts its count instead of reporting the
+    skipped frame ids as lost.
+    """
+    RESTART_GAP = 100
+    RESUME_PAUSE = VIDEO_FEEDBACK_INTERVAL
+    
+    def __init__(self, settle_time=VIDEO_REASSEMBLY_TIMEOUT):
+        self.settle_time = settle_time
+        self.senders = {}
+        self.last_report = time.time()
+    
+    def on_fragment(self, sender_id, frame_id, count, size, timestamp, arrival=None):
+        """Record one received fragment."""
+        if arrival is None:
+            arrival = time.time()
+        sender = self.senders.get(sender_id)
+        if sender is None:
+            sender = self.senders[sender_id] = {
+                'frames': {},
+                'last_settled': None,
+                'fragments_per_frame': count,
+                'bytes': 0,
+                'jitter': InterarrivalJitter(),
+                'last_arrival': arrival,
+                'resumes': set()
+            }
+        sender['bytes'] += size
+        
+        frame = sender['frames'].get(frame_id)
+        if frame is None:
+            last_settled = sender['last_settled']
+            if last_settled is not None and 0 <= last_settled - frame_id < self.RESTART_GAP:
+                return
+            frame = sender['frames'][frame_id] = [count, 0, arrival]
+            if arrival - sender['last_arrival'] > self.RESUME_PAUSE:
+                sender['resumes'].add(frame_id)
+            sender['last_arrival'] = arrival
+            sender['jitter'].update(timestamp, arrival)
+        frame[1] += 1
+    
+    def report(self, now=None):
+        """Return [(sender_id, loss, jitter_ms, kbps)] for frames settled since the last report."""
+        if now is None:
+            now = time.time()
+        elapsed = max(now - self.last_report, 1e-3)
+        self.last_report = now
+        
+        reports = []
+        for sender_id, sender in self.senders.items():
+            settled = sorted(frame_id for frame_id, frame in sender['frames'].items()
+                             if now - frame[2] >= self.settle_time)
+            if not settled:
+                continue
+            expected = received = 0
+            for frame_id in settled:
+                count, arrived, _ = sender['frames'].pop(frame_id)
+                expected += count
+                received += min(arrived, count)
+                sender['fragments_per_frame'] += (count - sender['fragments_per_frame']) / 8
+            
+            # Frame ids that never showed up at all were lost entirely, unless the stream
+            # was paused before the frame after them
+            previous = sender['last_settled']
+            for frame_id in settled:
+                gap = frame_id - previous - 1 if previous is not None else 0
+                if 0 < gap < self.RESTART_GAP and frame_id not in sender['resumes']:
+                    expected += gap * sender['fragments_per_frame']
+                sender['resumes'].discard(frame_id)
+                previous = frame_id
+            sender['last_settled'] = settled[-1]
+            
+            loss = 1 - received / expected if expected else 0.0
+            kbps = sender['bytes'] * 8 / elapsed / 1000
+            sender['bytes'] = 0
+            reports.append((sender_id, max(0.0, loss), sender['jitter'].seconds * 1000, kbps))
+        return reports
+
+class BitrateController:
+    """
+    Keeps a target bitrate from receiver reports (multiplicative decrease on loss or
+    jitter, gentle increase on a clean link; the worst recent receiver decides) and
+    steers JPEG quality towards that budget, stepping along VIDEO_LADDER when quality
+    runs out of range.
+    """
+    
+    def __init__(self, max_width=None, max_height=None):
+        self.ladder = [rung for rung in VIDEO_LADDER
+                       if max_width is None or (rung[0] <= max_width and rung[1] <= max_height)]
+        if not self.ladder:
+            self.ladder = VIDEO_LADDER[:1]
+        start = (VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS)
+        self.rung = self.ladder.index(start) if start in self.ladder else len(self.ladder) - 1
+        self.quality = VIDEO_QUALITY
+        self.target_bitrate = VIDEO_START_BITRATE
+        self.frame_size = None
+        self.frames_since_change = 0
+        self.reports = {}
+        self.last_update = 0
+        # Feedback arrives on another thread than the frames, and encoders read the settings on a third
+        self.lock = threading.Lock()
+    
+    @property
+    def width(self):
+        return self.ladder[self.rung][0]
+    
+    @property
+    def height(self):
+        return self.ladder[self.rung][1]
+    
+    @property
+    def fps(self):
+        return self.ladder[self.rung][2]
+    
+    def settings(self):
+        """(width, height, quality) to encode the next frame with, all from the same rung."""
+        with self.lock:
+            return self.width, self.height, self.quality
+    
+    def sending_bitrate(self):
+        """Bits per second the current settings actually produce."""
+        return (self.frame_size or 0) * 8 * self.fps
+    
+    def app_limited(self):
+        """Whether the stream is already at its best rung and quality."""
+        return self.rung == len(self.ladder) - 1 and self.quality >= VIDEO_QUALITY_RANGE[1]
+    
+    def on_feedback(self, receiver_id, loss, jitter_ms, now=None):
+        """Fold one receiver report into the target bitrate, at most once per feedback interval."""
+        with self.lock:
+            if now is None:
+                now = time.monotonic()
+            self.reports[receiver_id] = (loss, jitter_ms, now)
+            if now - self.last_update < VIDEO_FEEDBACK_INTERVAL * 0.9:
+                return
+            self.last_update = now
+        
+            fresh = [report for report in self.reports.values() if now - report[2] < 2 * VIDEO_FEEDBACK_INTERVAL]
+            worst_loss = max(report[0] for report in fresh)
+            worst_jitter = max(report[1] for report in fresh)
+        
+            if worst_loss > VIDEO_LOSS_HIGH:
+                self.target_bitrate *= max(0.5, 1 - 0.5 * worst_loss)
+            elif worst_jitter > VIDEO_JITTER_HIGH:
+                self.target_bitrate *= 0.85
+            elif worst_loss < VIDEO_LOSS_LOW:
+                self.target_bitrate *= 1.08
+                if self.app_limited():
+                    # Nothing left to spend a bigger budget on: don't let the target run away
+                    self.target_bitrate = min(self.target_bitrate, max(VIDEO_MIN_BITRATE, 1.5 * self.sending_bitrate()))
+            self.target_bitrate = max(VIDEO_MIN_BITRATE, min(VIDEO_MAX_BITRATE, self.target_bitrate))
+    
+    def on_frame(self, size):
+        """Record one encoded frame size; returns True if quality or rung changed."""
+        with self.lock:
+            self.frame_size = size if self.frame_size is None else self.frame_size * 0.8 + size * 0.2
+            self.frames_since_change += 1
+            if self.frames_since_change < max(2, self.fps // 2):
+                return False
+        
+            budget = self.target_bitrate / 8 / self.fps
+            min_quality, max_quality = VIDEO_QUALITY_RANGE
+            if self.frame_size > budget * 1.1:
+                if self.quality > min_quality:
+                    # Far over budget (e.g. right after a capacity drop): come down faster
+                    step = 15 if self.frame_size > budget * 1.5 else 5
+                    self.quality = max(min_quality, self.quality - step)
+                elif self.rung > 0:
+                    self.set_rung(self.rung - 1)
+                else:
+                    return False
+            elif self.frame_size < budget * 0.8:
+                if self.quality < max_quality:
+                    self.quality = min(max_quality, self.quality + 5)
+                elif self.rung < len(self.ladder) - 1 and self.fits_next_rung(budget):
+                    self.set_rung(self.rung + 1)
+                else:
+                    return False
+            else:
+                return False
+            self.frames_since_change = 0
+            return True
+    
+    def fits_next_rung(self, budget):
+        """Whether the next rung at middle quality is likely to fit the budget."""
+        width, height, fps = self.ladder[self.rung + 1]
+        # JPEG size grows a little slower than the pixel count, and dropping from top
+        # to middle quality roughly halves it
+        scale = ((width * height) / (self.width * self.height)) ** 0.75
+        predicted = self.frame_size * scale * 0.5
+        return predicted * fps < budget * self.fps * 0.9
+    
+    def set_rung(self, rung):
+        """Switch resolution/frame rate, restarting quality from the middle of the range."""
+        self.rung = rung
+        self.quality = sum(VIDEO_QUALITY_RANGE) // 2
+        self.frame_size = None
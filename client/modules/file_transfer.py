@@ -1,130 +1,417 @@
 """
 File Transfer Module
-Handles file uploads and downloads with progress tracking.
+Handles file uploads and downloads with progress tracking. Uploads travel on a
+dedicated file channel in large chunks, sent with sendfile, into the server's file
+store; other participants only hear about the file and download it on demand, over
+several parallel range streams, straight into a preallocated file on disk. Every
+chunk is checked against the file's manifest of chunk hashes, and only missing
+chunks ever move: an interrupted upload or download resumes where it stopped, and
+chunks already on disk are reused.
 """
 
 import os
-import pickle
-import struct
+import socket
 import threading
+import time
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from shared.file_io import (preallocate, read_at, write_at, send_file_data, file_chunks, chunk_count, chunk_digest,
+                            chunk_runs, split_ranges, manifest_digest, manifest_id, file_manifest, check_manifest,
+                            unpack_chunks)
 
 class FileTransfer:
-    def __init__(self, tcp_socket, username, progress_callback=None):
+    def __init__(self, tcp_socket, username, progress_callback=None, server_ip=None, download_dir=FILE_DOWNLOAD_DIR,
+                 available_callback=None):
         self.tcp_socket = tcp_socket
         self.username = username
         self.progress_callback = progress_callback
+        self.available_callback = available_callback
+        self.server_ip = server_ip
+        self.download_dir = download_dir
+        self.file_socket = None
+        self.send_lock = threading.Lock()
         self.available_files = {}
-        
-    def send_file(self, filepath):
-        """Send file to server for distribution."""
+        self.downloads = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+    
+    def open_channel(self):
+        """
+        Open the file channel for uploads (once registered on the control connection).
+        A server silent for FILE_CHANNEL_TIMEOUT counts as a dropped channel.
+        """
         try:
-            if not os.path.exists(filepath):
-                print(f"[ERROR] File not found: {filepath}")
-                return
-            
-            filename = os.path.basename(filepath)
-            filesize = os.path.getsize(filepath)
-            
-            # Send file metadata
+            self.file_socket = socket.create_connection((self.server_ip, FILE_PORT), timeout=FILE_CHANNEL_TIMEOUT)
+            self.file_socket.sendall(encode_message(MSG_REGISTER, {'username': self.username},
+                                                    sender_id=user_id(self.username)))
+        except OSError as e:
+            print(f"[ERROR] File channel: {e}")
+            self.file_socket = None
+            return
+        print(f"[FILE] File channel open on port {FILE_PORT}")
+    
+    def close_channel(self):
+        if self.file_socket:
+            self.file_socket.close()
+            self.file_socket = None
+    
+    def send_file(self, filepath):
+        """
+        Upload a file to the server's file store on the file channel, sending only the
+        chunks the server reports missing. A dropped channel is reopened and the upload
+        resumed, up to FILE_RETRIES times. Returns the file_id, or None if it failed.
+        """
+        if not os.path.exists(filepath):
+            print(f"[ERROR] File not found: {filepath}")
+            return None
+        
+        filename = os.path.basename(filepath)
+        filesize = os.path.getsize(filepath)
+        delay = FILE_RETRY_DELAY
+        # One upload at a time, so chunks of different files never interleave
+        with self.send_lock, open(filepath, 'rb') as f:
+            manifest = file_manifest(f.fileno(), filesize)
+            file_id = manifest_id(manifest)
             meta_message = {
-                'type': MSG_FILE_META,
                 'username': self.username,
                 'filename': filename,
-                'filesize': filesize
+                'filesize': filesize,
+                'file_id': file_id
             }
-            self.send_tcp(meta_message)
-            
-            # Send file data in chunks
-            with open(filepath, 'rb') as f:
-                sent = 0
-                while True:
-                    chunk = f.read(8192)
-                    if not chunk:
-                        break
-                    
-                    data_message = {
-                        'type': MSG_FILE_DATA,
-                        'username': self.username,
-                        'filename': filename,
-                        'data': chunk,
-                        'offset': sent
-                    }
-                    self.send_tcp(data_message)
+            for attempt in range(FILE_RETRIES + 1):
+                if attempt:
+                    print(f"[FILE] Resuming {filename} in {delay:.0f}s")
+                    time.sleep(delay)
+                    delay *= 2
+                try:
+                    if not self.file_socket:
+                        self.open_channel()
+                    if not self.file_socket:
+                        continue
+                    self.upload_chunks(f, meta_message, manifest)
                     
-                    sent += len(chunk)
+                    print(f"[FILE] Sent: {filename} ({filesize} bytes)")
                     if self.progress_callback:
-                        progress = int((sent / filesize) * 100)
-                        self.progress_callback(f"Sending: {progress}%")
-            
-            print(f"[FILE] Sent: {filename} ({filesize} bytes)")
-            if self.progress_callback:
-                self.progress_callback(f"Sent: {filename}")
+                        self.progress_callback(f"Sent: {filename}")
+                    return file_id
                 
-        except Exception as e:
-            print(f"[ERROR] File send: {e}")
+                except OSError as e:
+                    print(f"[ERROR] File send: {e}")
+                    self.close_channel()
+                except ValueError as e:
+                    print(f"[ERROR] File send: {e}")
+                    self.close_channel()
+                    break
+        
+        if self.progress_callback:
+            self.progress_callback(f"Send failed: {filename}")
+        return None
     
-    def receive_file_meta(self, message):
-        """Handle file metadata from server."""
-        filename = message.get('filename')
-        filesize = message.get('filesize')
-        sender = message.get('username')
+    def upload_chunks(self, f, meta_message, manifest):
+        """Announce an upload with its manifest, then send the chunks the server asks for until it has them all."""
+        filename = meta_message['filename']
+        filesize = meta_message['filesize']
+        file_id = meta_message['file_id']
+        sender_id = user_id(self.username)
+        self.file_socket.sendall(encode_message(MSG_FILE_META, meta_message, manifest, sender_id=sender_id))
+        missing = self.receive_status(file_id)
+        if missing:
+            print(f"[FILE] Sending {filename}: {len(missing)} of {chunk_count(filesize)} chunks")
+        reported = [0]
         
-        self.available_files[filename] = {
-            'sender': sender,
+        for _ in range(FILE_RETRIES + 1):
+            if not missing:
+                return
+            runs = chunk_runs(missing, filesize)
+            sent = [filesize - sum(length for _, length in runs)]
+            
+            def progress(count):
+                self.bytes_sent += count
+                sent[0] += count
+                percent = sent[0] * 100 // filesize
+                if self.progress_callback and percent >= reported[0] + 10:
+                    reported[0] = percent
+                    self.progress_callback(f"Sending {filename}: {percent}%")
+            
+            for offset, length in runs:
+                send_file_data(self.file_socket, f, {'file_id': file_id}, offset, length, sender_id, progress)
+            missing = self.receive_status(file_id)
+        raise ValueError(f"chunks of {filename} keep failing their hash on the server; was the file changed?")
+    
+    def receive_status(self, file_id):
+        """
+        Wait for the server's MSG_FILE_STATUS for an upload; returns the chunks it still
+        needs. A busy reply (another channel is still sending the file) is retried like
+        a dropped channel.
+        """
+        header = bytearray(HEADER_SIZE)
+        if not self.recv_into_exact(self.file_socket, memoryview(header)):
+            raise OSError("file channel closed")
+        body = bytearray(frame_body_size(header))
+        if not self.recv_into_exact(self.file_socket, memoryview(body)):
+            raise OSError("file channel closed")
+        message = decode_message(header + body)
+        if message['type'] != MSG_FILE_STATUS or message.get('file_id') != file_id:
+            raise OSError("unexpected reply on the file channel")
+        if message.get('busy'):
+            raise OSError("the file is still being uploaded on another channel")
+        return unpack_chunks(message['payload'])
+    
+    def receive_file_meta(self, message):
+        """Handle a file announcement from the server: the file can now be downloaded."""
+        file_id = message.get('file_id')
+        manifest = bytes(message.get('payload') or b'')
+        filesize = message.get('filesize') or 0
+        if not file_id:
+            return
+        if not check_manifest(manifest, file_id, filesize):
+            print(f"[ERROR] File announcement: manifest does not match {file_id}")
+            return
+        file_info = {
+            'file_id': file_id,
+            'filename': os.path.basename(message.get('filename') or '') or file_id,
+            'sender': message.get('username'),
             'size': filesize,
-            'received_data': {}
+            'manifest': manifest
         }
+        self.available_files[file_id] = file_info
         
         if self.progress_callback:
-            self.progress_callback(f"Available: {filename} from {sender} ({filesize} bytes)")
+            self.progress_callback(f"Available: {file_info['filename']} from {file_info['sender']} ({file_info['size']} bytes)")
+        if self.available_callback:
+            self.available_callback(file_info)
+    
+    def download_file(self, file_id, streams=FILE_DOWNLOAD_STREAMS):
+        """
+        Download an announced file. Chunks already on disk are reused; the rest are split
+        over parallel range streams and requested again if a stream drops, up to
+        FILE_RETRIES times. Blocks until done; returns the saved path, or None if it
+        failed (the '.part' file is kept, so the next attempt resumes from it).
+        """
+        file_info = self.available_files.get(file_id)
+        if file_info is None or file_id in self.downloads:
+            return None
+        download = self.begin_download(file_id)
+        if download is None:
+            return None
+        
+        delay = FILE_RETRY_DELAY
+        for attempt in range(FILE_RETRIES + 1):
+            missing = sorted(download['missing'])
+            if not missing or download['aborted']:
+                break
+            if attempt:
+                print(f"[FILE] {file_info['filename']}: {len(missing)} chunks missing, retrying in {delay:.0f}s")
+                time.sleep(delay)
+                delay *= 2
+            threads = [threading.Thread(target=self.stream_range, args=(download, ranges), daemon=True)
+                       for ranges in split_ranges(missing, file_info['size'], streams)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        if not download['missing'] and not download['aborted'] and not download['saved']:
+            self.save_file(file_id)
+        if not download['saved']:
+            print(f"[ERROR] File receive: {file_info['filename']} incomplete")
+            if self.progress_callback:
+                self.progress_callback(f"Download failed: {file_info['filename']}")
+            self.abort_file(file_id)
+            return None
+        return os.path.join(self.download_dir, file_info['filename'])
+    
+    def begin_download(self, file_id):
+        """Open the preallocated '.part' file for a download, keeping one left by an earlier attempt."""
+        file_info = self.available_files[file_id]
+        try:
+            os.makedirs(self.download_dir, exist_ok=True)
+            # Same directory as the destination, so the final rename is atomic
+            temp_path = os.path.join(self.download_dir, f".{file_info['filename']}.{file_id[:16]}.part")
+            resumed = os.path.exists(temp_path)
+            fd = os.open(temp_path, os.O_RDWR | os.O_CREAT, 0o644)
+            preallocate(fd, file_info['size'])
+        except OSError as e:
+            print(f"[ERROR] File receive: {e}")
+            return None
+        
+        download = {
+            'file_id': file_id,
+            'filename': file_info['filename'],
+            'size': file_info['size'],
+            'manifest': file_info['manifest'],
+            'fd': fd,
+            'temp_path': temp_path,
+            'missing': set(range(chunk_count(file_info['size']))),
+            'received': 0,
+            'progress': 0,
+            'lock': threading.Lock(),
+            'streams': [],
+            'saved': False,
+            'aborted': False
+        }
+        self.downloads[file_id] = download
+        try:
+            self.reuse_local_chunks(download, resumed)
+        except OSError as e:
+            print(f"[ERROR] File receive: {e}")
+        return download
+    
+    def reuse_local_chunks(self, download, resumed):
+        """
+        Take every chunk whose hash matches the manifest from disk instead of the
+        network: from the '.part' of an earlier attempt, and from files in the
+        downloads folder with the same name or size (an older version or a copy).
+        """
+        wanted = {}
+        for index in download['missing']:
+            wanted.setdefault(manifest_digest(download['manifest'], index), []).append(index)
+        candidates = [download['temp_path']] if resumed else []
+        for name in sorted(os.listdir(self.download_dir)):
+            path = os.path.join(self.download_dir, name)
+            if not name.startswith('.') and os.path.isfile(path) and \
+                    (name == download['filename'] or os.path.getsize(path) == download['size']):
+                candidates.append(path)
+        
+        total = len(download['missing'])
+        for path in candidates:
+            with open(path, 'rb') as f:
+                for offset, count in file_chunks(0, os.fstat(f.fileno()).st_size):
+                    if not wanted:
+                        break
+                    data = read_at(f.fileno(), offset, count)
+                    for index in wanted.pop(chunk_digest(data), []):
+                        if path != download['temp_path'] or index * FILE_CHANNEL_CHUNK != offset:
+                            write_at(download['fd'], data, index * FILE_CHANNEL_CHUNK)
+                        download['missing'].discard(index)
+                        download['received'] += len(data)
+        if total - len(download['missing']):
+            print(f"[FILE] {download['filename']}: {total - len(download['missing'])} of {total} chunks found on disk")
+    
+    def stream_range(self, download, ranges):
+        """Fetch byte ranges of a download on one range stream, receiving chunks into one reused buffer."""
+        try:
+            sock = socket.create_connection((self.server_ip, FILE_PORT))
+            download['streams'].append(sock)
+            with sock:
+                if download['aborted']:
+                    return
+                for offset, length in ranges:
+                    sock.sendall(encode_message(MSG_FILE_REQUEST, {'username': self.username, 'file_id': download['file_id'],
+                                                                   'offset': offset, 'length': length},
+                                                sender_id=user_id(self.username)))
+                buffer = bytearray(FILE_CHANNEL_CHUNK)
+                expected = sum(length for _, length in ranges)
+                received = 0
+                while received < expected:
+                    header = bytearray(HEADER_SIZE)
+                    if not self.recv_into_exact(sock, memoryview(header)):
+                        raise OSError("range stream closed early")
+                    msg_type, _, _, _, _, meta_len, payload_len = decode_header(header)
+                    if msg_type != MSG_FILE_DATA or payload_len > expected - received:
+                        raise ValueError("unexpected frame on range stream")
+                    meta = bytearray(meta_len)
+                    if len(buffer) < payload_len:
+                        buffer = bytearray(payload_len)
+                    payload = memoryview(buffer)[:payload_len]
+                    if not self.recv_into_exact(sock, memoryview(meta)) or not self.recv_into_exact(sock, payload):
+                        raise OSError("range stream closed early")
+                    
+                    message = decode_meta(header, meta)
+                    message['payload'] = payload
+                    self.receive_file_data(message)
+                    received += payload_len
+        except (OSError, ValueError) as e:
+            if not download['aborted']:
+                print(f"[ERROR] Range stream: {e}")
+    
+    def recv_into_exact(self, sock, view):
+        """Fill a buffer from a socket; False if it closed first."""
+        received = 0
+        while received < len(view):
+            count = sock.recv_into(view[received:])
+            if not count:
+                return False
+            received += count
+        return True
     
     def receive_file_data(self, message):
-        """Handle file data chunks from server."""
-        filename = message.get('filename')
-        data = message.get('data')
+        """Handle file data chunks from server: check each against the manifest and write it at its offset."""
+        file_id = message.get('file_id')
+        download = self.downloads.get(file_id)
+        if download is None or download['fd'] is None:
+            return
+        
+        data = message['payload']
         offset = message.get('offset')
+        index = offset // FILE_CHANNEL_CHUNK
+        if offset % FILE_CHANNEL_CHUNK or chunk_digest(data) != manifest_digest(download['manifest'], index):
+            # Left missing, so it is requested again
+            print(f"[ERROR] File receive: chunk {index} of {download['filename']} failed its hash")
+            return
         
-        if filename in self.available_files:
-            self.available_files[filename]['received_data'][offset] = data
-            
-            # Check if file is complete
-            total_received = sum(len(d) for d in self.available_files[filename]['received_data'].values())
-            total_size = self.available_files[filename]['size']
-            
-            if total_received >= total_size:
-                self.save_file(filename)
+        # Range streams report concurrently; the lock also keeps the file open while writing
+        with download['lock']:
+            if download['fd'] is None:
+                return
+            try:
+                write_at(download['fd'], data, offset)
+            except OSError as e:
+                print(f"[ERROR] File receive: {e}")
+                return
+            if index in download['missing']:
+                download['missing'].discard(index)
+                download['received'] += len(data)
+                self.bytes_received += len(data)
+            complete = not download['missing']
+            progress = download['received'] * 100 // download['size']
+            report = progress >= download['progress'] + 10 and not complete
+            if report:
+                download['progress'] = progress
+        
+        if self.progress_callback and report:
+            self.progress_callback(f"Receiving {download['filename']}: {progress}%")
+        if complete:
+            self.save_file(file_id)
     
-    def save_file(self, filename):
-        """Save received file to downloads folder."""
+    def save_file(self, file_id):
+        """Move a completely received file from its '.part' file into the downloads folder."""
+        download = self.downloads.pop(file_id)
         try:
-            downloads_dir = 'downloads'
-            os.makedirs(downloads_dir, exist_ok=True)
-            
-            filepath = os.path.join(downloads_dir, filename)
-            file_info = self.available_files[filename]
-            
-            with open(filepath, 'wb') as f:
-                sorted_offsets = sorted(file_info['received_data'].keys())
-                for offset in sorted_offsets:
-                    f.write(file_info['received_data'][offset])
+            with download['lock']:
+                os.close(download['fd'])
+                download['fd'] = None
+            filepath = os.path.join(self.download_dir, download['filename'])
+            os.replace(download['temp_path'], filepath)
+            download['saved'] = True
             
-            print(f"[FILE] Received: {filename}")
+            print(f"[FILE] Received: {download['filename']}")
             if self.progress_callback:
-                self.progress_callback(f"Downloaded: {filename}")
-            
+                self.progress_callback(f"Downloaded: {download['filename']}")
+        
         except Exception as e:
             print(f"[ERROR] File save: {e}")
     
-    def send_tcp(self, message):
-        """Send TCP message."""
-        try:
-            msg_data = pickle.dumps(message)
-            msg_length = struct.pack('!I', len(msg_data))
-            self.tcp_socket.sendall(msg_length + msg_data)
-        except Exception as e:
-            print(f"[ERROR] TCP send: {e}")
-
+    def abort_file(self, file_id):
+        """Stop a download and close its range streams; its '.part' file is kept to resume from."""
+        download = self.downloads.pop(file_id, None)
+        if download is None:
+            return
+        download['aborted'] = True
+        for sock in download['streams']:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with download['lock']:
+            if download['fd'] is not None:
+                os.close(download['fd'])
+                download['fd'] = None
+    
+    def close(self):
+        """Close the file channel and stop every download still in progress."""
+        self.close_channel()
+        for file_id in list(self.downloads):
+            self.abort_file(file_id)
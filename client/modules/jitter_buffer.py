@@ -0,0 +1,151 @@
+"""
+Audio Jitter Buffer
+Reorders received audio chunks and releases them at an adaptive playout delay,
+concealing lost chunks, for the playback node.
+"""
+
+import threading
+import math
+import time
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from shared.protocol import *
+from shared.stats import InterarrivalJitter
+
+class JitterBuffer:
+    """
+    Reorders received audio chunks by sequence number and releases one per chunk
+    period at an adaptive delay. The target depth follows the interarrival jitter
+    estimate (RFC 3550 style, from capture timestamps); missing chunks are concealed
+    by repeating the last chunk with a fade, and chunks arriving after their
+    playout slot are discarded, even after the buffer drained and re-primed. Gaps
+    with nothing to conceal are filled with comfort noise at the level last
+    announced by the server. Excess delay is cut by skipping a chunk at most once
+    every JITTER_SHRINK_INTERVAL chunks played.
+    """
+    
+    def __init__(self, min_depth=JITTER_MIN_DEPTH, max_depth=JITTER_MAX_DEPTH):
+        self.chunk_duration = AUDIO_CHUNK / AUDIO_RATE
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.target_depth = min_depth
+        self.silence = bytes(AUDIO_CHUNK * 2)
+        self.lock = threading.Lock()
+        self.packets = {}
+        self.next_seq = None
+        # Survives re-priming, so stragglers from before a pause are still recognised as late
+        self.last_played = None
+        self.since_shrink = 0
+        self.jitter = InterarrivalJitter()
+        self.last_samples = None
+        self.conceal_run = 0
+        self.noise_rms = 0
+        self.rng = np.random.default_rng()
+        
+        self.received = 0
+        self.late = 0
+        self.lost = 0
+        self.concealed = 0
+        self.dropped = 0
+    
+    def push(self, seq, timestamp, payload):
+        """Add one received chunk."""
+        arrival = time.time()
+        with self.lock:
+            self.received += 1
+            
+            jitter = self.jitter.update(timestamp, arrival)
+            depth = math.ceil(JITTER_SPREAD * jitter / self.chunk_duration) + 1
+            self.target_depth = max(self.min_depth, min(self.max_depth, depth))
+            
+            if self.last_played is not None and seq <= self.last_played:
+                if self.last_played - seq <= JITTER_RESTART_GAP:
+                    self.late += 1
+                    return
+                # Far behind the playout point: the stream restarted
+                self.packets.clear()
+                self.next_seq = None
+                self.last_played = None
+            self.packets[seq] = bytes(payload)
+            
+            # A burst beyond the maximum delay: skip ahead rather than let latency grow
+            while len(self.packets) > self.max_depth:
+                oldest = min(self.packets)
+                del self.packets[oldest]
+                self.dropped += 1
+                self.last_played = max(oldest, self.last_played or 0)
+                if self.next_seq is not None:
+                    self.next_seq = oldest + 1
+    
+    def set_comfort_noise(self, noise_rms):
+        """Set the background level played while nobody is speaking."""
+        self.noise_rms = noise_rms
+    
+    def comfort_noise(self):
+        """Return a chunk of low-level noise, or silence if no level is known."""
+        if not self.noise_rms:
+            return self.silence
+        noise = self.rng.normal(0, self.noise_rms, AUDIO_CHUNK)
+        return np.clip(noise, -32768, 32767).astype(np.int16).tobytes()
+    
+    def pop(self):
+        """Return the next chunk to play (real, concealed, or comfort noise)."""
+        with self.lock:
+            if self.next_seq is None:
+                # Priming: wait until the cushion reaches the target depth
+                if len(self.packets) < self.target_depth:
+                    return self.comfort_noise()
+                self.next_seq = min(self.packets)
+            
+            payload = self.packets.pop(self.next_seq, None)
+            self.last_played = self.next_seq
+            self.next_seq += 1
+            self.since_shrink += 1
+            
+            if payload is not None:
+                self.conceal_run = 0
+                self.last_samples = payload
+                
+                # Shrink the delay when jitter has calmed down, one chunk now and then
+                if len(self.packets) > self.target_depth and self.next_seq in self.packets \
+                        and self.since_shrink >= JITTER_SHRINK_INTERVAL:
+                    del self.packets[self.next_seq]
+                    self.last_played = self.next_seq
+                    self.next_seq += 1
+                    self.dropped += 1
+                    self.since_shrink = 0
+                return payload
+            
+            if self.packets:
+                self.lost += 1
+            return self.conceal()
+    
+    def conceal(self):
+        """Repeat the last chunk with a fade, then fall silent and re-prime."""
+        self.conceal_run += 1
+        if self.last_samples is None or self.conceal_run > JITTER_MAX_CONCEAL:
+            if not self.packets:
+                self.next_seq = None
+            return self.comfort_noise()
+        
+        self.concealed += 1
+        gain = JITTER_CONCEAL_FADE ** self.conceal_run
+        samples = np.frombuffer(self.last_samples, dtype=np.int16) * gain
+        return samples.astype(np.int16).tobytes()
+    
+    def stats(self):
+        """Return current delay and loss counters."""
+        with self.lock:
+            return {
+                'delay_ms': len(self.packets) * self.chunk_duration * 1000,
+                'target_ms': self.target_depth * self.chunk_duration * 1000,
+                'jitter_ms': self.jitter.seconds * 1000,
+                'received': self.received,
+                'lost': self.lost,
+                'late': self.late,
+                'concealed': self.concealed,
+                'dropped': self.dropped
+            }
@@ -0,0 +1,123 @@
+"""
+Media Engine
+Hosts the webcam, video display, microphone and speaker nodes inside the client
+process rather than as one spawned Python process each. The nodes share one UDP
+socket per medium, bound to a port the OS picks and registered with the server on
+the client's control connection, and one receive thread per socket hands every
+datagram to the node it is meant for. cv2 and numpy are already loaded with the
+client, so a stream starts in milliseconds. The engine's window display runs every
+OpenCV window of the process (the video grid and shared screens) on one thread.
+"""
+
+import socket
+import threading
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from shared.protocol import *
+from client.modules.video_capture_encode import VideoCaptureNode
+from client.modules.video_decode_render import VideoRenderNode
+from client.modules.window_display import WindowDisplay
+
+class MediaEngine:
+    def __init__(self, server_ip, username, control):
+        self.server_ip = server_ip
+        self.username = username
+        self.control = control
+        self.running = True
+        self.lock = threading.Lock()
+        self.video_capture = None
+        self.video_render = None
+        self.audio_capture = None
+        self.audio_playback = None
+        self.display = WindowDisplay()
+        self.display.start()
+        
+        self.video_socket = self.open_socket(VIDEO_SOCKET_BUFFER)
+        self.audio_socket = self.open_socket()
+        threading.Thread(target=self.receive, args=(self.video_socket, self.dispatch_video), daemon=True).start()
+        threading.Thread(target=self.receive, args=(self.audio_socket, self.dispatch_audio), daemon=True).start()
+    
+    def open_socket(self, buffer_size=None):
+        """A UDP socket on a free port, for both sending and receiving one medium."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        sock.bind(('0.0.0.0', 0))
+        return sock
+    
+    def receive(self, sock, dispatch):
+        """Read datagrams from a shared socket and dispatch each one."""
+        while self.running:
+            try:
+                data, _ = sock.recvfrom(MAX_PACKET_SIZE)
+                dispatch(data, decode_message(data))
+            except OSError:
+                if self.running:
+                    print("[ERROR] Media receive: socket closed")
+                return
+            except Exception as e:
+                print(f"[ERROR] Media receive: {e}")
+    
+    def dispatch_video(self, data, packet):
+        """Feedback on our webcam goes to the capture node, everything else to the display."""
+        if packet['type'] == MSG_VIDEO_FEEDBACK:
+            node = self.video_capture
+            if node and node.running:
+                node.handle_feedback(packet)
+        else:
+            node = self.video_render
+            if node and node.running:
+                node.handle_datagram(data, packet)
+    
+    def dispatch_audio(self, data, packet):
+        node = self.audio_playback
+        if node and node.running:
+            node.handle_datagram(data, packet)
+    
+    def start_node(self, name, create):
+        """Start a node unless the one held in attribute name is already running; returns whether it runs."""
+        with self.lock:
+            node = getattr(self, name)
+            if node is None or not node.running:
+                node = create()
+                setattr(self, name, node)
+                node.start()
+            return node.running
+    
+    def stop_node(self, name):
+        with self.lock:
+            node = getattr(self, name)
+            setattr(self, name, None)
+        if node and node.running:
+            node.stop()
+    
+    def start_video_capture(self):
+        return self.start_node('video_capture', lambda: VideoCaptureNode(
+            self.server_ip, self.username, sock=self.video_socket))
+    
+    def start_video_display(self):
+        return self.start_node('video_render', lambda: VideoRenderNode(
+            self.server_ip, self.username, control=self.control, sock=self.video_socket, display=self.display))
+    
+    def start_audio_capture(self):
+        # PortAudio is only loaded once audio is actually turned on
+        from client.modules.audio_capture_encode import AudioCaptureNode
+        return self.start_node('audio_capture', lambda: AudioCaptureNode(
+            self.server_ip, self.username, sock=self.audio_socket))
+    
+    def start_audio_playback(self):
+        from client.modules.audio_decode_playback import AudioPlaybackNode
+        return self.start_node('audio_playback', lambda: AudioPlaybackNode(
+            self.server_ip, self.username, control=self.control, sock=self.audio_socket))
+    
+    def stop(self):
+        """Stop every node and close the shared sockets."""
+        for name in ('video_capture', 'video_render', 'audio_capture', 'audio_playback'):
+            self.stop_node(name)
+        self.running = False
+        self.display.stop()
+        self.video_socket.close()
+        self.audio_socket.close()
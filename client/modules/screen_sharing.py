@@ -1,27 +1,94 @@
 """
 Screen Sharing Module
-Allows presenter to capture and share screen using TCP for reliability.
+Allows presenter to capture and share screen using TCP for reliability, on a
+dedicated screen channel so frames never hold up chat on the control connection
+(or inline on the control connection when the screen channel can't connect).
+Only the tiles that changed since the previous capture are sent (see screen_codec.py).
+Other participants' shared screens are rebuilt and shown by ScreenViewer.
 """
 
 import mss
 import numpy as np
-import cv2
-import pickle
-import struct
+import socket
 import threading
-import time
+import queue
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from client.modules.screen_codec import ScreenEncoder, ScreenCanvas, CapturePacer, prepare_capture
 
 class ScreenSharing:
-    def __init__(self, tcp_socket, username):
-        self.tcp_socket = tcp_socket
+    def __init__(self, server_ip, username, control=None, region=SCREEN_REGION):
+        self.server_ip = server_ip
         self.username = username
+        self.control = control
+        self.region = region
+        self.screen_socket = None
+        self.channel_open = False
+        self.send_lock = threading.Lock()
         self.sharing = False
         self.share_thread = None
+        self.encoder = None
+    
+    def connect_channel(self):
+        """
+        Connect the screen channel before registering; returns whether it connected,
+        which the MSG_REGISTER tells the server as 'screen_channel'. Without it, screen
+        messages travel inline on the control connection.
+        """
+        try:
+            self.screen_socket = socket.create_connection((self.server_ip, SCREEN_PORT))
+            return True
+        except OSError as e:
+            print(f"[ERROR] Screen channel: {e}, screen sharing stays on the control connection")
+            return False
+    
+    def open_channel(self, on_message):
+        """
+        Attach the connected screen channel (once registered on the control connection)
+        and pass every screen message received on it to on_message from a background thread.
+        """
+        self.channel_open = True
+        if self.screen_socket is None:
+            return
+        self.send_tcp(MSG_REGISTER, {'username': self.username})
+        threading.Thread(target=self.receive_channel, args=(on_message,), daemon=True).start()
+        print(f"[SCREEN SHARE] Screen channel open on port {SCREEN_PORT}")
+    
+    def receive_channel(self, on_message):
+        """Read screen messages from the screen channel until it closes; sends then go inline."""
+        try:
+            while True:
+                header = self.recv_exact(HEADER_SIZE)
+                if not header:
+                    break
+                body = self.recv_exact(frame_body_size(header))
+                if body is None:
+                    break
+                on_message(decode_message(header + body))
+        except OSError:
+            pass
+        self.screen_socket = None
+    
+    def recv_exact(self, num_bytes):
+        """Receive exact number of bytes from the screen channel."""
+        data = bytearray(num_bytes)
+        view = memoryview(data)
+        received = 0
+        while received < num_bytes:
+            count = self.screen_socket.recv_into(view[received:])
+            if not count:
+                return None
+            received += count
+        return bytes(data)
+    
+    def close_channel(self):
+        """Close the screen channel."""
+        self.sharing = False
+        if self.screen_socket:
+            self.screen_socket.close()
         
     def start_sharing(self):
         """Start screen sharing."""
@@ -29,18 +96,15 @@ class ScreenSharing:
             return
         
         self.sharing = True
+        self.encoder = ScreenEncoder()
         
         # Send start message
-        message = {
-            'type': MSG_SCREEN_START,
-            'username': self.username
-        }
-        self.send_tcp(message)
+        self.send_tcp(MSG_SCREEN_START, {'username': self.username})
         
         self.share_thread = threading.Thread(target=self.capture_and_send, daemon=True)
         self.share_thread.start()
         
-        print(f"[SCREEN SHARE] Started sharing")
+        print("[SCREEN SHARE] Started sharing")
     
     def stop_sharing(self):
         """Stop screen sharing."""
@@ -50,52 +114,124 @@ class ScreenSharing:
         self.sharing = False
         
         # Send stop message
-        message = {
-            'type': MSG_SCREEN_STOP,
-            'username': self.username
-        }
-        self.send_tcp(message)
+        self.send_tcp(MSG_SCREEN_STOP, {'username': self.username})
         
-        print(f"[SCREEN SHARE] Stopped sharing")
+        print(f"[SCREEN SHARE] Stopped sharing ({self.encoder.keyframes} keyframes, "
+              f"{self.encoder.deltas} deltas, {self.encoder.unchanged} unchanged captures skipped)")
+    
+    def set_region(self, region):
+        """Capture a rectangle ({'left', 'top', 'width', 'height'}, e.g. one window) or None for the whole monitor."""
+        self.region = region
     
     def capture_and_send(self):
-        """Capture screen and send frames to server."""
+        """Capture screen and send frames to server, at a frame rate that follows the content."""
+        pacer = CapturePacer()
         with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            
             while self.sharing:
                 try:
-                    # Capture screen
-                    screenshot = sct.grab(monitor)
-                    frame = np.array(screenshot)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                    
-                    # Resize for bandwidth
-                    frame = cv2.resize(frame, (1024, 768))
+                    # Capture screen (the region may change while sharing)
+                    screenshot = sct.grab(self.region or sct.monitors[SCREEN_MONITOR])
                     
-                    # Encode
-                    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 70]
-                    _, encoded = cv2.imencode('.jpg', frame, encode_param)
+                    # Scale to fit for bandwidth, keeping the aspect ratio
+                    frame = prepare_capture(np.asarray(screenshot))
                     
-                    # Send frame
-                    message = {
-                        'type': MSG_SCREEN_FRAME,
-                        'username': self.username,
-                        'frame': encoded.tobytes()
-                    }
-                    self.send_tcp(message)
+                    # Encode only what changed; a static screen sends nothing
+                    encoded = self.encoder.encode(frame)
+                    if encoded is not None:
+                        flags, meta, payload = encoded
+                        meta['username'] = self.username
+                        self.send_tcp(MSG_SCREEN_FRAME, meta, payload, flags)
                     
-                    time.sleep(0.1)
+                    pacer.update(self.encoder.dirty_fraction)
                     
                 except Exception as e:
                     print(f"[ERROR] Screen capture: {e}")
+                
+                pacer.wait()
     
-    def send_tcp(self, message):
-        """Send TCP message."""
+    def send_tcp(self, msg_type, meta, payload=b'', flags=0):
+        """Send a message on the screen channel, or inline without one (the capture thread and GUI both send)."""
         try:
-            msg_data = pickle.dumps(message)
-            msg_length = struct.pack('!I', len(msg_data))
-            self.tcp_socket.sendall(msg_length + msg_data)
+            frame = encode_message(msg_type, meta, payload, sender_id=user_id(self.username), flags=flags)
+            with self.send_lock:
+                (self.screen_socket or self.control).sendall(frame)
         except Exception as e:
             print(f"[ERROR] TCP send: {e}")
 
+class ScreenViewer:
+    """
+    Shows a presenter's shared screen in its own window of the process's window
+    display, decoding off the GUI thread.
+    """
+    
+    def __init__(self, display):
+        self.display = display
+        self.messages = queue.Queue()
+        self.canvas = ScreenCanvas()
+        self.window = None
+        self.screen = None
+        self.screen_lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def receive(self, message):
+        """Queue a MSG_SCREEN_START, MSG_SCREEN_FRAME or MSG_SCREEN_STOP from the TCP receive thread."""
+        self.messages.put(message)
+    
+    def run(self):
+        """Apply queued screen messages and hand the window the result once per batch."""
+        while self.running:
+            # Only messages fetched this time round
+            batch = []
+            try:
+                batch.append(self.messages.get(timeout=0.1))
+                while True:
+                    batch.append(self.messages.get_nowait())
+            except queue.Empty:
+                pass
+            
+            try:
+                # Frames queued before the newest keyframe are already covered by it
+                keyframes = [i for i, message in enumerate(batch) if message is not None
+                             and message['type'] == MSG_SCREEN_FRAME and message['flags'] & SCREEN_FLAG_KEYFRAME]
+                first = keyframes[-1] if keyframes else 0
+                screen = None
+                for index, message in enumerate(batch):
+                    if message is None:
+                        continue
+                    if message['type'] == MSG_SCREEN_START:
+                        self.close_window()
+                        self.canvas = ScreenCanvas()
+                        self.window = f"Screen - {message.get('username')}"
+                        self.display.attach(self.window, self.render_screen)
+                    elif message['type'] == MSG_SCREEN_STOP:
+                        self.close_window()
+                        screen = None
+                    elif index >= first or message['flags'] & SCREEN_FLAG_KEYFRAME:
+                        screen = self.canvas.apply(message)
+                
+                if screen is not None and self.window:
+                    # The canvas keeps changing on this thread; the display gets a snapshot
+                    with self.screen_lock:
+                        self.screen = screen.copy()
+            except Exception as e:
+                print(f"[ERROR] Screen view: {e}")
+    
+    def render_screen(self):
+        """Display callback: the screen as last updated, or None if unchanged since the last call."""
+        with self.screen_lock:
+            screen, self.screen = self.screen, None
+        return screen
+    
+    def close_window(self):
+        """Close the current presentation's window, if one is open."""
+        if self.window:
+            self.display.detach(self.window)
+            self.window = None
+            with self.screen_lock:
+                self.screen = None
+    
+    def stop(self):
+        """Stop the viewer thread."""
+        self.running = False
+        self.messages.put(None)
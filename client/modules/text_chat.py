@@ -3,8 +3,6 @@ Text Chat Module
 Handles group text messaging with chronological display.
 """
 
-import pickle
-import struct
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -21,15 +19,11 @@ class TextChat:
     def send_message(self, message_text):
         """Send chat message to server."""
         try:
-            message = {
-                'type': MSG_CHAT,
+            message = encode_message(MSG_CHAT, {
                 'username': self.username,
                 'message': message_text
-            }
-            
-            msg_data = pickle.dumps(message)
-            msg_length = struct.pack('!I', len(msg_data))
-            self.tcp_socket.sendall(msg_length + msg_data)
+            }, sender_id=user_id(self.username))
+            self.tcp_socket.sendall(message)
             
             # Add to local history
             self.chat_history.append(f"{self.username}: {message_text}")
@@ -1,76 +1,305 @@
 """
 Video Capture and Encode Node
-Captures video from webcam, compresses it, and sends via UDP to server.
+Captures video from webcam, compresses it, and sends it via UDP to server in MTU-sized fragments.
+Each frame is published as a full layer, whose quality, resolution and frame rate follow
+the receivers' loss/jitter feedback, and a small thumbnail layer for grid views.
+Capture, encode and send run as a pipeline of threads joined by one-frame slots, so
+a slow encode drops frames instead of falling behind the camera.
 """
 
 import cv2
 import socket
-import pickle
-import struct
 import threading
+import time
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from client.modules.bitrate_control import BitrateController
+
+class FrameSlot:
+    """
+    Hands the newest frame from one pipeline stage to the next. put never blocks: a
+    frame still waiting when a newer one arrives is replaced and counted as dropped,
+    and a frame older than one already put is dropped too, so stages running in
+    parallel cannot reorder frames.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.number = -1
+        self.dropped = 0
+        self.closed = False
+    
+    def put(self, number, item):
+        """Offer frame number (capture order) to the next stage."""
+        with self.condition:
+            if number <= self.number:
+                self.dropped += 1
+                return
+            if self.item is not None:
+                self.dropped += 1
+            self.item = (number, item)
+            self.number = number
+            self.condition.notify()
+    
+    def get(self, timeout=None):
+        """Wait for and take the newest frame: (number, item), or None on timeout or once closed."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item, self.item = self.item, None
+            return item
+    
+    def close(self):
+        """Wake every waiting stage; get returns None from now on."""
+        with self.condition:
+            self.closed = True
+            self.item = None
+            self.condition.notify_all()
 
 class VideoCaptureNode:
-    def __init__(self, server_ip, username):
+    def __init__(self, server_ip, username, sock=None):
         self.server_ip = server_ip
         self.username = username
         self.running = False
         self.capture = None
-        self.socket = None
+        # A socket shared with the media engine, which then passes feedback to handle_feedback
+        self.socket = sock
+        self.own_socket = sock is None
+        self.sender_id = user_id(username)
+        self.meta = encode_meta({'username': username})
+        self.seq = 0
+        self.controller = None
+        self.camera_mode = None
+        self.pending_mode = None
+        self.pending_since = 0
+        self.captured = FrameSlot()
+        self.encoded = FrameSlot()
+        self.stats_lock = threading.Lock()
+        self.stats = self.new_stats()
+        self.last_stats = time.monotonic()
         
     def start(self):
         """Start video capture and transmission."""
         self.running = True
-        self.capture = cv2.VideoCapture(0)
-        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, VIDEO_WIDTH)
-        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, VIDEO_HEIGHT)
-        self.capture.set(cv2.CAP_PROP_FPS, VIDEO_FPS)
+        self.capture = self.open_camera()
+        if not self.capture.isOpened():
+            print("[ERROR] Video capture: no camera found")
+            self.running = False
+            return
+        camera_width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+        camera_height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+        self.controller = BitrateController(camera_width, camera_height)
+        self.set_camera_mode(self.controller.ladder[self.controller.rung])
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.own_socket:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VIDEO_SOCKET_BUFFER)
         
         print(f"[VIDEO CAPTURE] Started for {self.username}")
         
-        threading.Thread(target=self.capture_and_send, daemon=True).start()
+        threading.Thread(target=self.capture_frames, daemon=True).start()
+        for _ in range(min(VIDEO_ENCODE_THREADS, os.cpu_count() or 1)):
+            threading.Thread(target=self.encode_frames, daemon=True).start()
+        threading.Thread(target=self.send_frames, daemon=True).start()
+        if self.own_socket:
+            threading.Thread(target=self.receive_feedback, daemon=True).start()
+    
+    def open_camera(self):
+        """
+        Open the webcam asking for the top of the ladder, so the size it settles on tells
+        the controller which rungs the camera has; start() then switches it to the
+        controller's rung before any frame is read.
+        """
+        capture = cv2.VideoCapture(0)
+        max_width, max_height, max_fps = VIDEO_LADDER[-1]
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, max_width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, max_height)
+        capture.set(cv2.CAP_PROP_FPS, max_fps)
+        return capture
+    
+    def set_camera_mode(self, mode):
+        """Ask the camera for a rung's size and rate, as MJPG when raw frames wouldn't fit through USB 2."""
+        width, height, fps = mode
+        fourcc = 'MJPG' if width * height * fps > CAMERA_RAW_PIXEL_RATE else 'YUYV'
+        self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.capture.set(cv2.CAP_PROP_FPS, fps)
+        self.camera_mode = mode
+        self.pending_mode = None
+        print(f"[VIDEO CAPTURE] Camera {width}x{height}@{fps} {fourcc}")
     
-    def capture_and_send(self):
-        """Capture frames and send to server."""
+    def follow_rung(self, now):
+        """
+        Switch the camera to the controller's rung once the controller has stayed on it
+        for CAMERA_MODE_HOLD seconds; until then the encoders resize the camera's frames.
+        """
+        mode = self.controller.ladder[self.controller.rung]
+        if mode == self.camera_mode:
+            self.pending_mode = None
+        elif mode != self.pending_mode:
+            self.pending_mode = mode
+            self.pending_since = now
+        elif now - self.pending_since >= CAMERA_MODE_HOLD:
+            self.set_camera_mode(mode)
+    
+    def receive_feedback(self):
+        """Read receiver reports relayed back by the server from the node's own socket."""
         while self.running:
             try:
+                data, _ = self.socket.recvfrom(MAX_PACKET_SIZE)
+                self.handle_feedback(decode_message(data))
+            except Exception as e:
+                if self.running:
+                    print(f"[ERROR] Video feedback: {e}")
+    
+    def handle_feedback(self, packet):
+        """Apply a receiver report on the full layer to the bitrate controller."""
+        if packet['type'] == MSG_VIDEO_FEEDBACK and packet.get('layer', VIDEO_LAYER_FULL) == VIDEO_LAYER_FULL:
+            self.controller.on_feedback(packet['sender_id'], packet.get('loss', 0), packet.get('jitter_ms', 0))
+    
+    def capture_frames(self):
+        """
+        Keep the camera drained (frames left in the driver's queue only get older), on
+        the controller's rung, and put the frames due at the controller's frame rate in
+        the encoders' slot, stamped with their capture time.
+        """
+        next_frame = time.monotonic()
+        number = 0
+        while self.running:
+            try:
+                self.follow_rung(time.monotonic())
                 ret, frame = self.capture.read()
+                timestamp = time.time()
                 if not ret:
                     continue
                 
-                # Resize and encode frame
-                frame = cv2.resize(frame, (VIDEO_WIDTH, VIDEO_HEIGHT))
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), VIDEO_QUALITY]
-                _, encoded_frame = cv2.imencode('.jpg', frame, encode_param)
+                # The camera may still run at a previous rung's higher rate; a frame up to a
+                # quarter interval early counts as due, so camera jitter can't halve the rate
+                now = time.monotonic()
+                interval = 1.0 / self.controller.fps
+                if now < next_frame - interval / 4:
+                    continue
+                next_frame = max(next_frame + interval, now)
+                self.captured.put(number, (frame, timestamp))
+                number += 1
                 
-                # Create packet with username
-                packet = {
-                    'username': self.username,
-                    'frame': encoded_frame.tobytes()
-                }
-                data = pickle.dumps(packet)
+            except Exception as e:
+                if self.running:
+                    print(f"[ERROR] Video capture: {e}")
+    
+    def encode_frames(self):
+        """Encode the newest captured frame as both layers, skipping frames that were replaced meanwhile."""
+        while self.running:
+            taken = self.captured.get(timeout=0.5)
+            if taken is None:
+                continue
+            number, (frame, timestamp) = taken
+            try:
+                start = time.perf_counter()
+                width, height, quality = self.controller.settings()
                 
-                # Split large packets if needed
-                if len(data) < MAX_PACKET_SIZE:
-                    self.socket.sendto(data, (self.server_ip, UDP_VIDEO_PORT))
-                else:
-                    print(f"[VIDEO CAPTURE] Packet too large: {len(data)} bytes")
+                # Encode the full layer at the controller's settings, resizing only if the camera differs
+                full = frame if frame.shape[:2] == (height, width) else cv2.resize(frame, (width, height))
+                _, encoded_full = cv2.imencode('.jpg', full, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
                 
+                # And a fixed thumbnail layer for viewers showing a grid of tiles, shrunk
+                # from the full layer when that is already smaller than the camera frame
+                thumb_width, thumb_height = VIDEO_THUMB_SIZE
+                source = full if thumb_width <= width <= frame.shape[1] and thumb_height <= height else frame
+                thumb = cv2.resize(source, VIDEO_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+                _, encoded_thumb = cv2.imencode('.jpg', thumb, [int(cv2.IMWRITE_JPEG_QUALITY), VIDEO_THUMB_QUALITY])
+                elapsed = time.perf_counter() - start
+                
+                with self.stats_lock:
+                    self.stats['encoded'] += 1
+                    self.stats['encode_seconds'] += elapsed
+                    self.stats['encode_max'] = max(self.stats['encode_max'], elapsed)
+                self.encoded.put(number, (encoded_full, encoded_thumb, timestamp))
+            
             except Exception as e:
-                print(f"[ERROR] Video capture: {e}")
+                print(f"[ERROR] Video encode: {e}")
+    
+    def send_frames(self):
+        """Send the newest encoded frame's layers and feed its size to the bitrate controller."""
+        while self.running:
+            taken = self.encoded.get(timeout=0.5)
+            if taken is not None:
+                try:
+                    _, (encoded_full, encoded_thumb, timestamp) = taken
+                    rung = self.controller.rung
+                    if self.controller.on_frame(len(encoded_full)) and self.controller.rung != rung:
+                        print(f"[VIDEO CAPTURE] {self.controller.width}x{self.controller.height}"
+                              f"@{self.controller.fps} quality={self.controller.quality} "
+                              f"target={self.controller.target_bitrate / 1000:.0f}kbit/s")
+                    
+                    # Both layers share the frame id and capture timestamp. Ids are given out
+                    # here, so frames dropped before sending don't look like loss to receivers.
+                    seq = self.seq
+                    self.seq += 1
+                    self.send_layer(VIDEO_LAYER_FULL, encoded_full, seq, timestamp)
+                    self.send_layer(VIDEO_LAYER_THUMB, encoded_thumb, seq, timestamp)
+                    
+                    latency = time.time() - timestamp
+                    with self.stats_lock:
+                        self.stats['sent'] += 1
+                        self.stats['latency_seconds'] += latency
+                        self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+                
+                except Exception as e:
+                    print(f"[ERROR] Video send: {e}")
+            
+            if time.monotonic() - self.last_stats >= VIDEO_CAPTURE_STATS_INTERVAL:
+                self.last_stats = time.monotonic()
+                self.log_capture_stats()
+    
+    def send_layer(self, layer, encoded_frame, seq, timestamp):
+        """Split one encoded layer into fragments (username only on the first) and send them."""
+        try:
+            fragments = encode_fragments(MSG_VIDEO, self.meta, encoded_frame.tobytes(), sender_id=self.sender_id,
+                                         seq=seq, timestamp=timestamp, flags=layer)
+        except ValueError as e:
+            print(f"[VIDEO CAPTURE] Frame dropped: {e}")
+            return
+        
+        for fragment in fragments:
+            self.socket.sendto(fragment, (self.server_ip, UDP_VIDEO_PORT))
+    
+    def new_stats(self):
+        return {'encoded': 0, 'sent': 0, 'encode_seconds': 0.0, 'encode_max': 0.0,
+                'latency_seconds': 0.0, 'latency_max': 0.0}
+    
+    def report(self):
+        """
+        Return and reset the pipeline's stats: (frames sent, frames dropped before
+        encoding or sending, mean/max encode ms, mean/max capture-to-send ms).
+        """
+        with self.stats_lock:
+            stats, self.stats = self.stats, self.new_stats()
+        dropped = self.captured.dropped + self.encoded.dropped
+        self.captured.dropped = self.encoded.dropped = 0
+        return (stats['sent'], dropped, stats['encode_seconds'] * 1000 / max(stats['encoded'], 1),
+                stats['encode_max'] * 1000, stats['latency_seconds'] * 1000 / max(stats['sent'], 1),
+                stats['latency_max'] * 1000)
+    
+    def log_capture_stats(self):
+        """Print the send rate, drops and encode/latency times since the last report."""
+        sent, dropped, encode_ms, encode_max_ms, latency_ms, latency_max_ms = self.report()
+        print(f"[VIDEO CAPTURE] {sent / VIDEO_CAPTURE_STATS_INTERVAL:.1f} fps sent, {dropped} dropped, "
+              f"encode {encode_ms:.1f} ms mean / {encode_max_ms:.1f} ms max, "
+              f"capture to send {latency_ms:.1f} ms mean / {latency_max_ms:.1f} ms max")
     
     def stop(self):
         """Stop video capture."""
         self.running = False
+        self.captured.close()
+        self.encoded.close()
         if self.capture:
             self.capture.release()
-        if self.socket:
+        if self.socket and self.own_socket:
             self.socket.close()
         print("[VIDEO CAPTURE] Stopped")
 
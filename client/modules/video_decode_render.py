@@ -1,135 +1,444 @@
 """
 Video Decode and Render Node
-Receives compressed video from server, decodes, and displays multiple streams.
+Receives compressed video fragments from server, reassembles and decodes them, and displays multiple streams.
+Streams arriving as the full layer (the active speakers, or a lone remote webcam) are
+shown large on a stage row above the thumbnail grid. The receive thread only
+reassembles frames; a pool of decode threads decodes the newest frame of each stream.
 """
 
 import cv2
 import socket
-import pickle
 import numpy as np
 import threading
+import time
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from shared.protocol import *
+from client.modules.bitrate_control import ReceiverStats
+from client.modules.window_display import WindowDisplay
+
+class FrameReassembler:
+    """
+    Collects video fragments per stream (sender and simulcast layer) and returns
+    each frame once all of its fragments have arrived. Incomplete frames are
+    discarded after a timeout, or as soon as a newer frame from the same stream
+    completes (it could no longer be shown anyway).
+    """
+    def __init__(self, timeout=VIDEO_REASSEMBLY_TIMEOUT):
+        self.timeout = timeout
+        self.frames = {}
+        self.last_complete = {}
+        self.completed = 0
+        self.expired = 0
+        self.superseded = 0
+    
+    def push(self, packet):
+        """Add one fragment; returns (username, frame bytes) when it completes a frame, else None."""
+        stream = (packet['sender_id'], packet['flags'] & VIDEO_LAYER_MASK)
+        frame_id = packet['seq']
+        index, count, data = split_fragment(packet['payload'])
+        if index >= count or count > VIDEO_MAX_FRAGMENTS:
+            return None
+        
+        # Fragments of frames captured before the last one shown are useless. Capture
+        # timestamps rather than frame ids decide this, so a restarted sender is not ignored.
+        if packet['timestamp'] <= self.last_complete.get(stream, 0):
+            return None
+        
+        key = (stream, frame_id)
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self.frames[key] = {
+                'parts': [None] * count,
+                'missing': count,
+                'username': None,
+                'timestamp': packet['timestamp'],
+                'started': time.monotonic()
+            }
+        if len(frame['parts']) != count or frame['parts'][index] is not None:
+            return None
+        
+        frame['parts'][index] = data
+        frame['missing'] -= 1
+        if index == 0:
+            frame['username'] = packet.get('username')
+        if frame['missing']:
+            return None
+        
+        del self.frames[key]
+        self.last_complete[stream] = frame['timestamp']
+        self.completed += 1
+        for old_key in [k for k, old in self.frames.items()
+                        if k[0] == stream and old['timestamp'] < frame['timestamp']]:
+            del self.frames[old_key]
+            self.superseded += 1
+        return frame['username'], b''.join(frame['parts'])
+    
+    def evict_expired(self):
+        """Discard incomplete frames that have waited longer than the timeout."""
+        now = time.monotonic()
+        for key in [k for k, frame in self.frames.items() if now - frame['started'] > self.timeout]:
+            del self.frames[key]
+            self.expired += 1
+
+class FrameDecoder:
+    """
+    Decodes complete frames off the receive thread, on a thread pool. Only the newest
+    frame of each stream is kept: a stream has at most one decode queued or running,
+    and a frame replaced before its decode starts is skipped. JPEGs are decoded at
+    1/2, 1/4 or 1/8 scale (IMREAD_REDUCED_COLOR_*) when the reduced frame still covers
+    the tile the stream is shown in. Keeps per-stream decode-time stats.
+    """
+    SCALES = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+              8: cv2.IMREAD_REDUCED_COLOR_8}
+    
+    def __init__(self, on_frame, threads=VIDEO_DECODE_THREADS):
+        self.on_frame = on_frame
+        self.pool = ThreadPoolExecutor(max_workers=min(threads, os.cpu_count() or 1),
+                                       thread_name_prefix='video-decode')
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.busy = set()
+        self.tile_sizes = {}
+        self.source_sizes = {}
+        self.stats = {}
+    
+    def push(self, username, layer, data, timestamp):
+        """Hand over a complete frame, replacing any frame of the stream still waiting for its decode."""
+        with self.lock:
+            stats = self.stream_stats(username)
+            if username in self.latest:
+                stats['skipped'] += 1
+            self.latest[username] = (layer, data, timestamp)
+            if username in self.busy:
+                return
+            self.busy.add(username)
+        self.pool.submit(self.decode_latest, username)
+    
+    def decode_latest(self, username):
+        """Decode a stream's newest frame; a newer one that arrived meanwhile goes to the back of the queue."""
+        with self.lock:
+            layer, data, timestamp = self.latest.pop(username)
+            scale = self.scale_for(username, layer)
+        
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), self.SCALES[scale])
+        elapsed = time.perf_counter() - start
+        
+        with self.lock:
+            stats = self.stream_stats(username)
+            if frame is None:
+                stats['failed'] += 1
+            else:
+                self.source_sizes[(username, layer)] = (frame.shape[1] * scale, frame.shape[0] * scale)
+                stats['decoded'] += 1
+                stats['seconds'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+                stats['scale'] = scale
+        if frame is not None:
+            try:
+                self.on_frame(username, frame, layer, timestamp)
+            except Exception as e:
+                print(f"[ERROR] Video decode: {e}")
+        
+        # Streams take turns on the pool rather than one busy stream keeping a thread
+        with self.lock:
+            if username not in self.latest:
+                self.busy.discard(username)
+                return
+        self.pool.submit(self.decode_latest, username)
+    
+    def scale_for(self, username, layer):
+        """The largest reduction whose output still covers the stream's tile (lock held)."""
+        source = self.source_sizes.get((username, layer))
+        tile = self.tile_sizes.get(username)
+        scale = 1
+        while source and tile and scale < 8 and \
+                source[0] // (scale * 2) >= tile[0] and source[1] // (scale * 2) >= tile[1]:
+            scale *= 2
+        return scale
+    
+    def set_tile_size(self, username, size):
+        """Tell the decoder how large a stream is shown."""
+        self.tile_sizes[username] = size
+    
+    def stream_stats(self, username):
+        return self.stats.setdefault(username, {'decoded': 0, 'skipped': 0, 'failed': 0, 'seconds': 0.0,
+                                                'max': 0.0, 'scale': 1})
+    
+    def report(self):
+        """Return and reset each stream's stats: (username, decoded, skipped, failed, mean ms, max ms, scale)."""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return [(username, s['decoded'], s['skipped'], s['failed'], s['seconds'] * 1000 / max(s['decoded'], 1),
+                 s['max'] * 1000, s['scale']) for username, s in sorted(stats.items())]
+    
+    def stop(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class GridCompositor:
+    """
+    Draws the stage (full-layer streams) above a grid of thumbnail streams on one
+    preallocated canvas. The layout, and the canvas, change only when streams come,
+    go or change layer; otherwise only tiles whose frame changed are redrawn, each
+    frame resized straight into its tile with a cached label drawn over it.
+    """
+    def __init__(self, on_tile_size=None):
+        self.on_tile_size = on_tile_size
+        self.canvas = None
+        self.layout_key = None
+        self.tiles = {}
+        self.drawn = {}
+        self.labels = {}
+    
+    def compose(self, streams):
+        """
+        Bring the canvas up to date with streams, sorted (username, frame, layer)
+        tuples. Returns how many tiles were redrawn (0 if the canvas is unchanged).
+        """
+        key = tuple((username, layer == VIDEO_LAYER_FULL) for username, _, layer in streams)
+        if key != self.layout_key:
+            self.set_layout(key)
+        redrawn = 0
+        for username, frame, _ in streams:
+            if self.drawn.get(username) is not frame:
+                self.draw_tile(username, frame)
+                redrawn += 1
+        return redrawn
+    
+    def set_layout(self, key):
+        """Place every stream's tile and allocate a blank canvas to hold them."""
+        stage = [username for username, on_stage in key if on_stage]
+        thumbs = [username for username, on_stage in key if not on_stage]
+        self.tiles = {}
+        height = width = 0
+        if stage:
+            stage_size = (VIDEO_WIDTH, VIDEO_HEIGHT) if len(stage) == 1 else (VIDEO_WIDTH // 2, VIDEO_HEIGHT // 2)
+            width, height = self.place(stage, stage_size, len(stage), 0)
+        if thumbs:
+            thumbs_width, height = self.place(thumbs, VIDEO_THUMB_SIZE, int(np.ceil(np.sqrt(len(thumbs)))), height)
+            width = max(width, thumbs_width)
+        
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.layout_key = key
+        self.drawn = {}
+        self.labels = {username_size: label for username_size, label in self.labels.items()
+                       if username_size[0] in self.tiles}
+        if self.on_tile_size:
+            for username, (_, _, tile_width, tile_height) in self.tiles.items():
+                self.on_tile_size(username, (tile_width, tile_height))
+    
+    def clear(self):
+        """Forget every tile and return a blank canvas, for when the last stream is gone."""
+        self.canvas = np.zeros((VIDEO_HEIGHT, VIDEO_WIDTH, 3), dtype=np.uint8)
+        self.layout_key = ()
+        self.tiles = {}
+        self.drawn = {}
+        return self.canvas
+    
+    def place(self, usernames, tile_size, cols, top):
+        """Lay tiles of tile_size out in rows of cols starting at top; returns (width, bottom)."""
+        tile_width, tile_height = tile_size
+        for index, username in enumerate(usernames):
+            row, col = divmod(index, cols)
+            self.tiles[username] = (col * tile_width, top + row * tile_height, tile_width, tile_height)
+        rows = -(-len(usernames) // cols)
+        return cols * tile_width, top + rows * tile_height
+    
+    def draw_tile(self, username, frame):
+        """Resize a frame into its tile of the canvas and label it."""
+        x, y, tile_width, tile_height = self.tiles[username]
+        tile = self.canvas[y:y + tile_height, x:x + tile_width]
+        if frame.shape[:2] == (tile_height, tile_width):
+            tile[:] = frame
+        else:
+            cv2.resize(frame, (tile_width, tile_height), dst=tile)
+        pixels, mask = self.label(username, tile_width)
+        label_height, label_width = mask.shape
+        np.copyto(tile[:label_height, :label_width], pixels, where=mask[..., None])
+        self.drawn[username] = frame
+    
+    def label(self, username, tile_width):
+        """The username rendered once per tile width: (pixels, mask)."""
+        label = self.labels.get((username, tile_width))
+        if label is None:
+            pixels = np.zeros((40, tile_width, 3), dtype=np.uint8)
+            cv2.putText(pixels, username, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            mask = pixels.any(axis=2)
+            # Keep only the columns the text reaches
+            used = max(1, int(np.flatnonzero(mask.any(axis=0)).max(initial=0)) + 1)
+            label = self.labels[(username, tile_width)] = (pixels[:, :used].copy(), mask[:, :used].copy())
+        return label
 
 class VideoRenderNode:
-    def __init__(self, server_ip, username):
+    def __init__(self, server_ip, username, control=None, sock=None, display=None):
         self.server_ip = server_ip
         self.username = username
         self.running = False
-        self.socket = None
+        # The client's registered control connection, if any, carries the port registration
+        self.control = control
+        # A socket shared with the media engine, which then passes datagrams to handle_datagram
+        self.socket = sock
+        self.own_socket = sock is None
         self.video_streams = {}
         self.stream_lock = threading.Lock()
+        self.sender_id = user_id(username)
+        self.reassembler = FrameReassembler()
+        self.decoder = FrameDecoder(self.store_frame)
+        self.compositor = GridCompositor(self.decoder.set_tile_size)
+        self.link_stats = ReceiverStats()
+        self.sources = {}
+        self.last_eviction = self.last_feedback = self.last_stats = time.monotonic()
+        # The process's window display, shared with the media engine; a node running alone has its own
+        self.display = display
+        self.own_display = display is None
         
     def start(self):
         """Start receiving and rendering video."""
         self.running = True
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(('0.0.0.0', UDP_VIDEO_PORT + 1000))
+        if self.own_socket:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_SOCKET_BUFFER)
+            self.socket.bind(('0.0.0.0', UDP_VIDEO_PORT + 1000))
+        port = self.socket.getsockname()[1]
         
-        print(f"[VIDEO RENDER] Started for {self.username} on port {UDP_VIDEO_PORT + 1000}")
+        print(f"[VIDEO RENDER] Started for {self.username} on port {port}")
         
-        self.register_udp_port()
+        self.register_udp_port(port)
         
-        threading.Thread(target=self.receive_video, daemon=True).start()
-        threading.Thread(target=self.display_video, daemon=True).start()
+        if self.own_socket:
+            threading.Thread(target=self.receive_video, daemon=True).start()
+        if self.own_display:
+            self.display = WindowDisplay()
+            self.display.start()
+        self.display.attach('Video Conference', self.render_grid, self.on_key)
     
-    def register_udp_port(self):
-        """Register video port with server via TCP."""
+    def register_udp_port(self, port):
+        """Register video port with server, on the control connection or else a connection of its own."""
+        message = {
+            'username': self.username,
+            'video_port': port,
+            'audio_port': None
+        }
         try:
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tcp_sock.connect((self.server_ip, TCP_PORT))
-            
-            message = {
-                'type': MSG_UDP_REGISTER,
-                'username': self.username,
-                'video_port': UDP_VIDEO_PORT + 1000,
-                'audio_port': None
-            }
+            if self.control:
+                self.control.sendall(encode_message(MSG_UDP_REGISTER, message, sender_id=self.sender_id))
+            else:
+                tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                tcp_sock.connect((self.server_ip, TCP_PORT))
+                tcp_sock.sendall(encode_message(MSG_UDP_REGISTER, message, sender_id=self.sender_id))
+                tcp_sock.close()
             
-            msg_data = pickle.dumps(message)
-            msg_length = struct.pack('!I', len(msg_data))
-            tcp_sock.sendall(msg_length + msg_data)
-            tcp_sock.close()
-            
-            print(f"[VIDEO RENDER] Registered UDP port with server")
+            print("[VIDEO RENDER] Registered UDP port with server")
         except Exception as e:
             print(f"[ERROR] Video port registration: {e}")
     
     def receive_video(self):
-        """Receive video packets from server."""
+        """Receive video datagrams from the node's own socket."""
         while self.running:
             try:
                 data, _ = self.socket.recvfrom(MAX_PACKET_SIZE)
-                packet = pickle.loads(data)
-                
-                username = packet.get('username')
-                if username != self.username:
-                    frame_data = packet.get('frame')
-                    
-                    # Decode frame
-                    nparr = np.frombuffer(frame_data, np.uint8)
-                    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    
-                    with self.stream_lock:
-                        self.video_streams[username] = frame
-                        
+                self.handle_datagram(data, decode_message(data))
             except Exception as e:
                 print(f"[ERROR] Video receive: {e}")
     
-    def display_video(self):
-        """Display all video streams in a grid layout."""
-        while self.running:
-            try:
-                with self.stream_lock:
-                    streams = list(self.video_streams.items())
-                
-                if not streams:
-                    cv2.waitKey(1)
-                    continue
-                
-                # Create grid layout
-                num_streams = len(streams)
-                cols = int(np.ceil(np.sqrt(num_streams)))
-                rows = int(np.ceil(num_streams / cols))
-                
-                grid_frames = []
-                for i in range(rows):
-                    row_frames = []
-                    for j in range(cols):
-                        idx = i * cols + j
-                        if idx < num_streams:
-                            username, frame = streams[idx]
-                            frame = cv2.resize(frame, (320, 240))
-                            cv2.putText(frame, username, (10, 30), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                            row_frames.append(frame)
-                        else:
-                            row_frames.append(np.zeros((240, 320, 3), dtype=np.uint8))
-                    
-                    if row_frames:
-                        grid_frames.append(np.hstack(row_frames))
-                
-                if grid_frames:
-                    grid = np.vstack(grid_frames)
-                    cv2.imshow('Video Conference', grid)
-                
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    self.stop()
-                    
-            except Exception as e:
-                print(f"[ERROR] Video display: {e}")
+    def handle_datagram(self, data, packet):
+        """Hand a video fragment to reassembly and each completed frame to the decoder, and report link quality."""
+        now = time.monotonic()
+        if now - self.last_eviction >= VIDEO_REASSEMBLY_TIMEOUT / 2:
+            self.last_eviction = now
+            self.reassembler.evict_expired()
+        
+        if now - self.last_feedback >= VIDEO_FEEDBACK_INTERVAL:
+            self.last_feedback = now
+            self.send_feedback()
+            self.send_subscription()
+        
+        if now - self.last_stats >= VIDEO_DECODE_STATS_INTERVAL:
+            self.last_stats = now
+            self.log_decode_stats()
+        
+        if packet['type'] == MSG_VIDEO and packet['sender_id'] != self.sender_id:
+            self.sources[packet['sender_id']] = now
+            _, count, _ = split_fragment(packet['payload'])
+            stream = (packet['sender_id'], packet['flags'] & VIDEO_LAYER_MASK)
+            self.link_stats.on_fragment(stream, packet['seq'], count, len(data), packet['timestamp'])
+            completed = self.reassembler.push(packet)
+            if completed is not None:
+                username, frame_data = completed
+                self.decoder.push(username, stream[1], frame_data, packet['timestamp'])
+    
+    def store_frame(self, username, frame, layer, timestamp):
+        """Decoder callback: make a decoded frame the one shown for its stream."""
+        with self.stream_lock:
+            self.video_streams[username] = (frame, layer, time.monotonic())
+    
+    def log_decode_stats(self):
+        """Print each stream's decode rate and times since the last report."""
+        for username, decoded, skipped, failed, mean_ms, max_ms, scale in self.decoder.report():
+            print(f"[VIDEO RENDER] {username}: {decoded / VIDEO_DECODE_STATS_INTERVAL:.1f} fps decoded, "
+                  f"{skipped} skipped, {failed} failed, {mean_ms:.1f} ms mean / {max_ms:.1f} ms max at 1/{scale} scale")
+    
+    def send_feedback(self):
+        """Send each video sender a loss/jitter report per layer, relayed by the server."""
+        for (source, layer), loss, jitter_ms, kbps in self.link_stats.report():
+            report = {'source': source, 'layer': layer, 'loss': round(loss, 4),
+                      'jitter_ms': round(jitter_ms, 2), 'kbps': round(kbps)}
+            self.socket.sendto(encode_message(MSG_VIDEO_FEEDBACK, report, sender_id=self.sender_id),
+                               (self.server_ip, UDP_VIDEO_PORT))
+    
+    def send_subscription(self):
+        """
+        Ask the server for the layers the display needs: a lone remote stream is shown
+        large and gets the full layer, a grid of tiles only needs thumbnails. Sent every
+        feedback interval so a lost datagram is soon repaired.
+        """
+        now = time.monotonic()
+        active = [source for source, last_seen in self.sources.items() if now - last_seen < 2 * VIDEO_FEEDBACK_INTERVAL]
+        layers = {str(source): VIDEO_LAYER_FULL for source in active} if len(active) == 1 else {}
+        subscription = {'default_layer': VIDEO_LAYER_THUMB, 'layers': layers}
+        self.socket.sendto(encode_message(MSG_VIDEO_SUBSCRIBE, subscription, sender_id=self.sender_id),
+                           (self.server_ip, UDP_VIDEO_PORT))
+    
+    def on_key(self, key):
+        if key == ord('q'):
+            self.stop()
+    
+    def render_grid(self):
+        """
+        Display callback: bring the stage and thumbnail grid up to date; returns it if
+        it changed, else None. Runs on the display thread at VIDEO_DISPLAY_FPS.
+        """
+        now = time.monotonic()
+        with self.stream_lock:
+            # Webcams the server stopped forwarding would otherwise freeze on screen
+            for username in [name for name, (_, _, updated) in self.video_streams.items()
+                             if now - updated > VIDEO_STREAM_TIMEOUT]:
+                del self.video_streams[username]
+            streams = [(username, frame, layer) for username, (frame, layer, _) in sorted(self.video_streams.items())]
+        
+        if not streams:
+            # Blank the window once when the last stream goes, rather than freeze its last frame
+            return self.compositor.clear() if self.compositor.layout_key else None
+        return self.compositor.canvas if self.compositor.compose(streams) else None
     
     def stop(self):
         """Stop video rendering."""
         self.running = False
-        if self.socket:
+        if self.socket and self.own_socket:
             self.socket.close()
-        cv2.destroyAllWindows()
-        print("[VIDEO RENDER] Stopped")
+        self.decoder.stop()
+        # Only this node's window: the client shows shared screens in the same process
+        if self.display:
+            self.display.detach('Video Conference')
+            if self.own_display:
+                self.display.stop()
+        print(f"[VIDEO RENDER] Stopped ({self.reassembler.completed} frames, "
+              f"{self.reassembler.expired} incomplete, {self.reassembler.superseded} superseded)")
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -0,0 +1,94 @@
+"""
+Window Display
+Owns every OpenCV HighGUI call of the client process on one thread. HighGUI
+backends (GTK, Qt) are not thread-safe, and waitKey runs the events of every window
+in the process, so the video grid and shared screens don't call imshow or waitKey
+themselves: each attaches its window with a render callback, which the display
+thread calls VIDEO_DISPLAY_FPS times a second to get the window's new image, if any.
+"""
+
+import threading
+import time
+import cv2
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from shared.protocol import *
+
+class WindowDisplay:
+    def __init__(self, fps=VIDEO_DISPLAY_FPS):
+        self.fps = fps
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.closing = set()
+        self.shown = set()
+        self.wakeup = threading.Event()
+        self.running = False
+    
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def attach(self, window, render, on_key=None):
+        """
+        Show a window whose image comes from render(), called on the display thread and
+        returning a new image or None when nothing changed. on_key(key) gets key presses.
+        """
+        with self.lock:
+            self.windows[window] = (render, on_key)
+            self.closing.discard(window)
+        self.wakeup.set()
+    
+    def detach(self, window):
+        """Stop rendering a window and close it; safe to call from any thread."""
+        with self.lock:
+            if self.windows.pop(window, None) is not None:
+                self.closing.add(window)
+        self.wakeup.set()
+    
+    def run(self):
+        """Render attached windows and run their events, paced to the display rate."""
+        next_frame = time.monotonic()
+        while self.running:
+            self.wakeup.clear()
+            with self.lock:
+                windows = list(self.windows.items())
+                closing, self.closing = self.closing, set()
+            try:
+                for window in closing & self.shown:
+                    cv2.destroyWindow(window)
+                self.shown -= closing
+                for window, (render, _) in windows:
+                    image = render()
+                    if image is not None:
+                        cv2.imshow(window, image)
+                        self.shown.add(window)
+                
+                if not self.shown:
+                    # No window to keep alive: wait for one to be attached
+                    self.wakeup.wait(1 / self.fps)
+                    next_frame = time.monotonic()
+                    continue
+                
+                # waitKey both sleeps until the next frame is due and runs the windows' events
+                next_frame = max(next_frame + 1 / self.fps, time.monotonic())
+                key = cv2.waitKey(max(1, int((next_frame - time.monotonic()) * 1000)))
+                if key != -1:
+                    for _, on_key in windows:
+                        if on_key:
+                            on_key(key & 0xFF)
+            except Exception as e:
+                print(f"[ERROR] Display: {e}")
+        
+        for window in self.shown:
+            try:
+                cv2.destroyWindow(window)
+            except Exception:
+                pass
+        self.shown.clear()
+    
+    def stop(self):
+        """Close every window and stop the display thread."""
+        self.running = False
+        self.wakeup.set()
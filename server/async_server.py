@@ -0,0 +1,273 @@
+"""
+Asyncio Server Engine
+Runs the relay on a single event loop: asyncio streams for TCP clients and
+DatagramProtocol endpoints for video/audio, instead of one OS thread per connection.
+Message routing is shared with the threaded engine, so the two are wire-compatible.
+"""
+
+import asyncio
+import socket
+import time
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from server.send_queue import OutboundQueue
+from server.server_main import CommunicationServer
+from shared.file_io import file_chunks, pack_chunks
+
+class AsyncClientWriter:
+    """Drains one client's OutboundQueue onto its stream from an event loop task."""
+    
+    def __init__(self, stream_writer, username, max_bytes=SEND_QUEUE_MAX_BYTES, drop_oldest=None):
+        self.stream_writer = stream_writer
+        self.username = username
+        self.queue = OutboundQueue(max_bytes, drop_oldest)
+        self.wakeup = asyncio.Event()
+        self.running = True
+        self.task = asyncio.get_running_loop().create_task(self.run())
+    
+    def enqueue(self, msg_type, buffers, supersede=False):
+        """Queue a frame (tuple of buffers) without blocking the event loop."""
+        if not self.running:
+            return
+        if not self.queue.push(msg_type, buffers, supersede):
+            print(f"[QUEUE] {self.username} fell {self.queue.bytes_queued} bytes behind, disconnecting")
+            self.running = False
+            self.stream_writer.transport.abort()
+        self.wakeup.set()
+    
+    async def run(self):
+        """Write queued messages, yielding to the loop while the client's buffer is full."""
+        try:
+            while self.running:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.running and self.queue:
+                    _, buffers = self.queue.pop()
+                    for buffer in buffers:
+                        self.stream_writer.write(buffer)
+                    await self.stream_writer.drain()
+        except Exception as e:
+            print(f"[ERROR] Send to {self.username}: {e}")
+            self.running = False
+            self.stream_writer.transport.abort()
+    
+    def stats(self):
+        """Return queue depth metrics for this client."""
+        return self.queue.stats()
+    
+    def close(self):
+        """Stop the writer, discarding anything still queued."""
+        self.running = False
+        self.wakeup.set()
+
+class UDPRelayProtocol(asyncio.DatagramProtocol):
+    """Hands every received datagram to a relay callback."""
+    
+    def __init__(self, relay, label):
+        self.relay = relay
+        self.label = label
+    
+    def datagram_received(self, data, address):
+        try:
+            self.relay(data, address)
+        except Exception as e:
+            print(f"[ERROR] UDP {self.label}: {e}")
+    
+    def error_received(self, exc):
+        print(f"[ERROR] UDP {self.label}: {exc}")
+
+class AsyncCommunicationServer(CommunicationServer):
+    """CommunicationServer whose sockets are all served by one asyncio event loop."""
+    
+    def __init__(self, host='0.0.0.0', queue_max_bytes=SEND_QUEUE_MAX_BYTES, drop_oldest=None,
+                 video_speakers=VIDEO_STAGE_SPEAKERS, video_others=VIDEO_OTHERS_LAYER, file_store=FILE_STORE_DIR):
+        super().__init__(host, queue_max_bytes, drop_oldest, video_speakers, video_others, file_store)
+        self.tcp_server = None
+        self.screen_server = None
+        self.file_server = None
+        self.file_locks = {}
+    
+    def start(self):
+        """Start all server sockets and run the event loop until interrupted."""
+        self.running = True
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n[SERVER] Shutting down...")
+    
+    async def serve(self):
+        """Open the TCP listener and UDP endpoints, then idle while logging stats."""
+        loop = asyncio.get_running_loop()
+        
+        self.tcp_server = await asyncio.start_server(
+            self.handle_tcp_stream, self.host, TCP_PORT, reuse_address=True, backlog=TCP_BACKLOG
+        )
+        print(f"[SERVER] TCP listening on {self.host}:{TCP_PORT} (asyncio)")
+        
+        self.screen_server = await asyncio.start_server(
+            lambda reader, writer: self.handle_tcp_stream(reader, writer, 'screen'),
+            self.host, SCREEN_PORT, reuse_address=True, backlog=TCP_BACKLOG
+        )
+        print(f"[SERVER] TCP Screen listening on {self.host}:{SCREEN_PORT}")
+        
+        self.file_server = await asyncio.start_server(
+            lambda reader, writer: self.handle_tcp_stream(reader, writer, 'file'),
+            self.host, FILE_PORT, reuse_address=True, backlog=TCP_BACKLOG
+        )
+        print(f"[SERVER] TCP File listening on {self.host}:{FILE_PORT}")
+        
+        self.udp_video_socket, _ = await loop.create_datagram_endpoint(
+            lambda: UDPRelayProtocol(self.relay_video, 'video'), sock=self.bind_udp(UDP_VIDEO_PORT, VIDEO_SOCKET_BUFFER)
+        )
+        print(f"[SERVER] UDP Video listening on {self.host}:{UDP_VIDEO_PORT}")
+        
+        self.udp_audio_socket, _ = await loop.create_datagram_endpoint(
+            lambda: UDPRelayProtocol(self.relay_audio, 'audio'), sock=self.bind_udp(UDP_AUDIO_PORT)
+        )
+        print(f"[SERVER] UDP Audio listening on {self.host}:{UDP_AUDIO_PORT}")
+        
+        mixer_task = loop.create_task(self.run_audio_mixer_task())
+        
+        print("[SERVER] Server is running. Press Ctrl+C to stop.")
+        
+        try:
+            last_stats = time.monotonic()
+            while self.running:
+                await asyncio.sleep(1)
+                if time.monotonic() - last_stats >= QUEUE_STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    self.log_queue_stats()
+        finally:
+            # Close transports while the loop is still alive
+            mixer_task.cancel()
+            self.stop()
+    
+    async def run_audio_mixer_task(self):
+        """Mix audio once per chunk period on the event loop."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self.running:
+            try:
+                self.mix_audio()
+            except Exception as e:
+                print(f"[ERROR] Audio mixer: {e}")
+            next_tick += MIXER_TICK
+            delay = next_tick - loop.time()
+            if delay < 0:
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+    
+    def bind_udp(self, port, buffer_size=None):
+        """Create a bound UDP socket with the same options as the threaded engine."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        sock.bind((self.host, port))
+        return sock
+    
+    async def handle_tcp_stream(self, reader, writer, channel='control'):
+        """Handle TCP communication from a client's control, screen or file stream."""
+        handle_message, unregister = self.channel_handlers(channel)
+        wait_for_handler = asyncio.iscoroutinefunction(handle_message)
+        address = writer.get_extra_info('peername')
+        username = None
+        try:
+            while self.running:
+                header = await reader.readexactly(HEADER_SIZE)
+                body = await reader.readexactly(self.check_body_size(header))
+                if wait_for_handler:
+                    username = await handle_message(header, body, writer, address, username)
+                else:
+                    username = handle_message(header, body, writer, address, username)
+        
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"[ERROR] TCP client {username}: {e}")
+        finally:
+            unregister(username, writer)
+            writer.close()
+    
+    def channel_handlers(self, channel):
+        """As the threaded engine, but file connections are handled by a coroutine."""
+        handle_message, unregister = super().channel_handlers(channel)
+        if channel == 'file':
+            handle_message = self.handle_file_message_async
+        return handle_message, unregister
+    
+    async def handle_file_message_async(self, header, body, connection, address, username):
+        """
+        Route one frame from a file connection as handle_file_message does, but hash,
+        write and copy upload chunks on the default executor: a 4 MB chunk takes
+        milliseconds of disk and SHA-256 work that would otherwise stall media relaying
+        and the mixer tick for everyone.
+        """
+        msg_type, _, sender_id, _, _, _, _ = decode_header(header)
+        loop = asyncio.get_running_loop()
+        if msg_type == MSG_FILE_META and username:
+            upload, stored_chunks = self.start_upload(connection, username, sender_id, header, body)
+            if upload:
+                await loop.run_in_executor(None, self.prepare_upload_file, upload, stored_chunks)
+                self.upload_started(connection, upload)
+        elif msg_type == MSG_FILE_DATA and username:
+            chunk = self.check_file_chunk(header, body, username)
+            if chunk:
+                upload, index, payload = chunk
+                verified = await loop.run_in_executor(None, self.store_chunk, upload, index, payload)
+                self.upload_chunk_stored(connection, upload, index, len(payload), verified)
+        else:
+            username = self.handle_file_message(header, body, connection, address, username)
+        return username
+    
+    def create_writer(self, connection, username):
+        """Create the event-loop writer for a newly registered stream."""
+        return AsyncClientWriter(connection, username, self.queue_max_bytes, self.drop_oldest)
+    
+    def send_file_status(self, connection, file_id, missing, busy=False):
+        """Tell an uploader which chunks of a file are still missing (none once it is stored), or that it is busy."""
+        connection.write(encode_message(MSG_FILE_STATUS, {'file_id': file_id, 'busy': busy}, pack_chunks(missing)))
+    
+    def serve_file_range(self, connection, entry, offset, length, username):
+        """Send a byte range of a stored file from its own task; requests on one stream take turns."""
+        lock = self.file_locks.setdefault(connection, asyncio.Lock())
+        asyncio.get_running_loop().create_task(self.send_file_range_async(connection, lock, entry, offset, length, username))
+    
+    async def send_file_range_async(self, connection, lock, entry, offset, length, username):
+        """Send a byte range of a stored file on a range stream, straight from disk with loop.sendfile."""
+        loop = asyncio.get_running_loop()
+        try:
+            async with lock:
+                with open(entry['path'], 'rb') as f:
+                    for start, count in file_chunks(offset, length):
+                        connection.write(encode_head(MSG_FILE_DATA, {'file_id': entry['file_id'], 'offset': start},
+                                                     count, sender_id=entry['sender_id']))
+                        # Waits for the header to flush, then hands the chunk to the kernel
+                        if await loop.sendfile(connection.transport, f, start, count) != count:
+                            raise OSError(f"{entry['filename']} changed while it was being sent")
+            print(f"[FILE] Sent {entry['filename']} bytes {offset}-{offset + length} to {username}")
+        except Exception as e:
+            print(f"[ERROR] File send to {username}: {e}")
+            connection.transport.abort()
+    
+    def unregister_file_channel(self, username, connection):
+        """Forget a closed file stream and its send lock."""
+        super().unregister_file_channel(username, connection)
+        self.file_locks.pop(connection, None)
+    
+    def stop(self):
+        """Stop the server and close all sockets."""
+        if not self.running:
+            return
+        if self.tcp_server:
+            self.tcp_server.close()
+        if self.screen_server:
+            self.screen_server.close()
+        if self.file_server:
+            self.file_server.close()
+        super().stop()
@@ -0,0 +1,193 @@
+"""
+Server Audio Mixer
+Buffers each speaker's audio in a small jitter buffer and, once per chunk period,
+mixes everyone into one stream per listener with that listener's own voice removed.
+Also tracks who has been speaking, for active-speaker video routing.
+"""
+
+import threading
+import time
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from shared.audio_codec import get_codec
+
+class SpeakerBuffer:
+    """Jitter buffer for one speaker, keyed on packet sequence number."""
+
+    def __init__(self, target_depth=MIXER_JITTER_DEPTH, max_depth=MIXER_MAX_DEPTH):
+        self.target_depth = target_depth
+        self.max_depth = max_depth
+        self.packets = {}
+        self.next_seq = None
+        self.priming = True
+        self.silent = False
+        self.last_heard = time.monotonic()
+        self.late = 0
+        self.missing = 0
+        self.codec_state = {}
+        self.last_decoded = None
+
+    def push(self, seq, samples):
+        """Store one chunk; chunks older than the playout point are discarded."""
+        self.last_heard = time.monotonic()
+        self.silent = False
+        if self.next_seq is not None and seq < self.next_seq:
+            if self.next_seq - seq <= MIXER_RESTART_GAP:
+                self.late += 1
+                return
+            # Far behind the playout point: the speaker restarted their capture
+            self.packets.clear()
+            self.next_seq = None
+            self.priming = True
+        self.packets[seq] = samples
+
+        # Sender clock ran ahead of ours: skip forward instead of adding latency
+        while len(self.packets) > self.max_depth:
+            del self.packets[min(self.packets)]
+            self.next_seq = min(self.packets)
+
+    def pop(self):
+        """Return the next chunk in sequence, or None when it has not arrived."""
+        if self.priming:
+            if len(self.packets) < self.target_depth:
+                return None
+            self.priming = False
+            self.next_seq = min(self.packets)
+
+        samples = self.packets.pop(self.next_seq, None)
+        self.next_seq += 1
+        if samples is None:
+            self.missing += 1
+            if not self.packets:
+                # Speaker paused or stalled: rebuild the cushion before resuming
+                self.priming = True
+        return samples
+
+class AudioMixer:
+    """Mixes all active speakers into one stream per listener (mix-minus-self)."""
+
+    def __init__(self, chunk=AUDIO_CHUNK):
+        self.chunk = chunk
+        self.speakers = {}
+        self.noise_levels = {}
+        self.levels = {}
+        self.recent_speakers = []
+        self.lock = threading.Lock()
+
+    def push(self, sender_id, seq, payload, codec_id=CODEC_PCM):
+        """Decode one speaker's chunk and queue it for mixing."""
+        codec = get_codec(codec_id)
+        if codec is None:
+            return
+        with self.lock:
+            speaker = self.speakers.get(sender_id)
+            if speaker is None:
+                speaker = self.speakers[sender_id] = SpeakerBuffer()
+        # Only the UDP receive thread decodes, so the codec state needs no lock
+        if speaker.last_decoded != (seq - 1, codec_id):
+            speaker.codec_state.clear()
+        speaker.last_decoded = (seq, codec_id)
+        pcm = codec.decode(payload, speaker.codec_state)
+        if len(pcm) != self.chunk * 2:
+            return
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        with self.lock:
+            speaker.push(seq, samples)
+
+    def mark_silent(self, sender_id, noise_rms):
+        """Record a speaker's VAD silence marker; they leave the mix once their buffer drains."""
+        with self.lock:
+            speaker = self.speakers.get(sender_id)
+            if speaker is not None:
+                speaker.silent = True
+            self.noise_levels[sender_id] = (noise_rms, time.monotonic())
+
+    def comfort_noise_level(self):
+        """Return the loudest background level recently reported by silent speakers."""
+        now = time.monotonic()
+        with self.lock:
+            for sender_id in [sid for sid, (_, heard) in self.noise_levels.items()
+                              if now - heard > 2 * VAD_COMFORT_INTERVAL]:
+                del self.noise_levels[sender_id]
+            return max((level for level, _ in self.noise_levels.values()), default=0)
+
+    def mix(self):
+        """
+        Take one chunk from every speaker and mix them.
+        Returns (shared_mix, per_speaker_mix): shared_mix is the full mix as PCM bytes for
+        listeners who are not speaking (None when nobody spoke this tick), and
+        per_speaker_mix maps each speaker's id to the mix without their own voice
+        (None when they are the only speaker).
+        """
+        now = time.monotonic()
+        with self.lock:
+            for sender_id in [sid for sid, speaker in self.speakers.items()
+                              if now - speaker.last_heard > MIXER_SPEAKER_TIMEOUT
+                              or (speaker.silent and not speaker.packets)]:
+                del self.speakers[sender_id]
+            chunks = [(sender_id, speaker.pop()) for sender_id, speaker in self.speakers.items()]
+
+        chunks = [(sender_id, samples) for sender_id, samples in chunks if samples is not None]
+        self.update_levels(chunks)
+        if not chunks:
+            return None, {}
+
+        speaker_ids = [sender_id for sender_id, _ in chunks]
+        if len(chunks) == 1:
+            # A lone speaker has nobody to hear
+            return chunks[0][1].tobytes(), {speaker_ids[0]: None}
+
+        stack = np.stack([samples for _, samples in chunks]).astype(np.int32)
+        total = stack.sum(axis=0)
+
+        # One vectorized pass produces every speaker's mix-minus-self row
+        minus_self = np.clip(total - stack, -32768, 32767).astype(np.int16)
+        shared_mix = np.clip(total, -32768, 32767).astype(np.int16).tobytes()
+        return shared_mix, {sender_id: minus_self[i].tobytes() for i, sender_id in enumerate(speaker_ids)}
+
+    def update_levels(self, chunks):
+        """
+        Smooth every speaker's RMS level over recent ticks and move the loudest one, once
+        clearly speaking, to the front of the recent-speakers list.
+        """
+        heard = {}
+        if chunks:
+            stack = np.stack([samples for _, samples in chunks]).astype(np.float32)
+            rms = np.sqrt(np.mean(stack * stack, axis=1))
+            heard = {sender_id: float(rms[i]) for i, (sender_id, _) in enumerate(chunks)}
+        with self.lock:
+            for sender_id in set(self.levels) | set(heard):
+                level = self.levels.get(sender_id, 0.0)
+                level += (heard.get(sender_id, 0.0) - level) * SPEAKER_LEVEL_SMOOTHING
+                if level < 1 and sender_id not in heard:
+                    del self.levels[sender_id]
+                else:
+                    self.levels[sender_id] = level
+            if not self.levels:
+                return
+            loudest = max(self.levels, key=self.levels.get)
+            if self.levels[loudest] >= SPEAKER_MIN_LEVEL and self.recent_speakers[:1] != [loudest]:
+                if loudest in self.recent_speakers:
+                    self.recent_speakers.remove(loudest)
+                self.recent_speakers.insert(0, loudest)
+
+    def top_speakers(self, count):
+        """Return up to count ids of the most recent dominant speakers, most recent first."""
+        with self.lock:
+            return self.recent_speakers[:count]
+
+    def remove_speaker(self, sender_id):
+        """Forget a participant who left."""
+        with self.lock:
+            self.levels.pop(sender_id, None)
+            if sender_id in self.recent_speakers:
+                self.recent_speakers.remove(sender_id)
+
+    def active_speakers(self):
+        """Return the ids of speakers currently feeding the mixer."""
+        with self.lock:
+            return list(self.speakers)
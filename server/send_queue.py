@@ -0,0 +1,179 @@
+"""
+Outbound Send Queues
+Gives every connected client its own bounded outbound queue drained by a dedicated
+writer, so a slow receiver only delays its own traffic and never the broadcaster.
+Queued frames are tuples of buffers shared by every recipient and written with
+scatter-gather I/O, so relaying never copies a payload.
+"""
+
+import collections
+import socket
+import threading
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+
+def send_buffers(sock, buffers):
+    """Send a sequence of buffers with sendmsg, resuming after partial writes."""
+    if not hasattr(sock, 'sendmsg'):
+        # No scatter-gather on this platform (Windows); one sendall per buffer still avoids joining
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+
+    views = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+class OutboundQueue:
+    """
+    Bounded FIFO of framed messages with per-type drop-oldest limits (not thread-safe).
+    Types in SEND_QUEUE_PRIORITY go in a separate lane that is always sent first.
+    """
+
+    def __init__(self, max_bytes=SEND_QUEUE_MAX_BYTES, drop_oldest=None):
+        self.max_bytes = max_bytes
+        self.drop_oldest = dict(SEND_QUEUE_DROP_OLDEST if drop_oldest is None else drop_oldest)
+        self.items = collections.deque()
+        self.priority = collections.deque()
+        self.type_counts = collections.Counter()
+        self.bytes_queued = 0
+        self.peak_depth = 0
+        self.dropped = 0
+        self.sent = 0
+
+    def push(self, msg_type, buffers, supersede=False):
+        """
+        Queue a frame given as a tuple of buffers. A superseding frame (e.g. a screen
+        keyframe) lets droppable older frames of its type go. Returns False when the
+        client is too far behind to keep.
+        """
+        size = sum(len(buffer) for buffer in buffers)
+        self.type_counts[msg_type] += 1
+        self.bytes_queued += size
+        if msg_type in SEND_QUEUE_PRIORITY:
+            # Small control traffic never waits behind bulk frames already queued
+            self.priority.append((msg_type, buffers, size))
+            self.peak_depth = max(self.peak_depth, len(self))
+            return True
+        self.items.append((msg_type, buffers, size))
+
+        # Types with a drop-oldest limit keep only their newest entries
+        limit = self.drop_oldest.get(msg_type)
+        if limit is not None:
+            while self.type_counts[msg_type] > limit:
+                self.evict_oldest(msg_type)
+        if supersede:
+            while self.type_counts[msg_type] > 1 and self.evict_oldest(msg_type):
+                pass
+
+        # Over the byte budget: shed droppable traffic first, never chat or control
+        while self.bytes_queued > self.max_bytes:
+            if not self.evict_oldest():
+                return False
+
+        self.peak_depth = max(self.peak_depth, len(self))
+        return True
+
+    def pop(self):
+        """Remove and return the oldest priority entry, else the oldest (msg_type, buffers) entry."""
+        msg_type, buffers, size = (self.priority or self.items).popleft()
+        self.type_counts[msg_type] -= 1
+        self.bytes_queued -= size
+        self.sent += 1
+        return msg_type, buffers
+
+    def evict_oldest(self, msg_type=None):
+        """Drop the oldest droppable entry (optionally of one type). Returns True if dropped."""
+        for index, (queued_type, _, size) in enumerate(self.items):
+            if queued_type not in self.drop_oldest:
+                continue
+            if msg_type is not None and queued_type != msg_type:
+                continue
+            del self.items[index]
+            self.type_counts[queued_type] -= 1
+            self.bytes_queued -= size
+            self.dropped += 1
+            return True
+        return False
+
+    def stats(self):
+        """Return queue depth metrics."""
+        return {
+            'depth': len(self),
+            'peak_depth': self.peak_depth,
+            'bytes_queued': self.bytes_queued,
+            'dropped': self.dropped,
+            'sent': self.sent
+        }
+
+    def __len__(self):
+        return len(self.priority) + len(self.items)
+
+class ClientWriter:
+    """Drains one client's OutboundQueue onto its TCP socket from a dedicated thread."""
+
+    def __init__(self, sock, username, max_bytes=SEND_QUEUE_MAX_BYTES, drop_oldest=None):
+        self.sock = sock
+        self.username = username
+        self.queue = OutboundQueue(max_bytes, drop_oldest)
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def enqueue(self, msg_type, buffers, supersede=False):
+        """Queue a frame (tuple of buffers) without blocking the caller."""
+        with self.condition:
+            if not self.running:
+                return
+            if not self.queue.push(msg_type, buffers, supersede):
+                print(f"[QUEUE] {self.username} fell {self.queue.bytes_queued} bytes behind, disconnecting")
+                self.running = False
+                self.abort()
+            self.condition.notify()
+
+    def run(self):
+        """Send queued messages until the writer is closed."""
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                _, buffers = self.queue.pop()
+
+            try:
+                send_buffers(self.sock, buffers)
+            except Exception as e:
+                print(f"[ERROR] Send to {self.username}: {e}")
+                with self.condition:
+                    self.running = False
+                self.abort()
+                return
+
+    def abort(self):
+        """Shut the socket down so the client's reader thread notices and cleans up."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return queue depth metrics for this client."""
+        with self.condition:
+            return self.queue.stats()
+
+    def close(self):
+        """Stop the writer, discarding anything still queued."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
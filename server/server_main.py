@@ -1,29 +1,58 @@
 """
 Main Server Application
 Manages client connections, user registry, and acts as relay bridge for all communications.
-Handles both TCP (chat, files, screen sharing) and UDP (video, audio) protocols.
+Handles both TCP (chat and control, with screen sharing and file contents on their own ports)
+and UDP (video, audio) protocols.
 """
 
+import argparse
+import shutil
 import socket
+import tempfile
 import threading
-import pickle
-import struct
+import time
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from shared.protocol import *
+from server.send_queue import ClientWriter
+from server.audio_mixer import AudioMixer
+from shared.audio_codec import get_codec, codec_id_from_flags, negotiate_codec
+from shared.file_io import (preallocate, write_at, copy_range, send_file_data, chunk_count, chunk_digest,
+                            manifest_digest, check_manifest, pack_chunks)
 
 class CommunicationServer:
-    def __init__(self, host='0.0.0.0'):
+    def __init__(self, host='0.0.0.0', queue_max_bytes=SEND_QUEUE_MAX_BYTES, drop_oldest=None,
+                 video_speakers=VIDEO_STAGE_SPEAKERS, video_others=VIDEO_OTHERS_LAYER, file_store=FILE_STORE_DIR):
         self.host = host
+        self.queue_max_bytes = queue_max_bytes
+        self.drop_oldest = SEND_QUEUE_DROP_OLDEST if drop_oldest is None else drop_oldest
         self.clients = {}
         self.client_lock = threading.Lock()
         self.tcp_socket = None
+        self.screen_socket = None
+        self.file_socket = None
         self.udp_video_socket = None
         self.udp_audio_socket = None
         self.running = False
         self.presenter = None
+        self.screen_cache = []
+        self.screen_lock = threading.Lock()
+        self.file_store = file_store
+        self.store_dir = None
+        self.stored_files = {}
+        self.uploads = {}
+        self.chunk_index = {}
+        self.store_lock = threading.Lock()
+        self.mixer = AudioMixer()
+        self.mix_seq = 0
+        self.mix_codec_states = {}
+        self.video_sources = {}
+        self.video_speakers = video_speakers
+        self.video_others = video_others
+        self.video_stage = frozenset()
+        self.last_comfort = 0
         
     def start(self):
         """Start all server sockets and listening threads."""
@@ -33,12 +62,28 @@ class CommunicationServer:
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.tcp_socket.bind((self.host, TCP_PORT))
-        self.tcp_socket.listen(5)
+        self.tcp_socket.listen(TCP_BACKLOG)
         print(f"[SERVER] TCP listening on {self.host}:{TCP_PORT}")
         
+        # TCP Socket for screen sharing, so frames never queue ahead of control messages
+        self.screen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.screen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.screen_socket.bind((self.host, SCREEN_PORT))
+        self.screen_socket.listen(TCP_BACKLOG)
+        print(f"[SERVER] TCP Screen listening on {self.host}:{SCREEN_PORT}")
+        
+        # TCP Socket for file contents, sent in bulk with sendfile
+        self.file_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.file_socket.bind((self.host, FILE_PORT))
+        self.file_socket.listen(TCP_BACKLOG)
+        print(f"[SERVER] TCP File listening on {self.host}:{FILE_PORT}")
+        
         # UDP Socket for video
         self.udp_video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.udp_video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.udp_video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_SOCKET_BUFFER)
+        self.udp_video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VIDEO_SOCKET_BUFFER)
         self.udp_video_socket.bind((self.host, UDP_VIDEO_PORT))
         print(f"[SERVER] UDP Video listening on {self.host}:{UDP_VIDEO_PORT}")
         
@@ -49,201 +94,748 @@ class CommunicationServer:
         print(f"[SERVER] UDP Audio listening on {self.host}:{UDP_AUDIO_PORT}")
         
         # Start listening threads
-        threading.Thread(target=self.accept_tcp_connections, daemon=True).start()
+        threading.Thread(target=self.accept_tcp_connections, args=(self.tcp_socket,), daemon=True).start()
+        threading.Thread(target=self.accept_tcp_connections, args=(self.screen_socket, 'screen'), daemon=True).start()
+        threading.Thread(target=self.accept_tcp_connections, args=(self.file_socket, 'file'), daemon=True).start()
         threading.Thread(target=self.handle_udp_video, daemon=True).start()
         threading.Thread(target=self.handle_udp_audio, daemon=True).start()
+        threading.Thread(target=self.run_audio_mixer, daemon=True).start()
         
         print("[SERVER] Server is running. Press Ctrl+C to stop.")
         
         try:
+            last_stats = time.monotonic()
             while self.running:
                 threading.Event().wait(1)
+                if time.monotonic() - last_stats >= QUEUE_STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    self.log_queue_stats()
         except KeyboardInterrupt:
             print("\n[SERVER] Shutting down...")
             self.stop()
     
-    def accept_tcp_connections(self):
-        """Accept incoming TCP client connections."""
+    def accept_tcp_connections(self, listen_socket, channel='control'):
+        """Accept incoming TCP client connections (control, screen or file channel)."""
         while self.running:
             try:
-                client_socket, address = self.tcp_socket.accept()
-                threading.Thread(target=self.handle_tcp_client, args=(client_socket, address), daemon=True).start()
+                client_socket, address = listen_socket.accept()
+                threading.Thread(target=self.handle_tcp_client, args=(client_socket, address, channel),
+                                 daemon=True).start()
             except Exception as e:
                 if self.running:
                     print(f"[ERROR] TCP accept: {e}")
     
-    def handle_tcp_client(self, client_socket, address):
-        """Handle TCP communication from a client."""
+    def handle_tcp_client(self, client_socket, address, channel='control'):
+        """Handle TCP communication from a client's control, screen or file connection."""
+        handle_message, unregister = self.channel_handlers(channel)
         username = None
         try:
             while self.running:
-                # Receive message length (4 bytes)
-                length_data = self.recv_exact(client_socket, 4)
-                if not length_data:
+                # Receive fixed-size frame header
+                header = self.recv_exact(client_socket, HEADER_SIZE)
+                if not header:
                     break
                 
-                msg_length = struct.unpack('!I', length_data)[0]
-                
-                # Receive message data
-                msg_data = self.recv_exact(client_socket, msg_length)
-                if not msg_data:
+                # Receive metadata and payload straight into their own buffer
+                body = self.recv_exact(client_socket, self.check_body_size(header))
+                if body is None:
                     break
                 
-                message = pickle.loads(msg_data)
-                msg_type = message.get('type')
-                
-                if msg_type == MSG_REGISTER:
-                    username = message.get('username')
-                    with self.client_lock:
-                        self.clients[username] = {
-                            'tcp_socket': client_socket,
-                            'address': address,
-                            'video_port': None,
-                            'audio_port': None
-                        }
-                    print(f"[SERVER] User registered: {username} from {address}")
-                    self.broadcast_user_list()
-                    
-                elif msg_type == MSG_UDP_REGISTER:
-                    video_port = message.get('video_port')
-                    audio_port = message.get('audio_port')
-                    reg_username = message.get('username')
-                    with self.client_lock:
-                        if reg_username in self.clients:
-                            if video_port is not None:
-                                self.clients[reg_username]['video_port'] = video_port
-                            if audio_port is not None:
-                                self.clients[reg_username]['audio_port'] = audio_port
-                    print(f"[SERVER] UDP registered for {reg_username}: video={video_port}, audio={audio_port}")
-                    
-                elif msg_type == MSG_CHAT:
-                    self.broadcast_tcp(message, exclude=username)
-                    print(f"[CHAT] {message.get('username')}: {message.get('message')}")
-                    
-                elif msg_type == MSG_FILE_META:
-                    self.broadcast_tcp(message, exclude=username)
-                    print(f"[FILE] {username} sharing: {message.get('filename')}")
-                    
-                elif msg_type == MSG_FILE_REQUEST:
-                    self.broadcast_tcp(message)
-                    
-                elif msg_type == MSG_FILE_DATA:
-                    self.broadcast_tcp(message, exclude=username)
-                    
-                elif msg_type == MSG_SCREEN_START:
-                    self.presenter = username
-                    self.broadcast_tcp(message, exclude=username)
-                    print(f"[SCREEN] {username} started screen sharing")
-                    
-                elif msg_type == MSG_SCREEN_STOP:
-                    self.presenter = None
-                    self.broadcast_tcp(message, exclude=username)
-                    print(f"[SCREEN] {username} stopped screen sharing")
-                    
-                elif msg_type == MSG_SCREEN_FRAME:
-                    self.broadcast_tcp(message, exclude=username)
+                username = handle_message(header, body, client_socket, address, username)
                     
         except Exception as e:
             print(f"[ERROR] TCP client {username}: {e}")
         finally:
-            if username:
-                with self.client_lock:
-                    if username in self.clients:
-                        del self.clients[username]
-                print(f"[SERVER] User disconnected: {username}")
-                self.broadcast_user_list()
+            unregister(username, client_socket)
             client_socket.close()
     
+    def channel_handlers(self, channel):
+        """Return (message handler, unregister on close) for a kind of client connection."""
+        return {
+            'control': (self.handle_tcp_message, self.unregister_client),
+            'screen': (self.handle_screen_message, self.unregister_screen_channel),
+            'file': (self.handle_file_message, self.unregister_file_channel)
+        }[channel]
+    
+    def handle_tcp_message(self, header, body, connection, address, username):
+        """
+        Route one TCP frame from a connection. Returns the connection's username.
+        Routing uses the header alone; relayed frames are forwarded as the original
+        (header, body) buffers and only control messages have their metadata decoded.
+        """
+        msg_type, flags, sender_id, _, _, _, _ = decode_header(header)
+        frame = (header, body)
+        
+        if msg_type == MSG_REGISTER:
+            message = decode_meta(header, body)
+            username = message.get('username')
+            writer = self.create_writer(connection, username)
+            # Holding the screen lock keeps the replayed presentation and live frames in order
+            with self.screen_lock, self.client_lock:
+                self.clients[username] = {
+                    'user_id': sender_id,
+                    'tcp_socket': connection,
+                    'writer': writer,
+                    'address': address,
+                    'video_port': None,
+                    'audio_port': None,
+                    'audio_codec': CODEC_PCM,
+                    'video_layers': {},
+                    'video_default_layer': VIDEO_LAYER_THUMB,
+                    'screen_writer': None,
+                    'screen_socket': None
+                }
+                if not message.get('screen_channel'):
+                    self.replay_screen(writer)
+            self.announce_stored_files(writer)
+            print(f"[SERVER] User registered: {username} from {address}")
+            self.broadcast_user_list()
+        
+        elif msg_type == MSG_UDP_REGISTER:
+            message = decode_meta(header, body)
+            video_port = message.get('video_port')
+            audio_port = message.get('audio_port')
+            reg_username = message.get('username')
+            audio_codec = negotiate_codec(message.get('audio_codecs'))
+            with self.client_lock:
+                if reg_username in self.clients:
+                    if video_port is not None:
+                        self.clients[reg_username]['video_port'] = video_port
+                    if audio_port is not None:
+                        self.clients[reg_username]['audio_port'] = audio_port
+                        self.clients[reg_username]['audio_codec'] = audio_codec
+            print(f"[SERVER] UDP registered for {reg_username}: video={video_port}, audio={audio_port}")
+            if audio_port is not None:
+                print(f"[SERVER] Audio codec for {reg_username}: {get_codec(audio_codec).name}")
+        
+        elif msg_type == MSG_CHAT:
+            self.broadcast_tcp(msg_type, frame, exclude=username)
+            message = decode_meta(header, body)
+            print(f"[CHAT] {message.get('username')}: {message.get('message')}")
+        
+        elif msg_type == MSG_SCREEN_START:
+            with self.screen_lock:
+                self.presenter = username
+                self.screen_cache = [(msg_type, frame)]
+                self.broadcast_screen(msg_type, frame, exclude=username)
+            print(f"[SCREEN] {username} started screen sharing")
+        
+        elif msg_type == MSG_SCREEN_STOP:
+            self.end_presentation(username, frame)
+        
+        elif msg_type == MSG_SCREEN_FRAME:
+            keyframe = bool(flags & SCREEN_FLAG_KEYFRAME)
+            with self.screen_lock:
+                if username == self.presenter:
+                    # Keep the latest keyframe and the deltas since, for late joiners
+                    if keyframe:
+                        self.screen_cache = self.screen_cache[:1]
+                    self.screen_cache.append((msg_type, frame))
+                self.broadcast_screen(msg_type, frame, exclude=username, supersede=keyframe)
+        
+        return username
+    
+    def handle_screen_message(self, header, body, connection, address, username):
+        """
+        Route one frame from a screen channel. The first frame registers the channel for
+        an already registered user; after that only screen messages are accepted.
+        """
+        msg_type = decode_header(header)[0]
+        if msg_type == MSG_REGISTER:
+            username = decode_meta(header, body).get('username')
+            writer = self.create_writer(connection, username)
+            with self.screen_lock, self.client_lock:
+                client_info = self.clients.get(username)
+                if client_info is None:
+                    writer.close()
+                    raise ValueError("screen channel opened before registering")
+                if client_info['screen_writer']:
+                    client_info['screen_writer'].close()
+                client_info['screen_writer'] = writer
+                client_info['screen_socket'] = connection
+                self.replay_screen(writer)
+            print(f"[SCREEN] Screen channel open for {username}")
+        elif msg_type in (MSG_SCREEN_START, MSG_SCREEN_FRAME, MSG_SCREEN_STOP) and username:
+            self.handle_tcp_message(header, body, connection, address, username)
+        return username
+    
+    def handle_file_message(self, header, body, connection, address, username):
+        """
+        Route one frame from a file connection: a client's file channel (registered by
+        its first frame) carrying that user's uploads into the file store, or a range
+        stream whose MSG_FILE_REQUESTs are answered with the requested bytes.
+        """
+        msg_type, _, sender_id, _, _, _, _ = decode_header(header)
+        if msg_type == MSG_REGISTER:
+            username = decode_meta(header, body).get('username')
+            with self.client_lock:
+                if username not in self.clients:
+                    raise ValueError("file channel opened before registering")
+            print(f"[FILE] File channel open for {username}")
+        
+        elif msg_type == MSG_FILE_META and username:
+            upload, stored_chunks = self.start_upload(connection, username, sender_id, header, body)
+            if upload:
+                self.prepare_upload_file(upload, stored_chunks)
+                self.upload_started(connection, upload)
+        
+        elif msg_type == MSG_FILE_DATA and username:
+            chunk = self.check_file_chunk(header, body, username)
+            if chunk:
+                upload, index, payload = chunk
+                self.upload_chunk_stored(connection, upload, index, len(payload), self.store_chunk(upload, index, payload))
+        
+        elif msg_type == MSG_FILE_REQUEST:
+            message = decode_meta(header, body)
+            username = username or message.get('username')
+            entry = self.stored_files.get(message.get('file_id'))
+            if entry is None:
+                raise ValueError(f"{username} requested unknown file {message.get('file_id')}")
+            offset = message.get('offset', 0)
+            length = message.get('length', entry['size'] - offset)
+            if offset < 0 or length < 0 or offset + length > entry['size']:
+                raise ValueError(f"{username} requested bytes {offset}+{length} of a {entry['size']} byte file")
+            self.serve_file_range(connection, entry, offset, length, username)
+        return username
+    
+    def start_upload(self, connection, username, sender_id, header, body):
+        """
+        Find the upload a MSG_FILE_META starts or resumes; returns (upload, stored
+        chunks to copy into it). A file already in the store needs no chunks. Only an
+        upload whose channel dropped is resumed: while another channel is still sending
+        the file, the uploader is told it is busy and (None, None) returned.
+        """
+        message = decode_meta(header, body)
+        manifest = bytes(memoryview(body)[decode_header(header)[5]:])
+        if not check_manifest(manifest, message.get('file_id'), message.get('filesize') or 0):
+            raise ValueError(f"{username} sent a manifest that does not match {message.get('file_id')}")
+        file_id = message['file_id']
+        size = message.get('filesize') or 0
+        now = time.monotonic()
+        with self.store_lock:
+            if self.store_dir is None:
+                self.store_dir = tempfile.mkdtemp(prefix='file-store-', dir=self.file_store)
+            self.expire_partial_uploads(now)
+            upload = self.uploads.get(file_id)
+            owner = upload['username'] if upload and upload['connection'] not in (None, connection) else None
+            resumed = upload is not None
+            if upload is None:
+                upload = {'file_id': file_id, 'size': size, 'manifest': manifest, 'fd': None,
+                          'path': os.path.join(self.store_dir, f"{file_id}.part"), 'pending': set(),
+                          'missing': set() if file_id in self.stored_files else set(range(chunk_count(size)))}
+                if upload['missing']:
+                    self.uploads[file_id] = upload
+            if not owner:
+                upload.update(connection=connection, username=username, sender_id=sender_id, touched=now, started=now,
+                              filename=os.path.basename(message.get('filename') or '') or file_id, received=0)
+                stored_chunks = {} if resumed or not upload['missing'] else dict(self.chunk_index)
+        
+        if owner:
+            print(f"[FILE] {username} sent {file_id[:12]} while {owner} is still uploading it, told to wait")
+            self.send_file_status(connection, file_id, [], busy=True)
+            return None, None
+        if resumed:
+            print(f"[FILE] {username} resuming {upload['filename']}: {len(upload['missing'])} of "
+                  f"{chunk_count(size)} chunks missing")
+            return upload, None
+        return upload, stored_chunks
+    
+    def prepare_upload_file(self, upload, stored_chunks):
+        """
+        Give a new upload a preallocated partial file, with any chunk the store already
+        holds copied into it rather than sent again; returns how many were copied.
+        Blocking disk work, kept apart so the asyncio engine can run it off its loop.
+        """
+        if stored_chunks is None or not upload['missing']:
+            return 0
+        upload['fd'] = os.open(upload['path'], os.O_RDWR | os.O_CREAT, 0o600)
+        preallocate(upload['fd'], upload['size'])
+        copied = self.copy_stored_chunks(upload, stored_chunks)
+        print(f"[FILE] {upload['username']} uploading: {upload['filename']} ({upload['size']} bytes, "
+              f"{copied} chunks already stored)")
+        return copied
+    
+    def upload_started(self, connection, upload):
+        """Ask the uploader for the chunks still missing, or store the file if there are none."""
+        with self.store_lock:
+            upload['pending'] = set(upload['missing'])
+        if not upload['missing']:
+            self.finish_upload(upload)
+        self.send_file_status(connection, upload['file_id'], sorted(upload['missing']))
+    
+    def check_file_chunk(self, header, body, username):
+        """
+        Check a MSG_FILE_DATA is a whole chunk of a known upload; returns (upload, chunk
+        index, payload), or None for a chunk of a file stored meanwhile.
+        """
+        meta_len = decode_header(header)[5]
+        message = decode_meta(header, body)
+        upload = self.uploads.get(message.get('file_id'))
+        if upload is None and message.get('file_id') in self.stored_files:
+            # Still in flight on a dropped channel when the resumed upload completed
+            return None
+        if upload is None:
+            raise ValueError(f"{username} sent a chunk of unknown upload {message.get('file_id')}")
+        offset = message.get('offset')
+        payload = memoryview(body)[meta_len:]
+        if offset % FILE_CHANNEL_CHUNK or offset >= upload['size'] or \
+                len(payload) != min(FILE_CHANNEL_CHUNK, upload['size'] - offset):
+            raise ValueError(f"{username} sent bytes {offset}+{len(payload)} of {upload['filename']}, not a chunk")
+        return upload, offset // FILE_CHANNEL_CHUNK, payload
+    
+    def store_chunk(self, upload, index, payload):
+        """Check a chunk against the upload's manifest and write it if it matches; returns whether it did."""
+        # Every chunk is checked against the manifest before it is kept
+        verified = chunk_digest(payload) == manifest_digest(upload['manifest'], index)
+        if verified:
+            write_at(upload['fd'], payload, index * FILE_CHANNEL_CHUNK)
+        else:
+            print(f"[FILE] Chunk {index} of {upload['filename']} from {upload['username']} failed its hash, asking again")
+        return verified
+    
+    def upload_chunk_stored(self, connection, upload, index, size, verified):
+        """Count a stored chunk; once a round of chunks is in, finish the file or ask for what is missing."""
+        with self.store_lock:
+            # Only chunks on the upload's current channel count toward its round
+            requested = index in upload['pending'] and upload['connection'] is connection
+            if requested:
+                upload['pending'].discard(index)
+            if verified and index in upload['missing']:
+                upload['missing'].discard(index)
+                upload['received'] += size
+            upload['touched'] = time.monotonic()
+            # Once every requested chunk is in, the uploader hears what is still missing
+            round_done = requested and not upload['pending']
+            if round_done:
+                upload['pending'] = set(upload['missing'])
+        if round_done:
+            if not upload['missing']:
+                self.finish_upload(upload)
+            self.send_file_status(connection, upload['file_id'], sorted(upload['missing']))
+    
+    def copy_stored_chunks(self, upload, stored_chunks):
+        """Copy every chunk of an upload found in the store (by digest) into its partial file; returns how many."""
+        copied = 0
+        for index in sorted(upload['missing']):
+            source = stored_chunks.get(manifest_digest(upload['manifest'], index))
+            if source is None:
+                continue
+            path, offset = source
+            with open(path, 'rb') as f:
+                copy_range(f.fileno(), upload['fd'], offset, index * FILE_CHANNEL_CHUNK,
+                           min(FILE_CHANNEL_CHUNK, upload['size'] - index * FILE_CHANNEL_CHUNK))
+            upload['missing'].discard(index)
+            copied += 1
+        return copied
+    
+    def finish_upload(self, upload):
+        """Move a complete upload into the file store under its file_id and announce it."""
+        file_id = upload['file_id']
+        path = os.path.join(self.store_dir, file_id)
+        manifest = upload['manifest']
+        announcement = encode_message(MSG_FILE_META, {'username': upload['username'], 'filename': upload['filename'],
+                                                      'filesize': upload['size'], 'file_id': file_id},
+                                      manifest, sender_id=upload['sender_id'])
+        with self.store_lock:
+            self.uploads.pop(file_id, None)
+            if upload['fd'] is not None:
+                os.close(upload['fd'])
+                upload['fd'] = None
+                # Identical contents are stored once
+                if file_id in self.stored_files:
+                    os.remove(upload['path'])
+                else:
+                    os.replace(upload['path'], path)
+            elif file_id not in self.stored_files:
+                # An empty file has no chunks, so it never got a partial file
+                open(path, 'wb').close()
+            for index in range(chunk_count(upload['size'])):
+                self.chunk_index.setdefault(manifest_digest(manifest, index), (path, index * FILE_CHANNEL_CHUNK))
+            self.stored_files[file_id] = {'file_id': file_id, 'filename': upload['filename'], 'size': upload['size'],
+                                          'path': path, 'sender_id': upload['sender_id'], 'announcement': announcement}
+        
+        elapsed = max(time.monotonic() - upload['started'], 1e-6)
+        print(f"[FILE] {upload['username']} shared {upload['filename']} ({upload['received']} bytes sent, "
+              f"{upload['received'] / elapsed / 1e6:.0f} MB/s), stored as {file_id[:12]}")
+        self.broadcast_tcp(MSG_FILE_META, (announcement,), exclude=upload['username'])
+    
+    def send_file_status(self, connection, file_id, missing, busy=False):
+        """Tell an uploader which chunks of a file are still missing (none once it is stored), or that it is busy."""
+        connection.sendall(encode_message(MSG_FILE_STATUS, {'file_id': file_id, 'busy': busy}, pack_chunks(missing)))
+        
+    def announce_stored_files(self, writer):
+        """Tell a newly registered client about every file in the store."""
+        with self.store_lock:
+            announcements = [entry['announcement'] for entry in self.stored_files.values()]
+        for announcement in announcements:
+            writer.enqueue(MSG_FILE_META, (announcement,))
+    
+    def serve_file_range(self, connection, entry, offset, length, username):
+        """Send a byte range of a stored file on a range stream, straight from disk with sendfile."""
+        with open(entry['path'], 'rb') as f:
+            send_file_data(connection, f, {'file_id': entry['file_id']}, offset, length, entry['sender_id'])
+        print(f"[FILE] Sent {entry['filename']} bytes {offset}-{offset + length} to {username}")
+    
+    def suspend_uploads(self, connection):
+        """Keep the uploads of a closed file channel for resuming."""
+        with self.store_lock:
+            for upload in self.uploads.values():
+                if upload['connection'] is connection:
+                    upload['connection'] = None
+                    upload['touched'] = time.monotonic()
+                    print(f"[FILE] Upload of {upload['filename']} from {upload['username']} interrupted, "
+                          f"{len(upload['missing'])} chunks missing")
+    
+    def expire_partial_uploads(self, now):
+        """Discard interrupted uploads nobody resumed within FILE_PARTIAL_TTL (store lock held)."""
+        for file_id, upload in list(self.uploads.items()):
+            if upload['connection'] is None and now - upload['touched'] > FILE_PARTIAL_TTL:
+                del self.uploads[file_id]
+                # An upload dropped before its partial file was opened has nothing on disk
+                if upload['fd'] is not None:
+                    os.close(upload['fd'])
+                    upload['fd'] = None
+                    os.remove(upload['path'])
+                print(f"[FILE] Upload of {upload['filename']} from {upload['username']} expired, discarded")
+    
+    def create_writer(self, connection, username):
+        """Create the outbound queue writer for a newly registered connection."""
+        return ClientWriter(connection, username, self.queue_max_bytes, self.drop_oldest)
+    
+    def unregister_client(self, username, connection):
+        """Remove a disconnected client and tell everyone else."""
+        if not username:
+            return
+        
+        with self.client_lock:
+            client_info = self.clients.get(username)
+            if client_info and client_info['tcp_socket'] is connection:
+                del self.clients[username]
+                self.video_sources.pop(client_info['user_id'], None)
+                self.mixer.remove_speaker(client_info['user_id'])
+            else:
+                client_info = None
+        if client_info:
+            client_info['writer'].close()
+            if client_info['screen_writer']:
+                client_info['screen_writer'].close()
+            if username == self.presenter:
+                self.end_presentation(username, (encode_message(MSG_SCREEN_STOP, {'username': username},
+                                                                sender_id=client_info['user_id']), b''))
+        print(f"[SERVER] User disconnected: {username}")
+        self.broadcast_user_list()
+    
+    def unregister_screen_channel(self, username, connection):
+        """Detach a closed screen channel; a presenter losing theirs ends the presentation."""
+        with self.client_lock:
+            client_info = self.clients.get(username)
+            if not client_info or client_info['screen_socket'] is not connection:
+                return
+            writer = client_info['screen_writer']
+            client_info['screen_writer'] = client_info['screen_socket'] = None
+        writer.close()
+        if username == self.presenter:
+            self.end_presentation(username, (encode_message(MSG_SCREEN_STOP, {'username': username},
+                                                            sender_id=client_info['user_id']), b''))
+    
+    def unregister_file_channel(self, username, connection):
+        """Forget a closed file connection; an upload it left incomplete waits to be resumed."""
+        self.suspend_uploads(connection)
+    
     def handle_udp_video(self):
         """Handle incoming UDP video packets and broadcast to all clients."""
         while self.running:
             try:
                 data, address = self.udp_video_socket.recvfrom(MAX_PACKET_SIZE)
-                
-                # Broadcast to all clients with registered video ports
-                with self.client_lock:
-                    for username, client_info in self.clients.items():
-                        try:
-                            video_port = client_info.get('video_port')
-                            if video_port:
-                                client_address = client_info['address']
-                                self.udp_video_socket.sendto(data, (client_address[0], video_port))
-                        except Exception as e:
-                            print(f"[ERROR] UDP video send to {username}: {e}")
+                self.relay_video(data, address)
             except Exception as e:
                 if self.running:
                     print(f"[ERROR] UDP video: {e}")
     
-    def handle_udp_audio(self):
-        """Handle incoming UDP audio packets, mix, and broadcast to all clients."""
-        audio_buffer = {}
+    def relay_video(self, data, address):
+        """
+        Forward one video datagram (a fragment of one simulcast layer) to every other
+        client with a registered video port that wants that layer of this sender: the
+        full layer for stage speakers and explicit full subscriptions, otherwise the
+        receiver's default layer, or nothing when other webcams are switched off.
+        """
+        msg_type, flags, sender_id, _, _, _, _ = decode_header(data)
+        if msg_type == MSG_VIDEO_FEEDBACK:
+            self.relay_video_feedback(data)
+            return
+        if msg_type == MSG_VIDEO_SUBSCRIBE:
+            self.update_video_subscription(sender_id, decode_message(data))
+            return
         
+        layer = flags & VIDEO_LAYER_MASK
+        on_stage = sender_id in self.video_stage
+        with self.client_lock:
+            # Remember where each sender's video comes from so feedback can reach it
+            self.video_sources[sender_id] = address
+            for username, client_info in self.clients.items():
+                try:
+                    video_port = client_info.get('video_port')
+                    if not video_port or client_info['user_id'] == sender_id:
+                        continue
+                    wanted = client_info['video_layers'].get(sender_id)
+                    if on_stage:
+                        wanted = VIDEO_LAYER_FULL
+                    elif wanted is None:
+                        if self.video_others == 'none':
+                            continue
+                        wanted = client_info['video_default_layer']
+                    if wanted != layer:
+                        continue
+                    self.udp_video_socket.sendto(data, (client_info['address'][0], video_port))
+                except Exception as e:
+                    print(f"[ERROR] UDP video send to {username}: {e}")
+    
+    def update_video_subscription(self, receiver_id, message):
+        """Record which video layer a receiver wants from each sender."""
+        layers = {int(source): layer for source, layer in message.get('layers', {}).items()}
+        default_layer = message.get('default_layer', VIDEO_LAYER_THUMB)
+        with self.client_lock:
+            for client_info in self.clients.values():
+                if client_info['user_id'] == receiver_id:
+                    client_info['video_layers'] = layers
+                    client_info['video_default_layer'] = default_layer
+    
+    def relay_video_feedback(self, data):
+        """Forward a receiver's loss/jitter report to the video sender it describes."""
+        source = decode_message(data).get('source')
+        with self.client_lock:
+            address = self.video_sources.get(source)
+        if address:
+            self.udp_video_socket.sendto(data, address)
+    
+    def handle_udp_audio(self):
+        """Handle incoming UDP audio packets and feed them to the mixer."""
         while self.running:
             try:
                 data, address = self.udp_audio_socket.recvfrom(MAX_PACKET_SIZE)
-                
-                # Simple broadcast (mixing would require numpy audio processing)
-                with self.client_lock:
-                    for username, client_info in self.clients.items():
-                        try:
-                            audio_port = client_info.get('audio_port')
-                            if audio_port:
-                                client_address = client_info['address']
-                                self.udp_audio_socket.sendto(data, (client_address[0], audio_port))
-                        except Exception as e:
-                            print(f"[ERROR] UDP audio send to {username}: {e}")
+                self.relay_audio(data, address)
             except Exception as e:
                 if self.running:
                     print(f"[ERROR] UDP audio: {e}")
     
-    def broadcast_tcp(self, message, exclude=None):
-        """Broadcast TCP message to all clients except excluded username."""
-        msg_data = pickle.dumps(message)
-        msg_length = struct.pack('!I', len(msg_data))
+    def relay_audio(self, data, address):
+        """Hand one speaker's audio datagram to the mixer."""
+        msg_type, flags, sender_id, seq, _, meta_len, payload_len = decode_header(data)
+        if msg_type != MSG_AUDIO:
+            return
+        if flags & AUDIO_FLAG_SILENCE:
+            self.mixer.mark_silent(sender_id, decode_message(data).get('noise_rms', 0))
+            return
+        start = HEADER_SIZE + meta_len
+        self.mixer.push(sender_id, seq, memoryview(data)[start:start + payload_len], codec_id_from_flags(flags))
+    
+    def run_audio_mixer(self):
+        """Mix audio once per chunk period, pacing against a deadline rather than sleeping a fixed time."""
+        next_tick = time.monotonic()
+        while self.running:
+            try:
+                self.mix_audio()
+            except Exception as e:
+                print(f"[ERROR] Audio mixer: {e}")
+            next_tick += MIXER_TICK
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind: resume from now instead of bursting to catch up
+                next_tick = time.monotonic()
+    
+    def mix_audio(self):
+        """Send one mixed chunk to every listener with a registered audio port."""
+        self.mix_seq += 1
+        shared_mix, speaker_mixes = self.mixer.mix()
+        self.video_stage = frozenset(self.mixer.top_speakers(self.video_speakers))
+        if shared_mix is None:
+            self.mix_codec_states = {}
+            self.send_comfort_noise()
+            return
         
         with self.client_lock:
-            for username, client_info in self.clients.items():
-                if username != exclude:
-                    try:
-                        client_info['tcp_socket'].sendall(msg_length + msg_data)
-                    except Exception as e:
-                        print(f"[ERROR] Broadcast to {username}: {e}")
+            listeners = [(username, client_info['user_id'], client_info['audio_codec'],
+                          (client_info['address'][0], client_info['audio_port']))
+                         for username, client_info in self.clients.items() if client_info.get('audio_port')]
+        
+        # Listeners who are not speaking share one encoded packet per codec. Every
+        # stream keeps its codec state only while it is sent on consecutive ticks
+        timestamp = time.time()
+        shared_packets = {}
+        states = {}
+        for username, listener_id, codec_id, listener_address in listeners:
+            codec = get_codec(codec_id)
+            if listener_id in speaker_mixes:
+                mix = speaker_mixes[listener_id]
+                if mix is None:
+                    continue
+                state = states[listener_id] = self.mix_codec_states.get(listener_id, {})
+                packet = encode_message(MSG_AUDIO, payload=codec.encode(mix, state), seq=self.mix_seq,
+                                        timestamp=timestamp, flags=codec_id)
+            else:
+                packet = shared_packets.get(codec_id)
+                if packet is None:
+                    state = states[codec_id, 'shared'] = self.mix_codec_states.get((codec_id, 'shared'), {})
+                    packet = shared_packets[codec_id] = encode_message(
+                        MSG_AUDIO, payload=codec.encode(shared_mix, state), seq=self.mix_seq,
+                        timestamp=timestamp, flags=codec_id
+                    )
+            try:
+                self.udp_audio_socket.sendto(packet, listener_address)
+            except Exception as e:
+                print(f"[ERROR] UDP audio send to {username}: {e}")
+        self.mix_codec_states = states
+    
+    def send_comfort_noise(self):
+        """While nobody speaks, periodically tell listeners what background level to play."""
+        now = time.monotonic()
+        if now - self.last_comfort < VAD_COMFORT_INTERVAL:
+            return
+        self.last_comfort = now
+        noise_rms = self.mixer.comfort_noise_level()
+        if not noise_rms:
+            return
+        
+        with self.client_lock:
+            listeners = [(username, (client_info['address'][0], client_info['audio_port']))
+                         for username, client_info in self.clients.items() if client_info.get('audio_port')]
+        
+        packet = encode_message(MSG_AUDIO, {'noise_rms': noise_rms}, seq=self.mix_seq, flags=AUDIO_FLAG_SILENCE)
+        for username, listener_address in listeners:
+            try:
+                self.udp_audio_socket.sendto(packet, listener_address)
+            except Exception as e:
+                print(f"[ERROR] UDP audio send to {username}: {e}")
+    
+    def broadcast_tcp(self, msg_type, frame, exclude=None, supersede=False):
+        """Queue a TCP frame (tuple of buffers) for all clients except excluded username."""
+        with self.client_lock:
+            writers = [client_info['writer'] for username, client_info in self.clients.items()
+                       if username != exclude]
+        
+        # Writers only append to their own queue, so a slow client never blocks this loop
+        for writer in writers:
+            writer.enqueue(msg_type, frame, supersede)
+    
+    def broadcast_screen(self, msg_type, frame, exclude=None, supersede=False):
+        """Queue a screen frame for all clients except excluded username, on their screen channel if open."""
+        with self.client_lock:
+            writers = [client_info['screen_writer'] or client_info['writer']
+                       for username, client_info in self.clients.items() if username != exclude]
+        for writer in writers:
+            writer.enqueue(msg_type, frame, supersede)
+    
+    def replay_screen(self, writer):
+        """Bring a newly registered client into a running presentation (caller holds screen_lock)."""
+        for msg_type, frame in self.screen_cache:
+            writer.enqueue(msg_type, frame)
+    
+    def end_presentation(self, username, frame):
+        """Forget the presenter's cached screen and tell viewers the share stopped."""
+        with self.screen_lock:
+            if username != self.presenter:
+                return
+            self.presenter = None
+            self.screen_cache = []
+            self.broadcast_screen(MSG_SCREEN_STOP, frame, exclude=username)
+        print(f"[SCREEN] {username} stopped screen sharing")
+    
+    def get_queue_stats(self):
+        """Return outbound queue metrics per connected client."""
+        with self.client_lock:
+            writers = {username: client_info['writer'] for username, client_info in self.clients.items()}
+            writers.update({f"{username}/screen": client_info['screen_writer']
+                            for username, client_info in self.clients.items() if client_info['screen_writer']})
+        return {username: writer.stats() for username, writer in writers.items()}
+    
+    def log_queue_stats(self):
+        """Print outbound queue metrics for clients with backlog or drops."""
+        for username, stats in self.get_queue_stats().items():
+            if stats['depth'] or stats['dropped']:
+                print(f"[QUEUE] {username}: depth={stats['depth']} peak={stats['peak_depth']} "
+                      f"bytes={stats['bytes_queued']} dropped={stats['dropped']}")
     
     def broadcast_user_list(self):
         """Broadcast current user list to all connected clients."""
         with self.client_lock:
             user_list = list(self.clients.keys())
         
-        message = {
-            'type': MSG_USER_LIST,
-            'users': user_list
-        }
-        self.broadcast_tcp(message)
+        frame = encode_message(MSG_USER_LIST, {'users': user_list})
+        self.broadcast_tcp(MSG_USER_LIST, (frame,))
+    
+    def check_body_size(self, header):
+        """Return the body size announced by a frame header, rejecting oversized frames."""
+        body_size = frame_body_size(header)
+        if body_size > MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {body_size} bytes exceeds MAX_FRAME_SIZE")
+        return body_size
     
     def recv_exact(self, sock, num_bytes):
-        """Receive exact number of bytes from socket."""
-        data = b''
-        while len(data) < num_bytes:
-            chunk = sock.recv(num_bytes - len(data))
-            if not chunk:
+        """Receive exact number of bytes from socket into one preallocated buffer."""
+        data = bytearray(num_bytes)
+        view = memoryview(data)
+        received = 0
+        while received < num_bytes:
+            count = sock.recv_into(view[received:])
+            if not count:
                 return None
-            data += chunk
+            received += count
         return data
     
     def stop(self):
         """Stop the server and close all sockets."""
         self.running = False
         
+        with self.client_lock:
+            writers = [client_info['writer'] for client_info in self.clients.values()]
+            writers += [client_info['screen_writer'] for client_info in self.clients.values()
+                        if client_info['screen_writer']]
+        for writer in writers:
+            writer.close()
+        
         if self.tcp_socket:
             self.tcp_socket.close()
+        if self.screen_socket:
+            self.screen_socket.close()
+        if self.file_socket:
+            self.file_socket.close()
         if self.udp_video_socket:
             self.udp_video_socket.close()
         if self.udp_audio_socket:
             self.udp_audio_socket.close()
+        with self.store_lock:
+            for upload in self.uploads.values():
+                if upload['fd'] is not None:
+                    os.close(upload['fd'])
+            self.uploads.clear()
+        if self.store_dir:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
         
         print("[SERVER] Server stopped.")
 
 if __name__ == "__main__":
-    server = CommunicationServer()
+    parser = argparse.ArgumentParser(description="LAN communication relay server")
+    parser.add_argument('--host', default='0.0.0.0', help="address to bind all sockets to")
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help="threaded: one OS thread per connection; asyncio: single event loop")
+    parser.add_argument('--video-speakers', type=int, default=VIDEO_STAGE_SPEAKERS,
+                        help="number of recent active speakers whose full video everyone receives")
+    parser.add_argument('--video-others', choices=['thumbnail', 'none'], default=VIDEO_OTHERS_LAYER,
+                        help="what to forward of every other webcam")
+    parser.add_argument('--send-queue-mb', type=float, default=SEND_QUEUE_MAX_BYTES / 1024 / 1024,
+                        help="backlog at which a slow client is disconnected")
+    parser.add_argument('--file-store', default=FILE_STORE_DIR,
+                        help="directory to keep shared files in (default: the system temp directory)")
+    args = parser.parse_args()
+    
+    options = {'queue_max_bytes': int(args.send_queue_mb * 1024 * 1024), 'video_speakers': args.video_speakers,
+               'video_others': args.video_others, 'file_store': args.file_store}
+    if args.engine == 'asyncio':
+        from server.async_server import AsyncCommunicationServer
+        server = AsyncCommunicationServer(args.host, **options)
+    else:
+        server = CommunicationServer(args.host, **options)
     server.start()
 
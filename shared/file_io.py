@@ -0,0 +1,142 @@
+"""
+File I/O helpers shared by the client and the server for file transfers: chunk
+manifests, writing chunks at their offset into a preallocated file, splitting the
+chunks still needed over range streams, and sending a byte range of a file as
+MSG_FILE_DATA frames with the payloads going out through sendfile.
+"""
+
+import hashlib
+import os
+import struct
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+
+def preallocate(fd, size):
+    """Reserve size bytes for a file up front, so writes do not fragment it or fail halfway on a full disk."""
+    if hasattr(os, 'posix_fallocate') and size > 0:
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # Not supported by every filesystem; fall back to a sparse file
+            pass
+    os.ftruncate(fd, size)
+
+def write_at(fd, data, offset):
+    """Write data at a file offset without moving the file position (pwrite where available)."""
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data):]
+
+def file_chunks(offset, length, chunk_size=FILE_CHANNEL_CHUNK):
+    """Yield (offset, count) for every chunk of the byte range [offset, offset + length)."""
+    end = offset + length
+    for start in range(offset, end, chunk_size):
+        yield start, min(chunk_size, end - start)
+
+def read_at(fd, offset, count):
+    """Read up to count bytes at a file offset without moving the file position."""
+    if hasattr(os, 'pread'):
+        return os.pread(fd, count, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, count)
+
+def copy_range(src_fd, dst_fd, src_offset, dst_offset, count):
+    """Copy bytes between two files inside the kernel (copy_file_range) where available."""
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+                if not copied:
+                    break
+                src_offset += copied
+                dst_offset += copied
+                count -= copied
+            if count == 0:
+                return
+        except OSError:
+            # Not supported across every pair of filesystems; copy through a buffer
+            pass
+    while count > 0:
+        data = read_at(src_fd, src_offset, min(count, FILE_CHANNEL_CHUNK))
+        if not data:
+            raise OSError("source file ended early")
+        write_at(dst_fd, data, dst_offset)
+        src_offset += len(data)
+        dst_offset += len(data)
+        count -= len(data)
+
+def chunk_count(size):
+    """Number of FILE_CHANNEL_CHUNK chunks in a size-byte file."""
+    return -(-size // FILE_CHANNEL_CHUNK)
+
+def chunk_digest(data):
+    return hashlib.sha256(data).digest()
+
+def manifest_digest(manifest, index):
+    """The digest a manifest expects for chunk index."""
+    return manifest[index * FILE_DIGEST_SIZE:(index + 1) * FILE_DIGEST_SIZE]
+
+def manifest_id(manifest):
+    """The file_id of the file a manifest describes."""
+    return hashlib.sha256(manifest).hexdigest()
+
+def file_manifest(fd, size):
+    """Hash a file chunk by chunk and return its manifest."""
+    return b''.join(chunk_digest(read_at(fd, offset, count)) for offset, count in file_chunks(0, size))
+
+def check_manifest(manifest, file_id, size):
+    """Whether a manifest matches a file_id and describes a size-byte file."""
+    return len(manifest) == chunk_count(size) * FILE_DIGEST_SIZE and manifest_id(manifest) == file_id
+
+def pack_chunks(indices):
+    """Chunk indices as a MSG_FILE_STATUS payload."""
+    return struct.pack(f'!{len(indices)}I', *indices)
+
+def unpack_chunks(payload):
+    return list(struct.unpack(f'!{len(payload) // 4}I', payload))
+
+def chunk_runs(indices, size):
+    """Turn sorted chunk indices into (offset, length) byte ranges, one per run of consecutive chunks."""
+    runs = []
+    for index in indices:
+        offset = index * FILE_CHANNEL_CHUNK
+        length = min(FILE_CHANNEL_CHUNK, size - offset)
+        if runs and runs[-1][0] + runs[-1][1] == offset:
+            runs[-1] = (runs[-1][0], runs[-1][1] + length)
+        else:
+            runs.append((offset, length))
+    return runs
+
+def split_ranges(indices, size, streams=FILE_DOWNLOAD_STREAMS, min_range=FILE_RANGE_MIN):
+    """
+    Split the sorted chunk indices still needed from a size-byte file over at most
+    streams range streams, none given less than min_range; returns each stream's list
+    of (offset, length) ranges.
+    """
+    count = max(1, min(streams, len(indices) * FILE_CHANNEL_CHUNK // min_range))
+    groups = [indices[len(indices) * index // count:len(indices) * (index + 1) // count] for index in range(count)]
+    return [chunk_runs(group, size) for group in groups if group]
+
+def send_file_data(sock, f, meta, offset, length, sender_id=0, progress=None):
+    """
+    Send the byte range [offset, offset + length) of a file on a blocking socket as
+    MSG_FILE_DATA frames of up to FILE_CHANNEL_CHUNK bytes, each carrying meta plus
+    its 'offset': the header goes out with sendall and the payload straight from the
+    file with sendfile, without passing through Python buffers. progress(count) is
+    called after every chunk.
+    """
+    for start, count in file_chunks(offset, length):
+        sock.sendall(encode_head(MSG_FILE_DATA, dict(meta, offset=start), count, sender_id=sender_id))
+        if sock.sendfile(f, start, count) != count:
+            raise OSError("file changed while it was being sent")
+        if progress:
+            progress(count)
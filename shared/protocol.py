@@ -1,29 +1,39 @@
 """
 Shared protocol definitions for the LAN communication system.
-Defines message types and constants used across server and client.
+Defines message types, constants and the binary wire format used across server and client.
 """
 
-# TCP Message Types
-MSG_REGISTER = "REGISTER"
-MSG_UDP_REGISTER = "UDP_REGISTER"
-MSG_CHAT = "CHAT"
-MSG_FILE_META = "FILE_META"
-MSG_FILE_REQUEST = "FILE_REQUEST"
-MSG_FILE_DATA = "FILE_DATA"
-MSG_SCREEN_START = "SCREEN_START"
-MSG_SCREEN_STOP = "SCREEN_STOP"
-MSG_SCREEN_FRAME = "SCREEN_FRAME"
-MSG_USER_LIST = "USER_LIST"
-MSG_DISCONNECT = "DISCONNECT"
+import json
+import struct
+import time
+import zlib
+
+# TCP Message Types (one-byte type codes on the wire)
+MSG_REGISTER = 1
+MSG_UDP_REGISTER = 2
+MSG_CHAT = 3
+MSG_FILE_META = 4
+MSG_FILE_REQUEST = 5
+MSG_FILE_DATA = 6
+MSG_SCREEN_START = 7
+MSG_SCREEN_STOP = 8
+MSG_SCREEN_FRAME = 9
+MSG_USER_LIST = 10
+MSG_DISCONNECT = 11
+MSG_FILE_STATUS = 12
 
 # UDP Message Types
-MSG_VIDEO = "VIDEO"
-MSG_AUDIO = "AUDIO"
+MSG_VIDEO = 32
+MSG_AUDIO = 33
+MSG_VIDEO_FEEDBACK = 34
+MSG_VIDEO_SUBSCRIBE = 35
 
 # Server Ports
 TCP_PORT = 5555
 UDP_VIDEO_PORT = 5556
 UDP_AUDIO_PORT = 5557
+SCREEN_PORT = 5558                        # TCP, screen sharing only (see below)
+FILE_PORT = 5559                          # TCP, file contents only (see below)
 
 # Configuration
 MAX_PACKET_SIZE = 65507
@@ -35,3 +45,290 @@ VIDEO_WIDTH = 640
 VIDEO_HEIGHT = 480
 VIDEO_FPS = 15
 
+# Server outbound send queues. Types listed in SEND_QUEUE_DROP_OLDEST may be dropped
+# oldest-first, beyond their limit (None: only when over SEND_QUEUE_MAX_BYTES). Screen
+# deltas build on each other, so they are not capped by count; a keyframe instead
+# supersedes every screen frame still queued before it.
+SEND_QUEUE_MAX_BYTES = 16 * 1024 * 1024
+SEND_QUEUE_DROP_OLDEST = {MSG_SCREEN_FRAME: None}
+SEND_QUEUE_PRIORITY = {MSG_CHAT, MSG_USER_LIST}   # sent ahead of anything else queued
+QUEUE_STATS_INTERVAL = 30
+
+# Largest TCP frame body the server accepts (bigger frames close the connection)
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Server audio mixer
+MIXER_TICK = AUDIO_CHUNK / AUDIO_RATE     # one chunk period (~23 ms)
+MIXER_JITTER_DEPTH = 2                    # chunks buffered per speaker before mixing starts
+MIXER_MAX_DEPTH = 6                       # chunks beyond this are skipped to bound latency
+MIXER_RESTART_GAP = 256                   # sequence jump treated as a restarted stream
+MIXER_SPEAKER_TIMEOUT = 1.0               # seconds of silence before a speaker is dropped
+
+# Client audio jitter buffer
+JITTER_MIN_DEPTH = 2                      # chunks buffered before playout starts
+JITTER_MAX_DEPTH = 10                     # upper bound on playout delay (~230 ms)
+JITTER_SPREAD = 3                         # target delay in multiples of measured jitter
+JITTER_MAX_CONCEAL = 3                    # chunks concealed before falling silent
+JITTER_CONCEAL_FADE = 0.5                 # gain applied per concealed chunk
+JITTER_SHRINK_INTERVAL = 25               # chunks played between two chunks skipped to cut delay
+JITTER_RESTART_GAP = 256                  # sequence jump back treated as a restarted stream
+JITTER_STATS_INTERVAL = 10
+
+# Audio codecs (see shared/audio_codec.py); the id rides in the low byte of MSG_AUDIO flags.
+# Playback nodes offer their codecs in preference order in MSG_UDP_REGISTER ('audio_codecs'),
+# and the server encodes each listener's mix with the first one it supports.
+AUDIO_CODEC_MASK = 0x00FF
+CODEC_PCM = 0                             # raw int16 at AUDIO_RATE
+CODEC_MULAW_16K = 1                       # 16 kHz, 8-bit mu-law
+AUDIO_CODEC = CODEC_MULAW_16K             # codec capture nodes send with
+AUDIO_CODEC_PREFERENCE = [CODEC_MULAW_16K, CODEC_PCM]
+
+# Voice activity detection: capture nodes stop sending during silence and instead
+# send a MSG_AUDIO with AUDIO_FLAG_SILENCE (meta 'noise_rms') every VAD_COMFORT_INTERVAL
+AUDIO_FLAG_SILENCE = 0x0100
+VAD_MIN_RMS = 200                         # absolute speech floor in int16 units (~-44 dBFS)
+VAD_ENERGY_RATIO = 3.0                    # speech must be this many times the noise floor RMS
+VAD_ZCR_RANGE = (0.1, 0.4)                # zero-crossing rate of quieter unvoiced speech
+VAD_HANGOVER = 12                         # chunks still sent after speech ends (~280 ms)
+VAD_COMFORT_INTERVAL = 0.5                # seconds between comfort-noise markers
+
+# Adaptive video bitrate: render nodes report each sender's fragment loss and frame
+# jitter every VIDEO_FEEDBACK_INTERVAL as MSG_VIDEO_FEEDBACK (meta 'source', 'loss',
+# 'jitter_ms', 'kbps'); the server forwards reports to the address the source sends from
+VIDEO_FEEDBACK_INTERVAL = 1.0
+VIDEO_LADDER = [                          # (width, height, fps) steps, lowest first
+    (320, 240, 10),
+    (480, 360, 15),
+    (640, 480, 15),
+    (1280, 720, 20),
+    (1920, 1080, 30)
+]
+VIDEO_QUALITY_RANGE = (25, 85)
+VIDEO_START_BITRATE = 1000 * 1000         # bits per second
+VIDEO_MIN_BITRATE = 100 * 1000
+VIDEO_MAX_BITRATE = 10 * 1000 * 1000
+VIDEO_LOSS_HIGH = 0.10                    # loss above this cuts the target bitrate
+VIDEO_LOSS_LOW = 0.02                     # loss below this lets it grow
+VIDEO_JITTER_HIGH = 40                    # ms of frame jitter treated as queue build-up
+
+# Simulcast: capture nodes publish every frame as a full layer (adaptive, above) and a
+# small thumbnail layer; the layer id rides in the low bits of MSG_VIDEO flags. Render
+# nodes send MSG_VIDEO_SUBSCRIBE (meta 'default_layer' and 'layers' {source id: layer})
+# and the server forwards each receiver only the layer it asked for, never its own video.
+VIDEO_LAYER_MASK = 0x000F
+VIDEO_LAYER_THUMB = 0
+VIDEO_LAYER_FULL = 1
+VIDEO_THUMB_SIZE = (320, 240)
+VIDEO_THUMB_QUALITY = 40
+
+# Active-speaker video routing: the server ranks speakers by the smoothed level of the
+# audio it mixes and forwards the full layer of the VIDEO_STAGE_SPEAKERS most recent
+# dominant speakers to everyone. Other webcams go out as thumbnails, or not at all when
+# VIDEO_OTHERS_LAYER is 'none' (egress then grows linearly with participants).
+# Server flags --video-speakers/--video-others override both.
+VIDEO_STAGE_SPEAKERS = 4
+VIDEO_OTHERS_LAYER = 'thumbnail'          # 'thumbnail' or 'none'
+SPEAKER_LEVEL_SMOOTHING = 0.1             # per mixer tick (~0.25 s time constant)
+SPEAKER_MIN_LEVEL = VAD_MIN_RMS           # smoothed RMS needed to take the stage
+VIDEO_STREAM_TIMEOUT = 3.0                # seconds before a render node drops a tile that stopped
+
+# Render nodes decode only the newest complete frame of each stream, on a pool of
+# VIDEO_DECODE_THREADS threads (at most one decode per stream at a time), at 1/2, 1/4
+# or 1/8 scale when that still covers the tile the stream is shown in, and log each
+# stream's decode times every VIDEO_DECODE_STATS_INTERVAL.
+VIDEO_DECODE_THREADS = 4
+VIDEO_DECODE_STATS_INTERVAL = 10.0
+VIDEO_DISPLAY_FPS = 30                    # the grid is redrawn at most this often, and only when a frame changed
+
+# Capture nodes run capture, encode and send as separate threads: the capture thread
+# drains the camera and leaves the newest frame due at the controller's frame rate
+# (VIDEO_FPS to start with) in a one-frame slot, VIDEO_ENCODE_THREADS encoders take
+# the newest frame from it and the sender takes the newest encoded one, so frames a
+# busy CPU can't keep up with are dropped rather than queued. The frame timestamp is
+# the capture time. Send rate, drops, encode and capture-to-send times are logged
+# every VIDEO_CAPTURE_STATS_INTERVAL.
+VIDEO_ENCODE_THREADS = 2
+VIDEO_CAPTURE_STATS_INTERVAL = 10.0
+
+# The webcam is opened at the controller's rung rather than its largest mode, and
+# switched to a new rung's size and rate once the controller has held that rung for
+# CAMERA_MODE_HOLD seconds (frames are resized meanwhile), so a flapping rung doesn't
+# restart the camera's stream. Modes above CAMERA_RAW_PIXEL_RATE pixels a second, more
+# than uncompressed YUYV fits through USB 2, are requested as MJPG.
+CAMERA_MODE_HOLD = 5.0
+CAMERA_RAW_PIXEL_RATE = 10 * 1000 * 1000
+
+# Screen sharing: each MSG_SCREEN_FRAME is either a keyframe (SCREEN_FLAG_KEYFRAME, payload
+# one JPEG of the whole screen) or a delta whose meta 'rects' lists [x, y, w, h, size] for
+# every changed run of tiles, with the rects' JPEGs back to back as the payload (see
+# client/modules/screen_codec.py). A static screen sends nothing between keyframes.
+# Screen messages travel on their own TCP connection to SCREEN_PORT, opened after the
+# client registers (its first frame is a MSG_REGISTER naming the user), so frame data
+# never delays chat and control messages. A client connects that channel before it
+# registers and sets 'screen_channel' in its MSG_REGISTER only if it connected; such
+# clients get screen messages there, others (or one whose channel closed) get and
+# send them inline on the control connection.
+SCREEN_FLAG_KEYFRAME = 0x0001
+SCREEN_MONITOR = 1                        # mss monitor index captured when no region is set
+SCREEN_REGION = None                      # or {'left', 'top', 'width', 'height'}, e.g. a window's bounds
+SCREEN_WIDTH = 1024                       # captures are scaled to fit, keeping their aspect ratio
+SCREEN_HEIGHT = 768
+SCREEN_FPS = 10                           # slides, typing
+SCREEN_FPS_MIN = 2                        # after SCREEN_STATIC_CAPTURES unchanged captures
+SCREEN_FPS_MAX = 24                       # while the smoothed changed-tile fraction is at least SCREEN_MOTION_DIRTY
+SCREEN_STATIC_CAPTURES = 10
+SCREEN_MOTION_DIRTY = 0.15
+SCREEN_QUALITY = 70
+SCREEN_TILE = 64                          # pixels; a multiple of the 8x8 JPEG block
+SCREEN_KEYFRAME_INTERVAL = 5.0            # seconds; also repairs deltas dropped by a slow link
+SCREEN_KEYFRAME_DIRTY = 0.5               # fraction of changed tiles above which a keyframe is sent
+
+# File transfer: file contents travel on their own TCP connections to FILE_PORT. Files
+# are cut into FILE_CHANNEL_CHUNK-byte chunks; a file's manifest is the SHA-256 digests
+# of its chunks, concatenated, and its 'file_id' is the SHA-256 of the manifest. A
+# client's file channel, opened after it registers (its first frame is a MSG_REGISTER
+# naming the user), carries its uploads: a MSG_FILE_META ('filename', 'filesize',
+# 'file_id', the manifest as payload), answered with a MSG_FILE_STATUS ('file_id', the
+# indices of the chunks still missing as '!I' values in the payload). The client sends
+# those chunks as MSG_FILE_DATA frames ('file_id', 'offset'), payloads sent with sendfile,
+# and gets another MSG_FILE_STATUS once they are in: empty when the file is complete, or
+# the chunks that failed their hash. An upload cut off midway is kept on the server
+# for FILE_PARTIAL_TTL seconds, so sending the same MSG_FILE_META again resumes it;
+# while another channel is still sending that file, the MSG_FILE_STATUS says 'busy'
+# instead and the client tries again later. A client waits at most FILE_CHANNEL_TIMEOUT
+# seconds for any reply or send on its file channel before treating it as dropped.
+# chunks the store already holds, from any file, are copied on the server instead of
+# being sent. The server keeps every file in a store keyed by 'file_id' and announces
+# it as a MSG_FILE_META with the manifest on the control connections (also to clients
+# that join later). Participants who want the file send MSG_FILE_REQUESTs ('file_id',
+# 'offset', 'length', whole chunks) on FILE_PORT connections of their own and get those
+# bytes back as MSG_FILE_DATA frames of one chunk each ('file_id', 'offset'); downloads
+# of at least FILE_RANGE_MIN bytes are split over FILE_DOWNLOAD_STREAMS such range
+# streams. Receivers check every chunk against the manifest and write it at its offset
+# into a preallocated '.part' file in FILE_DOWNLOAD_DIR, renamed into place once every
+# chunk has arrived. Chunks found in an earlier '.part' of the file or in a local file
+# of the same name or size are taken from disk instead, and chunks lost to a dropped
+# stream are requested again, up to FILE_RETRIES times.
+FILE_CHANNEL_CHUNK = 4 * 1024 * 1024
+FILE_DIGEST_SIZE = 32                     # SHA-256 digest of one chunk in a manifest
+FILE_DOWNLOAD_STREAMS = 4
+FILE_RANGE_MIN = 16 * 1024 * 1024         # smallest range worth its own stream
+FILE_RETRIES = 3
+FILE_RETRY_DELAY = 1.0                    # seconds, doubled after every failed attempt
+FILE_PARTIAL_TTL = 3600                   # seconds an interrupted upload waits to be resumed
+FILE_CHANNEL_TIMEOUT = 30.0
+FILE_DOWNLOAD_DIR = 'downloads'
+FILE_STORE_DIR = None                     # server file store parent; None for the system temp directory
+
+# Server listen backlog (must absorb a room's worth of simultaneous joins)
+TCP_BACKLOG = 512
+
+# Wire format
+# Every TCP message and UDP datagram is one frame: a fixed header, then optional
+# UTF-8 JSON metadata (small fields such as username or filename), then the raw
+# payload bytes (audio samples, JPEG data, file chunks).
+#
+#   version u8 | type u8 | flags u16 | sender_id u32 | seq u32 |
+#   timestamp f64 (seconds since epoch) | meta_len u16 | payload_len u32
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('!BBHIIdHI')
+HEADER_SIZE = HEADER.size
+META_ENCODER = json.JSONEncoder(separators=(',', ':'))
+META_DECODER = json.JSONDecoder()
+
+def user_id(username):
+    """Return the 32-bit sender id carried in frame headers for a username."""
+    return zlib.crc32(username.encode('utf-8'))
+
+def encode_meta(meta):
+    """Encode a metadata dict once, for senders that reuse it on every packet."""
+    return META_ENCODER.encode(meta).encode('utf-8') if meta else b''
+
+def encode_message(msg_type, meta=None, payload=b'', sender_id=0, seq=0, timestamp=None, flags=0):
+    """Build one frame from a message type, metadata (dict or encode_meta bytes) and raw payload."""
+    return encode_head(msg_type, meta, len(payload), sender_id, seq, timestamp, flags) + payload
+
+def encode_head(msg_type, meta=None, payload_len=0, sender_id=0, seq=0, timestamp=None, flags=0):
+    """Build the header and metadata of a frame whose payload_len payload bytes are sent separately (e.g. by sendfile)."""
+    meta_data = meta if isinstance(meta, bytes) else encode_meta(meta)
+    if timestamp is None:
+        timestamp = time.time()
+    header = HEADER.pack(PROTOCOL_VERSION, msg_type, flags, sender_id, seq & 0xFFFFFFFF,
+                         timestamp, len(meta_data), payload_len)
+    return header + meta_data
+
+def decode_header(data):
+    """Unpack a frame header into (msg_type, flags, sender_id, seq, timestamp, meta_len, payload_len)."""
+    version, msg_type, flags, sender_id, seq, timestamp, meta_len, payload_len = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    return msg_type, flags, sender_id, seq, timestamp, meta_len, payload_len
+
+def frame_body_size(header):
+    """Return how many bytes follow a frame header on a stream."""
+    _, _, _, _, _, meta_len, payload_len = decode_header(header)
+    return meta_len + payload_len
+
+def decode_meta(header, body):
+    """Decode only the metadata of a frame received as separate header and body buffers."""
+    _, _, _, _, _, meta_len, _ = decode_header(header)
+    return META_DECODER.decode(str(memoryview(body)[:meta_len], 'utf-8')) if meta_len else {}
+
+def decode_message(data):
+    """
+    Decode a frame into a message dict: metadata fields plus header fields, with
+    'payload' as a memoryview into data (copy it if it must outlive the frame).
+    """
+    msg_type, flags, sender_id, seq, timestamp, meta_len, payload_len = decode_header(data)
+    meta_end = HEADER_SIZE + meta_len
+    if len(data) < meta_end + payload_len:
+        raise ValueError("Truncated frame")
+
+    view = memoryview(data)
+    message = META_DECODER.decode(str(view[HEADER_SIZE:meta_end], 'utf-8')) if meta_len else {}
+    message['type'] = msg_type
+    message['flags'] = flags
+    message['sender_id'] = sender_id
+    message['seq'] = seq
+    message['timestamp'] = timestamp
+    message['payload'] = view[meta_end:meta_end + payload_len]
+    return message
+
+# Video fragmentation
+# A video frame is sent as one or more datagrams of at most VIDEO_MTU bytes, so large
+# frames never depend on IP fragmentation (where losing any piece loses the datagram).
+# Every fragment carries the frame id in its header seq and starts its payload with
+#
+#   fragment index u16 | fragment count u16
+#
+# Only fragment 0 carries the metadata.
+VIDEO_MTU = 1400                          # leaves room for IP/UDP headers within a 1500-byte MTU
+FRAGMENT = struct.Struct('!HH')
+VIDEO_MAX_FRAGMENTS = 2048                # ~2.7 MB, enough for a 1080p JPEG at high quality
+VIDEO_REASSEMBLY_TIMEOUT = 0.5            # seconds before an incomplete frame is discarded
+VIDEO_SOCKET_BUFFER = 4 * 1024 * 1024     # UDP buffer for bursts of fragments
+
+def encode_fragments(msg_type, meta, payload, sender_id=0, seq=0, timestamp=None, flags=0, mtu=VIDEO_MTU):
+    """Split one frame's payload into datagrams of at most mtu bytes, sharing seq and timestamp."""
+    meta_data = meta if isinstance(meta, bytes) else encode_meta(meta)
+    if timestamp is None:
+        timestamp = time.time()
+    first_size = mtu - HEADER_SIZE - FRAGMENT.size - len(meta_data)
+    rest_size = mtu - HEADER_SIZE - FRAGMENT.size
+    count = 1 + max(0, -(-(len(payload) - first_size) // rest_size))
+    if count > VIDEO_MAX_FRAGMENTS:
+        raise ValueError(f"Frame of {len(payload)} bytes needs {count} fragments")
+
+    view = memoryview(payload)
+    fragments = [encode_message(msg_type, meta_data, FRAGMENT.pack(0, count) + view[:first_size],
+                                sender_id, seq, timestamp, flags)]
+    for index in range(1, count):
+        start = first_size + (index - 1) * rest_size
+        fragments.append(encode_message(msg_type, None, FRAGMENT.pack(index, count) + view[start:start + rest_size],
+                                        sender_id, seq, timestamp, flags))
+    return fragments
+
+def split_fragment(payload):
+    """Return (index, count, data) for a fragment payload."""
+    index, count = FRAGMENT.unpack_from(payload)
+    return index, count, payload[FRAGMENT.size:]
@@ -0,0 +1,26 @@
+"""
+Link statistics shared by the client's media receivers: the interarrival jitter
+estimate that the audio jitter buffer sizes its delay from and that video receivers
+report back to senders.
+"""
+
+class InterarrivalJitter:
+    """
+    RFC 3550 interarrival jitter: a running mean of how much the transit time (arrival
+    minus the sender's capture timestamp) changes from one packet to the next, in
+    seconds. Sender and receiver clocks differ by a constant, which cancels out in
+    that difference, so the clocks need not be synchronised.
+    """
+    GAIN = 1 / 16
+    
+    def __init__(self):
+        self.seconds = 0.0
+        self.last_transit = None
+    
+    def update(self, timestamp, arrival):
+        """Fold in one packet sent at timestamp (sender clock) and received at arrival; returns the estimate."""
+        transit = arrival - timestamp
+        if self.last_transit is not None:
+            self.seconds += (abs(transit - self.last_transit) - self.seconds) * self.GAIN
+        self.last_transit = transit
+        return self.seconds
@@ -0,0 +1,48 @@
+"""
+Audio codecs: streams encoded chunk after chunk must not click at chunk boundaries.
+"""
+
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from shared.audio_codec import CODECS
+
+BOUNDARY = 4
+
+def tone_signal(chunks):
+    t = np.arange(AUDIO_CHUNK * chunks) / AUDIO_RATE
+    return (8000 * np.sin(2 * np.pi * 300 * t)).astype(np.int16)
+
+def round_trip(codec, signal):
+    """
+    Stream a signal through the codec chunk by chunk, keeping its state; return
+    (original, decoded) lined up for the codec's delay, without the first chunk.
+    """
+    encode_state, decode_state = {}, {}
+    decoded = np.concatenate([
+        np.frombuffer(codec.decode(codec.encode(signal[i:i + AUDIO_CHUNK].tobytes(), encode_state), decode_state),
+                      dtype=np.int16) for i in range(0, len(signal), AUDIO_CHUNK)
+    ]).astype(np.float64)
+    signal = signal.astype(np.float64)
+    delay = min(range(8), key=lambda d: np.abs(decoded[AUDIO_CHUNK + d:] - signal[AUDIO_CHUNK:len(signal) - d]).mean())
+    return signal[AUDIO_CHUNK:len(signal) - delay], decoded[AUDIO_CHUNK + delay:]
+
+def boundary_errors(reference, decoded):
+    """(max error within BOUNDARY samples of a chunk edge, max error elsewhere)."""
+    error = np.abs(reference - decoded)
+    position = np.arange(len(error)) % AUDIO_CHUNK
+    edge = (position < BOUNDARY) | (position >= AUDIO_CHUNK - BOUNDARY)
+    return error[edge].max(), error[~edge].max()
+
+def test_round_trip_keeps_chunk_size():
+    pcm = bytes(AUDIO_CHUNK * 2)
+    for codec in CODECS.values():
+        assert len(codec.decode(codec.encode(pcm, {}), {})) == AUDIO_CHUNK * 2
+
+def test_no_click_at_chunk_boundaries():
+    for codec in CODECS.values():
+        edge, inner = boundary_errors(*round_trip(codec, tone_signal(20)))
+        assert edge <= 1.5 * inner + 1, codec.name
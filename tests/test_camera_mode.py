@@ -0,0 +1,55 @@
+"""
+Capture node camera mode: the webcam follows the controller's rung, with a hold time.
+"""
+
+import cv2
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from client.modules.video_capture_encode import VideoCaptureNode
+from client.modules.bitrate_control import BitrateController
+
+class RecordingCapture:
+    """Stands in for cv2.VideoCapture, recording the size asked for."""
+    
+    def __init__(self):
+        self.modes = []
+        self.props = {}
+    
+    def set(self, prop, value):
+        self.props[prop] = value
+        if prop == cv2.CAP_PROP_FPS:
+            self.modes.append((self.props[cv2.CAP_PROP_FRAME_WIDTH], self.props[cv2.CAP_PROP_FRAME_HEIGHT], value))
+        return True
+
+def camera_node():
+    node = VideoCaptureNode('127.0.0.1', 'test')
+    node.capture = RecordingCapture()
+    node.controller = BitrateController(1920, 1080)
+    node.set_camera_mode(node.controller.ladder[node.controller.rung])
+    return node
+
+def test_camera_opens_at_current_rung():
+    node = camera_node()
+    assert node.capture.modes == [(VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS)]
+    assert node.capture.props[cv2.CAP_PROP_FOURCC] == cv2.VideoWriter_fourcc(*'YUYV')
+
+def test_camera_follows_held_rung():
+    node = camera_node()
+    node.controller.rung += 1
+    node.follow_rung(100.0)
+    node.follow_rung(100.0 + CAMERA_MODE_HOLD / 2)
+    assert len(node.capture.modes) == 1
+    node.follow_rung(100.0 + CAMERA_MODE_HOLD)
+    assert node.capture.modes[-1] == node.controller.ladder[node.controller.rung]
+    assert node.capture.props[cv2.CAP_PROP_FOURCC] == cv2.VideoWriter_fourcc(*'MJPG')
+
+def test_flapping_rung_keeps_camera_mode():
+    node = camera_node()
+    start = node.controller.rung
+    for step in range(20):
+        node.controller.rung = start + step % 2
+        node.follow_rung(100.0 + step)
+    assert len(node.capture.modes) == 1
@@ -0,0 +1,41 @@
+"""
+Server file store: partial uploads.
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from shared.file_io import file_manifest, manifest_id, unpack_chunks
+from server.server_main import CommunicationServer
+
+def test_expire_upload_without_partial_file(tmp_path):
+    server = CommunicationServer(file_store=str(tmp_path))
+    # Dropped before prepare_upload_file opened its partial file
+    server.uploads['f' * 64] = {'file_id': 'f' * 64, 'connection': None, 'touched': 0, 'fd': None,
+                                'path': str(tmp_path / 'missing.part'), 'filename': 'a.bin', 'username': 'alice'}
+    server.expire_partial_uploads(FILE_PARTIAL_TTL + 1)
+    assert server.uploads == {}
+
+class RecordingConnection:
+    def __init__(self):
+        self.sent = []
+    
+    def sendall(self, data):
+        self.sent.append(decode_message(data))
+
+def test_empty_file_is_stored(tmp_path):
+    server = CommunicationServer(file_store=str(tmp_path))
+    server.broadcast_tcp = lambda *args, **kwargs: None
+    connection = RecordingConnection()
+    manifest = file_manifest(None, 0)
+    file_id = manifest_id(manifest)
+    frame = encode_message(MSG_FILE_META, {'filename': 'empty.txt', 'filesize': 0, 'file_id': file_id}, manifest)
+    upload, stored_chunks = server.start_upload(connection, 'alice', user_id('alice'), frame[:HEADER_SIZE],
+                                                frame[HEADER_SIZE:])
+    server.prepare_upload_file(upload, stored_chunks)
+    server.upload_started(connection, upload)
+    assert unpack_chunks(connection.sent[-1]['payload']) == []
+    with open(server.stored_files[file_id]['path'], 'rb') as f:
+        assert f.read() == b''
@@ -0,0 +1,22 @@
+"""
+Interarrival jitter estimate shared by the audio and video receivers.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.stats import InterarrivalJitter
+
+def test_clock_offset_cancels_out():
+    jitter = InterarrivalJitter()
+    for packet in range(50):
+        jitter.update(packet * 0.02, 1000.0 + packet * 0.02)
+    assert jitter.seconds < 1e-9
+
+def test_alternating_delay_converges():
+    jitter = InterarrivalJitter()
+    for packet in range(200):
+        delay = 0.03 if packet % 2 else 0.0
+        jitter.update(packet * 0.02, 5.0 + packet * 0.02 + delay)
+    assert abs(jitter.seconds - 0.03) < 0.001
@@ -0,0 +1,59 @@
+"""
+JitterBuffer playout: late stragglers, re-priming and delay shrinking.
+"""
+
+import time
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from client.modules.jitter_buffer import JitterBuffer
+
+def chunk(seq):
+    """A chunk whose samples all carry its sequence number."""
+    return np.full(AUDIO_CHUNK, seq % 30000 + 1, dtype=np.int16).tobytes()
+
+def played_seq(payload):
+    """The sequence number a popped chunk carries, or None for concealment or comfort noise."""
+    samples = np.frombuffer(payload, dtype=np.int16)
+    value = int(samples[0])
+    if value > 0 and (samples == value).all():
+        return value - 1
+    return None
+
+def push(buffer, seqs):
+    for seq in seqs:
+        buffer.push(seq, time.time(), chunk(seq))
+
+def test_straggler_after_reprime_is_late():
+    buffer = JitterBuffer()
+    # Chunk 50 goes missing and playout moves past it
+    push(buffer, [seq for seq in range(100) if seq != 50])
+    played = [played_seq(buffer.pop()) for _ in range(100 + JITTER_MAX_CONCEAL + 2)]
+    assert 99 in played and buffer.next_seq is None
+    
+    push(buffer, [50])
+    push(buffer, range(200, 210))
+    played = [played_seq(buffer.pop()) for _ in range(5)]
+    assert played == [200, 201, 202, 203, 204]
+    assert buffer.late == 1
+
+def test_restarted_stream_is_played():
+    buffer = JitterBuffer()
+    push(buffer, range(1000, 1010))
+    for _ in range(10):
+        buffer.pop()
+    push(buffer, range(5))
+    assert [played_seq(buffer.pop()) for _ in range(3)] == [0, 1, 2]
+
+def test_burst_shrinks_delay_gradually():
+    buffer = JitterBuffer()
+    push(buffer, range(4))
+    played = [played_seq(buffer.pop()) for _ in range(2)]
+    # A burst of ten chunks arrives at once
+    push(buffer, range(4, 14))
+    played += [played_seq(buffer.pop()) for _ in range(12)]
+    skipped = set(range(14)) - set(played)
+    assert len(skipped) <= 1
@@ -0,0 +1,52 @@
+"""
+ReceiverStats loss accounting.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from client.modules.bitrate_control import ReceiverStats
+
+SENDER = (1, VIDEO_LAYER_FULL)
+FRAME_INTERVAL = 1 / 15
+
+def receive(stats, frame_ids, start, fragments=3):
+    """Deliver every fragment of frame_ids at 15 fps from start; return the time after the last one."""
+    arrival = start
+    for frame_id in frame_ids:
+        for _ in range(fragments):
+            stats.on_fragment(SENDER, frame_id, fragments, 1000, arrival, arrival)
+        arrival += FRAME_INTERVAL
+    return arrival
+
+def losses(stats, now):
+    return [loss for sender_id, loss, _, _ in stats.report(now) if sender_id == SENDER]
+
+def test_clean_stream_has_no_loss():
+    stats = ReceiverStats()
+    end = receive(stats, range(30), 100.0)
+    assert losses(stats, end + 1) == [0.0]
+
+def test_missing_frames_count_as_loss():
+    stats = ReceiverStats()
+    end = receive(stats, [frame_id for frame_id in range(30) if frame_id % 5], 100.0)
+    receive(stats, range(30, 60), end)
+    first = losses(stats, end)
+    second = losses(stats, end + 3)
+    assert 0.15 < first[0] + second[0] < 0.25
+
+def test_stage_off_and_on_is_not_loss():
+    stats = ReceiverStats()
+    end = receive(stats, range(30), 100.0)
+    assert losses(stats, end + 1) == [0.0]
+    # Off stage: the server forwards none of frames 30-74 for three seconds
+    end = receive(stats, range(75, 105), end + 45 * FRAME_INTERVAL)
+    assert losses(stats, end + 1) == [0.0]
+
+def test_stage_switch_within_one_report():
+    stats = ReceiverStats()
+    end = receive(stats, range(10), 100.0)
+    end = receive(stats, range(40, 50), end + 30 * FRAME_INTERVAL)
+    assert losses(stats, end + 1) == [0.0]
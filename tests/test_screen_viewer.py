@@ -0,0 +1,50 @@
+"""
+ScreenViewer loop: idle timeouts must not reprocess old messages.
+"""
+
+import time
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+
+screen_sharing = pytest.importorskip('client.modules.screen_sharing')
+
+class RecordingDisplay:
+    """Stands in for the window display, recording which windows are attached and detached."""
+    
+    def __init__(self):
+        self.attached = []
+        self.detached = []
+    
+    def attach(self, window, render, on_key=None):
+        self.attached.append(window)
+    
+    def detach(self, window):
+        self.detached.append(window)
+
+@pytest.fixture
+def viewer(capsys):
+    display = RecordingDisplay()
+    viewer = screen_sharing.ScreenViewer(display)
+    yield viewer, display, capsys
+    viewer.stop()
+    time.sleep(0.2)
+
+def test_empty_queue_is_idle(viewer):
+    viewer, display, capsys = viewer
+    time.sleep(0.5)
+    assert "[ERROR]" not in capsys.readouterr().out
+    assert display.attached == [] and display.detached == []
+
+def test_start_is_handled_once(viewer):
+    viewer, display, capsys = viewer
+    viewer.receive({'type': MSG_SCREEN_START, 'flags': 0, 'username': 'alice'})
+    # Several idle timeouts after the start message
+    time.sleep(0.6)
+    assert "[ERROR]" not in capsys.readouterr().out
+    assert display.attached == ["Screen - alice"]
+    assert display.detached == []
+    assert viewer.render_screen() is None
@@ -0,0 +1,25 @@
+"""
+Video render node grid: streams that stop are taken off the window.
+"""
+
+import time
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.protocol import *
+from client.modules.video_decode_render import VideoRenderNode
+
+def test_last_stream_timing_out_blanks_the_grid():
+    node = VideoRenderNode('127.0.0.1', 'viewer')
+    frame = np.full((VIDEO_THUMB_SIZE[1], VIDEO_THUMB_SIZE[0], 3), 200, dtype=np.uint8)
+    node.video_streams['alice'] = (frame, VIDEO_LAYER_THUMB, time.monotonic())
+    assert node.render_grid().any()
+    
+    node.video_streams['alice'] = (frame, VIDEO_LAYER_THUMB, time.monotonic() - VIDEO_STREAM_TIMEOUT - 1)
+    blank = node.render_grid()
+    assert blank is not None and not blank.any()
+    # Nothing more to redraw until a stream comes back
+    assert node.render_grid() is None
+    node.decoder.stop()